@@ -12,7 +12,96 @@ from app.core.cookbook_manager import CookbookManager
 from app.core.review_manager import ReviewManager
 
 from app.core.schemas import WeeklyPlan, DayPlan, MealDetail, PantryRecommendations
-from app.core.model_manager import ModelManager
+from app.core.model_manager import ModelManager, TruncatedResponseError
+from app.core.single_flight import FLIGHTS, SupersededError, fingerprint
+
+# How many follow-up requests we make to finish a truncated plan.
+MAX_PLAN_CONTINUATIONS = 3
+
+# Character budget for the pantry section of the planning prompt (~1.5k tokens)
+INVENTORY_PROMPT_CHARS = 6000
+
+# Grocery check results per (user, plan version, pantry version, local_only); oldest dropped first
+GROCERY_CHECK_CACHE_SIZE = 64
+_GROCERY_CHECK_CACHE = {}
+
+def grocery_lines(plan_dict):
+    """[{"id": "<date>-<meal>-<n>", "name": ingredient line}] for every meal of a plan."""
+    lines = []
+    for day in plan_dict.get('days', []):
+        for meal_type in ['breakfast', 'lunch', 'dinner']:
+            meal = day.get(meal_type)
+            if meal:
+                for idx, ing in enumerate(meal['ingredients']):
+                    lines.append({"id": f"{day['date']}-{meal_type}-{idx}", "name": ing})
+    return lines
+
+def grocery_version(plan_dict):
+    """Changes whenever a plan's grocery lines do; identifies which plan a pantry check was for."""
+    return fingerprint(grocery_lines(plan_dict))
+
+def _complete_json_objects(text, pos):
+    """Yields every fully-closed {...} at the top level of an array starting at pos."""
+    depth = 0
+    in_string = False
+    escape = False
+    start = None
+    for i in range(pos, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0 and start is not None:
+                try:
+                    yield json.loads(text[start:i + 1])
+                except ValueError:
+                    pass
+                start = None
+        elif ch == ']' and depth == 0:
+            return
+
+def salvage_partial_plan(text):
+    """Recovers the complete days (and shopping list, if it got that far) from truncated WeeklyPlan JSON."""
+    plan = {"days": [], "shopping_list": [], "summary_message": ""}
+    if not text:
+        return plan
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            plan.update({k: v for k, v in data.items() if v})
+            return plan
+    except ValueError:
+        pass
+
+    days_key = text.find('"days"')
+    if days_key != -1:
+        bracket = text.find('[', days_key)
+        if bracket != -1:
+            plan['days'] = [d for d in _complete_json_objects(text, bracket + 1) if isinstance(d, dict) and d.get('date')]
+
+    list_key = text.find('"shopping_list"')
+    if list_key != -1:
+        bracket = text.find('[', list_key)
+        end = text.find(']', bracket) if bracket != -1 else -1
+        if bracket != -1 and end != -1:
+            try:
+                plan['shopping_list'] = json.loads(text[bracket:end + 1])
+            except ValueError:
+                pass
+    return plan
 
 class ArbyAgent:
     def __init__(self, base_dir, user_id, original_env=None):
@@ -58,7 +147,7 @@ class ArbyAgent:
         self.calendar_manager = CalendarManager(self.user_state_dir)
         
         self.cookbook_manager = CookbookManager(self.user_state_dir, config={}) # Config loaded internally or passed if needed
-        self.review_manager = ReviewManager(self.user_state_dir, model_manager=self.model_manager)
+        self.review_manager = ReviewManager(self.user_state_dir, model_manager=self.model_manager, cookbook_manager=self.cookbook_manager)
         
         # Prepare Mailer with User-Specific Settings
         email_config = prefs.get('email_settings', {})
@@ -122,6 +211,31 @@ class ArbyAgent:
         with open(self.history_file, 'w') as f:
             json.dump(history, f, indent=4)
 
+    def get_planning_slots(self, start_date=None, duration=None):
+        """Returns [(date_str, day_name, [meal_types])] for every scheduled day in the window."""
+        config = self.calendar_manager.load_config()
+
+        # Determine Start Date
+        if start_date:
+            if isinstance(start_date, str):
+                 start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        else:
+             today = datetime.now()
+             start_date = today + timedelta(days=1)
+
+        # Determine Duration
+        days_to_plan = int(duration) if duration else config.get('duration_days', 4)
+
+        slots = []
+        for i in range(days_to_plan):
+            d = start_date + timedelta(days=i)
+            day_name = d.strftime("%A")
+            day_sched = config['schedule'].get(day_name, {})
+            meals_needed = [m for m, active in day_sched.items() if active]
+            if meals_needed:
+                slots.append((d.strftime("%Y-%m-%d"), day_name, meals_needed))
+        return slots
+
     def construct_prompt(self, start_date=None, duration=None):
         """Constructs the system and user prompts based on current state."""
         # Load Preferences
@@ -143,33 +257,13 @@ class ArbyAgent:
         # 1. Sync & Inventory & Config
         inventory_summary = "Not provided."
         if data_ctx.get('use_inventory'):
-            inventory_summary = self.inventory_manager.get_summary()
-        
-        # Get Config
-        config = self.calendar_manager.load_config()
-        
-        # Determine Start Date
-        if start_date:
-            if isinstance(start_date, str):
-                 start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        else:
-             today = datetime.now()
-             start_date = today + timedelta(days=1)
-             
-        # Determine Duration
-        days_to_plan = int(duration) if duration else config.get('duration_days', 4)
+            # Names and amounts by aisle, soon-to-expire items first so a trimmed list still shows what must be used
+            inventory_summary = self.inventory_manager.get_summary("planner", max_chars=INVENTORY_PROMPT_CHARS)
         
-        planning_dates = []
-        days_config_summary = []
-        for i in range(days_to_plan):
-            d = start_date + timedelta(days=i)
-            day_name = d.strftime("%A")
-            date_str = d.strftime("%Y-%m-%d")
-            day_sched = config['schedule'].get(day_name, {})
-            if any(day_sched.values()):
-                planning_dates.append(date_str)
-                meals_needed = [m for m, active in day_sched.items() if active]
-                days_config_summary.append(f"{day_name} ({date_str}): {', '.join(meals_needed)}")
+        days_config_summary = [
+            f"{day_name} ({date_str}): {', '.join(meals_needed)}"
+            for date_str, day_name, meals_needed in self.get_planning_slots(start_date, duration)
+        ]
         
         # User Context
         user_ideas = "No specific cravings."
@@ -225,7 +319,7 @@ class ArbyAgent:
         1. Only fill the meal slots (Breakfast/Lunch/Dinner) requested by the user for each date.
         2. Take inspiration from recipes in the Cookbook Library (provided below) if they fit the schedule and inventory. If you use a library recipe, you can adjust quantities to fit the requested servings.
         3. Obey the User Ideas (provided below) for the plan into account when planning the meals.
-        4. Prioritize using Inventory items (provided below).
+        4. Prioritize using Inventory items (provided below), especially those listed under "Use soon" (days left in brackets) - plan them into the earliest days.
         5. Learn what the user likes based on the Recent History and Cookbook Ratings. Favor recipes with 4 or 5 stars. If a recipe has a low rating (1 or 2 stars), avoid using it unless specifically asked. Do not repeat the same recipes too often.
         """
         
@@ -253,23 +347,113 @@ class ArbyAgent:
         
         # 1. Construct Prompt
         system_instruction, user_prompt = self.construct_prompt(start_date=start_date, duration=duration)
+        slots = self.get_planning_slots(start_date=start_date, duration=duration)
         
         # 7. Call Model Manager
         # Default to Configured Core Model if no model selected
         if not model_id:
             model_id = self.model_manager.get_core_model_id()
-            
-        try:
-            return self.model_manager.generate(
-                model_id=model_id,
-                system_instruction=system_instruction,
-                user_prompt=user_prompt
-            )
-        except Exception as e:
-            return {"error": f"Generation failed: {str(e)}"}
 
-    def modify_plan(self, current_plan, user_feedback, model_id=None):
-        """Modifies an existing plan based heavily on user feedback."""
+        num_slots = sum(len(meals) for _, _, meals in slots)
+
+        def run(cancelled):
+            try:
+                return self.model_manager.generate(
+                    model_id=model_id,
+                    system_instruction=system_instruction,
+                    user_prompt=user_prompt,
+                    max_output_tokens=self.model_manager.plan_output_budget(model_id, num_slots),
+                    call_site="plan",
+                    units=num_slots
+                )
+            except TruncatedResponseError as e:
+                print(f"DEBUG: {e}. Continuing with the missing days only...")
+                return self._continue_truncated_plan(model_id, system_instruction, user_prompt, slots, e.partial_text)
+            except Exception as e:
+                return {"error": f"Generation failed: {str(e)}"}
+
+        # Double-clicks / refreshes with the same inputs share one generation
+        return FLIGHTS.do(self.user_id, "generate_draft", fingerprint(model_id, system_instruction, user_prompt), run)
+
+    def _continue_truncated_plan(self, model_id, system_instruction, user_prompt, slots, partial_text):
+        """Keeps the days that made it out of a truncated response and asks only for the rest."""
+        plan = salvage_partial_plan(partial_text)
+        planned_dates = {d['date'] for d in plan['days']}
+
+        for _ in range(MAX_PLAN_CONTINUATIONS):
+            remaining = [s for s in slots if s[0] not in planned_dates]
+            if not remaining:
+                break
+
+            planned_names = [
+                day[mt]['name'] for day in plan['days'] for mt in ['breakfast', 'lunch', 'dinner']
+                if isinstance(day.get(mt), dict) and day[mt].get('name')
+            ]
+            continuation_prompt = f"""{user_prompt}
+
+        **CONTINUATION - IMPORTANT:**
+        An earlier response already covered part of this schedule. Plan ONLY these remaining days:
+        {chr(10).join([f"- {day_name} ({date_str}): {', '.join(meals)}" for date_str, day_name, meals in remaining])}
+
+        Already planned (do not repeat these dishes): {', '.join(planned_names) or 'None'}
+        - `shopping_list`: only the ingredients needed for the remaining days.
+        - `summary_message`: one short sentence.
+        """
+            remaining_slots = sum(len(m) for _, _, m in remaining)
+            budget = self.model_manager.plan_output_budget(model_id, remaining_slots)
+            try:
+                chunk = self.model_manager.generate(
+                    model_id=model_id,
+                    system_instruction=system_instruction,
+                    user_prompt=continuation_prompt,
+                    max_output_tokens=budget,
+                    call_site="plan_continuation",
+                    units=remaining_slots
+                )
+            except TruncatedResponseError as e:
+                chunk = salvage_partial_plan(e.partial_text)
+            except Exception as e:
+                print(f"DEBUG: Plan continuation failed: {e}")
+                break
+
+            remaining_dates = {s[0] for s in remaining}
+            new_days = [d for d in chunk.get('days', []) if d.get('date') in remaining_dates and d['date'] not in planned_dates]
+            if not new_days:
+                break
+            plan['days'].extend(new_days)
+            planned_dates.update(d['date'] for d in new_days)
+            for item in chunk.get('shopping_list', []):
+                if item not in plan['shopping_list']:
+                    plan['shopping_list'].append(item)
+            if not plan['summary_message']:
+                plan['summary_message'] = chunk.get('summary_message', '')
+
+        if not plan['days']:
+            return {"error": "Generation failed: the model ran out of output tokens before finishing a single day."}
+
+        plan['days'].sort(key=lambda d: d['date'])
+        if not plan['shopping_list']:
+            # Truncated before the list was written; fall back to the per-meal ingredients
+            for day in plan['days']:
+                for mt in ['breakfast', 'lunch', 'dinner']:
+                    meal = day.get(mt)
+                    if isinstance(meal, dict):
+                        for ing in meal.get('ingredients', []):
+                            if ing not in plan['shopping_list']:
+                                plan['shopping_list'].append(ing)
+
+        missing = [s[0] for s in slots if s[0] not in planned_dates]
+        if missing:
+            note = f"(Note: Arby could not finish planning {', '.join(missing)}.)"
+            plan['summary_message'] = f"{plan['summary_message']} {note}".strip()
+        return plan
+
+    def modify_plan(self, current_plan, user_feedback, model_id=None, target="draft"):
+        """Modifies an existing plan based heavily on user feedback.
+
+        target ("draft" or "active") keys the single-flight slot, so editing the draft
+        never supersedes a modification of the active plan.
+        """
         print(f"Modifying Plan with Model: {model_id or 'Default'}...")
         
         # 1. System Instruction - Focused on Modification
@@ -306,14 +490,18 @@ class ArbyAgent:
         if not model_id:
             model_id = self.model_manager.get_core_model_id()
             
-        try:
-            return self.model_manager.generate(
-                model_id=model_id,
-                system_instruction=system_instruction,
-                user_prompt=user_prompt
-            )
-        except Exception as e:
-            return {"error": f"Modification failed: {str(e)}"}
+        def run(cancelled):
+            try:
+                return self.model_manager.generate(
+                    model_id=model_id,
+                    system_instruction=system_instruction,
+                    user_prompt=user_prompt,
+                    call_site="modify_plan"
+                )
+            except Exception as e:
+                return {"error": f"Modification failed: {str(e)}"}
+
+        return FLIGHTS.do(self.user_id, f"modify_plan:{target}", fingerprint(model_id, current_plan, user_feedback), run)
 
     def finalize_plan(self, plan_dict):
         """Saves the plan to calendar, history, and sends email."""
@@ -375,23 +563,50 @@ class ArbyAgent:
         print("Finalization Complete.")
         return True
 
-    def recommend_grocery_checks(self, plan_dict):
-        """Cross-references grocery list with pantry and returns recommended item_ids to skip."""
-        inventory_summary = self.inventory_manager.get_summary()
-        
+    def recommend_grocery_checks(self, plan_dict, local_only=False):
+        """Cross-references grocery list with pantry and returns recommended item_ids to skip.
+
+        Clear hits and misses are settled locally; only the uncertain remainder goes to
+        the Sous Chef, and only with the pantry items it could match. Results are cached
+        per (plan version, pantry version). local_only skips the Sous Chef entirely.
+        """
         # Flatten all ingredients into a list with their IDs
-        flattened_items = []
-        for day in plan_dict['days']:
-            for meal_type in ['breakfast', 'lunch', 'dinner']:
-                meal = day.get(meal_type)
-                if meal:
-                    for idx, ing in enumerate(meal['ingredients']):
-                        item_id = f"{day['date']}-{meal_type}-{idx}"
-                        flattened_items.append({"id": item_id, "name": ing})
-
-        if not flattened_items or "Pantry is empty" in inventory_summary:
+        flattened_items = grocery_lines(plan_dict)
+
+        if not flattened_items:
             return []
 
+        cache_key = (self.user_id, fingerprint(flattened_items), self.inventory_manager.version(), local_only)
+        if cache_key in _GROCERY_CHECK_CACHE:
+            print("DEBUG: Grocery check served from cache.")
+            return list(_GROCERY_CHECK_CACHE[cache_key])
+
+        verdicts = self.inventory_manager.check_lines([i['name'] for i in flattened_items])
+        checks = [item['id'] for item, (verdict, _) in zip(flattened_items, verdicts) if verdict == "have"]
+        uncertain = [(item, ids) for item, (verdict, ids) in zip(flattened_items, verdicts) if verdict == "unsure"]
+        print(f"DEBUG: Grocery check: {len(checks)} in pantry, {len(flattened_items) - len(checks) - len(uncertain)} missing, "
+              f"{len(uncertain)} uncertain{' (skipped)' if local_only else ''}.")
+
+        if uncertain and not local_only:
+            try:
+                checks += self._llm_grocery_checks(uncertain)
+            except SupersededError:
+                print("DEBUG: Grocery check superseded by a newer plan; dropping stale result.")
+                return checks
+            except Exception as e:
+                print(f"Error recommending grocery checks: {e}")
+                return checks
+
+        _GROCERY_CHECK_CACHE[cache_key] = tuple(checks)
+        while len(_GROCERY_CHECK_CACHE) > GROCERY_CHECK_CACHE_SIZE:
+            _GROCERY_CHECK_CACHE.pop(next(iter(_GROCERY_CHECK_CACHE)))
+        return checks
+
+    def _llm_grocery_checks(self, uncertain):
+        """Asks the Sous Chef about [(grocery item, candidate pantry ids)] the local check couldn't settle."""
+        grocery_items = [item for item, _ in uncertain]
+        inventory_summary = self.inventory_manager.subset_summary([i for _, ids in uncertain for i in ids])
+
         system_instruction = """
         You are a meticulous Sous Chef. 
         Your task is to review a user's grocery list against their pantry inventory.
@@ -405,27 +620,59 @@ class ArbyAgent:
         """
         
         user_prompt = f"""
-        **Pantry Inventory:**
+        **Pantry Inventory (possible matches only):**
         {inventory_summary}
         
         **Grocery List:**
-        {json.dumps(flattened_items)}
+        {json.dumps(grocery_items)}
         """
 
-        try:
-            # Use the Sous Chef model if set
-            model_id = self.model_manager.get_sous_chef_model_id()
-            
+        # Use the Sous Chef model if set
+        model_id = self.model_manager.get_sous_chef_model_id()
+        allowed = {item['id'] for item in grocery_items}
+
+        def run(cancelled):
             result = self.model_manager.generate(
                 model_id=model_id,
                 system_instruction=system_instruction,
                 user_prompt=user_prompt,
-                schema=PantryRecommendations
+                schema=PantryRecommendations,
+                call_site="grocery_check",
+                units=len(grocery_items)
             )
-            return result.get('recommended_checks', [])
-        except Exception as e:
-            print(f"Error recommending grocery checks: {e}")
-            return []
+            return [i for i in result.get('recommended_checks', []) if i in allowed]
+
+        return FLIGHTS.do(self.user_id, "recommend_grocery_checks",
+                          fingerprint(model_id, inventory_summary, grocery_items), run)
+
+    def sync_library(self, progress_callback=None, cancel_check=None, sync_state=None):
+        """Runs a cookbook library sync, coalescing duplicate syncs for this user.
+
+        A sync with a different librarian model supersedes (and cancels) the older one.
+        """
+        model_id = self.model_manager.get_librarian_model_id()
+
+        def run(cancelled):
+            return self.cookbook_manager.sync_library(
+                progress_callback=progress_callback,
+                model_id=model_id,
+                model_manager=self.model_manager,
+                cancel_check=lambda: cancelled() or bool(cancel_check and cancel_check()),
+                sync_state=sync_state
+            )
+
+        fp = fingerprint(self.cookbook_manager.library_path, model_id)
+        return FLIGHTS.do(self.user_id, "sync_library", fp, run)
+
+    def sync_library_changes(self, changed, deleted, cancel_check=None):
+        """Ingests just the PDFs the library watcher reported (relpaths); deleted ones orphan their recipes."""
+        return self.cookbook_manager.sync_library(
+            model_id=self.model_manager.get_librarian_model_id(),
+            model_manager=self.model_manager,
+            cancel_check=cancel_check,
+            paths=changed,
+            deleted=deleted
+        )
 
     def run(self):
         """Orchestrates the meal plan generation (Legacy/Background)."""
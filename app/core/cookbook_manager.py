@@ -1,19 +1,154 @@
 import os
+import re
 import json
 import uuid
 import shutil
 import hashlib
 import glob
 import time
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import List, Optional
 from pydantic import BaseModel
 import google.genai as genai
+from app.core.recipe_index import RecipeIndex
+from app.core.rate_limiter import RATE_LIMIT_BACKOFF_SECONDS, is_rate_limit_error, limiter_for
+from app.core.sync_manifest import SyncManifest, classify
+from app.core.recipe_journal import RecipeJournal
+from app.core.recipe_dedupe import DedupeIndex, same_content
+from app.core.recipe_vectors import VectorIndex
+from app.core.pdf_text import PDF_PAGE_TOKENS, extract_text, is_usable
+from app.core.pantry_context import estimate_tokens
+from app.core.model_manager import DEFAULT_LIBRARIAN_MODEL, GenerationCancelled
 
 # --- CONSTANTS ---
 CATEGORIES = ["Breakfast", "Main", "Side", "Dessert", "Drink"]
 PROTEINS = ["Chicken", "Pork", "Beef", "Salmon", "Tuna", "Trout", "Shrimp", "Crab", "Lobster", "Vegetarian", "Vegan"]
 
+# PDFs extracted at once during a library sync (1 = one after another)
+SYNC_WORKERS = int(os.environ.get("ARBY_SYNC_WORKERS", 4))
+SYNC_MAX_RETRIES = 3
+# During sync, journalled recipes are merged into cookbook.json every K recipes or T seconds
+SYNC_CHECKPOINT_RECIPES = int(os.environ.get("ARBY_SYNC_CHECKPOINT_RECIPES", 25))
+SYNC_CHECKPOINT_SECONDS = float(os.environ.get("ARBY_SYNC_CHECKPOINT_SECONDS", 30))
+
+# Shared by the text and upload extraction paths
+PDF_EXTRACTION_PROMPT = """
+Extract the recipe into JSON format.
+
+STRICT TITLE RULES:
+1. Extract the name as a clean, concise title.
+2. Remove subjective adjectives like "Best Ever", "Amazing", "Delicious", "Healthy", "Perfect".
+3. Remove duration indicators like "20 Minute", "30 Min".
+4. Use Title Case. Do NEVER use ALL CAPS.
+
+STRICT CATEGORIZATION RULES:
+1. "category": Must be one of ["Breakfast", "Main", "Side", "Dessert", "Drink"].
+   - "Main" applies to Lunch or Dinner.
+2. "protein": Must be one of ["Chicken", "Pork", "Beef", "Salmon", "Tuna", "Trout", "Shrimp", "Crab", "Lobster", "Vegetarian", "Vegan"].
+   - If multiple meats, pick the dominant one.
+   - If no meat, use "Vegetarian" or "Vegan".
+
+Structure:
+{
+    "name": "Recipe Title",
+    "category": "Main",
+    "protein": "Chicken",
+    "ingredients": ["1 cup flour", ...],
+    "instructions": ["Step 1...", "Step 2..."]
+}
+Only return the JSON.
+"""
+
+# Search indexes cached per cookbook file: path -> (file signature, RecipeIndex)
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+# Near-duplicate (MinHash/LSH) index, cached the same way and guarded by _INDEX_LOCK
+_DEDUPE_CACHE = {}
+# Similarity (vector) indexes: path -> (file signature, VectorIndex). Entries are swapped under
+# _INDEX_LOCK, but synced and queried under each VectorIndex's own lock.
+_VECTOR_CACHE = {}
+# Cookbook files already normalised at this signature (skip the pass on every request)
+_NORMALIZED = {}
+# Journals already replayed by this process (a crash can only have happened before start-up)
+_REPLAYED = set()
+# One sync at a time per cookbook (a full sync waits for a running one; a watcher batch only briefly)
+_SYNC_LOCKS = {}
+_SYNC_LOCKS_GUARD = threading.Lock()
+# Seconds a watcher batch waits for another sync of the same cookbook before giving up
+BATCH_LOCK_WAIT = 5
+
+class SyncInProgress(Exception):
+    """Raised to a watcher batch when another sync of the cookbook is still running."""
+
+# Title fluff removed by clean_title (compiled once; case insensitive)
+_FLUFF_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'\b(?:The )?Best\s+Ever\b',
+    r'\b(?:The )?Best\b',
+    r'\bAmazing\b',
+    r'\bDelicious\b',
+    r'\bHealthy\b',
+    r'\bEasy\b',
+    r'\bSimple\b',
+    r'\bPerfect\b',
+    r'\bWorld\'s Best\b',
+    r'\bAuthentic\b',
+    r'\bQuick\b',
+    r'\d+\s*-?\s*(?:min|minute|hr|hour)s?\b', # "20 Min", "30 Minute"
+    r'\(Leftovers\)',
+    r'\(Modified\)',
+    r'\(Customized\)',
+    r'^Leftover\s+', # "Leftover Chicken" -> "Chicken"
+    r'^Leftovers\s+',
+)]
+_SPACES_RE = re.compile(r'\s+')
+_EDGE_PUNCT_RE = re.compile(r'^\W+|\W+$')
+
+def clean_title(title: str) -> str:
+    """Cleans up recipe titles: removes fluff, fixes casing."""
+    if not title: return "Untitled Recipe"
+    
+    # 1. Fix ALL CAPS
+    if title.isupper():
+        title = title.title()
+        
+    # 2. Remove Fluff Words
+    cleaned = title
+    for pattern in _FLUFF_PATTERNS:
+        cleaned = pattern.sub('', cleaned)
+        
+    # 3. Clean up extra spaces/punctuation/trailing dashes
+    cleaned = _SPACES_RE.sub(' ', cleaned).strip()
+    cleaned = _EDGE_PUNCT_RE.sub('', cleaned) # Trim leading/trailing non-word chars
+    cleaned = cleaned.rstrip('-').strip()
+    
+    # If we stripped everything (e.g. just "Best Ever"), revert to original but Title Case
+    if not cleaned:
+        return title.title()
+        
+    return cleaned
+
+def _format_minutes(minutes):
+    if minutes < 1:
+        return "<1 min"
+    if minutes < 60:
+        return f"{minutes:.0f} min"
+    return f"{minutes // 60:.0f}h {minutes % 60:.0f}m"
+
+def title_key(title: str) -> str:
+    """Lookup form of a title: cleaned, lowercase."""
+    return clean_title(title).lower().strip()
+
 # --- SCHEMA ---
+class ExtractedRecipe(BaseModel):
+    """What the model returns for a PDF; CookbookManager adds id/source/filename."""
+    name: str
+    category: str = "Main"
+    protein: str = "Vegetarian"
+    ingredients: List[str] = []
+    instructions: List[str] = []
+
 class Recipe(BaseModel):
     id: str
     name: str
@@ -22,7 +157,10 @@ class Recipe(BaseModel):
     ingredients: List[str] = []
     instructions: List[str] = []
     source: str = "manual"  # 'manual', 'pdf', 'arby'
-    filename: Optional[str] = None  # Filename if source is pdf
+    filename: Optional[str] = None  # Path inside the library folder if source is pdf
+    content_hash: Optional[str] = None  # SHA-256 of that PDF when it was extracted
+    orphaned: bool = False  # its PDF is no longer in the library folder
+    duplicate_of: Optional[str] = None  # id of the recipe this one looked like a copy of when added
     rating: int = 0 # 0-5 stars
 
 class CookbookManager:
@@ -50,56 +188,41 @@ class CookbookManager:
         # Blacklist for ignored PDFs
         self.blacklist_file = os.path.join(self.state_dir, 'blacklist.json')
 
+        # Recipes extracted by a sync but not yet checkpointed into cookbook.json
+        self.journal = RecipeJournal(os.path.join(self.state_dir, 'cookbook.journal.jsonl'))
+        self._replay_journal()
+
+        # How the last sync's PDFs were read (local text vs upload), see _record_pdf_route
+        self._stats_lock = threading.Lock()
+        self.pdf_text_stats = {"local": 0, "uploaded": 0, "bytes_saved": 0, "tokens_saved": 0}
+        self._text_models = {}  # librarian model id -> model that actually reads PDF text, see _pdf_text_model
+
         # Normalization
         self._normalize_categories()
 
     def _clean_title(self, title: str) -> str:
-        """Cleans up recipe titles: removes fluff, fixes casing."""
-        if not title: return "Untitled Recipe"
-        
-        # 1. Fix ALL CAPS
-        if title.isupper():
-            title = title.title()
-            
-        # 2. Remove Fluff Words (Case Insensitive Regex)
-        fluff_patterns = [
-            r'\b(?:The )?Best\s+Ever\b',
-            r'\b(?:The )?Best\b',
-            r'\bAmazing\b',
-            r'\bDelicious\b',
-            r'\bHealthy\b',
-            r'\bEasy\b',
-            r'\bSimple\b',
-            r'\bPerfect\b',
-            r'\bWorld\'s Best\b',
-            r'\bAuthentic\b',
-            r'\bQuick\b',
-            r'\d+\s*-?\s*(?:min|minute|hr|hour)s?\b', # "20 Min", "30 Minute"
-            r'\(Leftovers\)',
-            r'\(Modified\)',
-            r'\(Customized\)',
-            r'^Leftover\s+', # "Leftover Chicken" -> "Chicken"
-            r'^Leftovers\s+',
-        ]
-        
-        cleaned = title
-        import re
-        for pattern in fluff_patterns:
-            cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
-            
-        # 3. Clean up extra spaces/punctuation/trailing dashes
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        cleaned = re.sub(r'^\W+|\W+$', '', cleaned) # Trim leading/trailing non-word chars
-        cleaned = cleaned.rstrip('-').strip()
-        
-        # If we stripped everything (e.g. just "Best Ever"), revert to original but Title Case
-        if not cleaned:
-            return title.title()
-            
-        return cleaned
+        return clean_title(title)
+
+    def _replay_journal(self):
+        """Merges recipes a crashed sync journalled but never checkpointed (once per process)."""
+        path = os.path.abspath(self.journal.path)
+        if path in _REPLAYED:
+            return
+        _REPLAYED.add(path)
+        merged = self.journal.merge(self.load_recipes, self.save_recipes)
+        if merged:
+            print(f"DEBUG: Replayed {merged} journalled recipe(s) from an interrupted sync.")
+
+    def checkpoint(self):
+        """Folds the sync journal into cookbook.json. Returns the number of recipes merged."""
+        return self.journal.merge(self.load_recipes, self.save_recipes)
 
     def _normalize_categories(self):
         """Fix categories and clean up titles."""
+        path = os.path.abspath(self.cookbook_file)
+        signature = self._signature()
+        if signature is not None and _NORMALIZED.get(path) == signature:
+            return
         recipes = self.load_recipes()
         changed = False
         allowed_categories = set(CATEGORIES)
@@ -144,6 +267,7 @@ class CookbookManager:
         if changed:
             print("DEBUG: Normalized recipe data (Categories & Titles).")
             self.save_recipes(recipes)
+        _NORMALIZED[path] = self._signature()
 
     def load_blacklist(self) -> List[str]:
         if not os.path.exists(self.blacklist_file):
@@ -187,78 +311,147 @@ class CookbookManager:
             return []
 
     def save_recipes(self, recipes: List[dict]):
-        with open(self.cookbook_file, 'w') as f:
-            json.dump(recipes, f, indent=4)
+        """Writes the cookbook and patches a current search index with just the recipes that changed."""
+        path = os.path.abspath(self.cookbook_file)
+        with _INDEX_LOCK:
+            before = self._signature()
+            # Write-then-rename so a crash never leaves a half-written cookbook behind
+            tmp = self.cookbook_file + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(recipes, f, indent=4)
+            os.replace(tmp, self.cookbook_file)
+
+            after = self._signature()
+
+            cached = _DEDUPE_CACHE.get(path)
+            if cached and cached[0] == before:
+                cached[1].sync(recipes)
+                _DEDUPE_CACHE[path] = (after, cached[1])
+            else:
+                _DEDUPE_CACHE.pop(path, None)
+            # The vector index catches up (changed recipes only) on its next query, outside this lock
+
+            cached = _INDEX_CACHE.get(path)
+            if not cached or cached[0] != before:
+                _INDEX_CACHE.pop(path, None)
+                return
+            index = cached[1]
+            kept = set()
+            for recipe in recipes:
+                if 'id' not in recipe:
+                    continue
+                kept.add(recipe['id'])
+                if index.get(recipe['id']) != recipe:
+                    # Copy, so later in-place edits by the caller can't alias the indexed version
+                    index.add(copy.deepcopy(recipe))
+            for recipe_id in [i for i in index.docs if i not in kept]:
+                index.remove(recipe_id)
+            _INDEX_CACHE[path] = (after, index)
+
+    def _signature(self):
+        try:
+            st = os.stat(self.cookbook_file)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get_index(self) -> RecipeIndex:
+        """Search index for this cookbook; rebuilt only when the file changed behind our back."""
+        path = os.path.abspath(self.cookbook_file)
+        with _INDEX_LOCK:
+            signature = self._signature()
+            cached = _INDEX_CACHE.get(path)
+            if cached and cached[0] == signature:
+                return cached[1]
+            start = time.time()
+            index = RecipeIndex(self.load_recipes(), title_key=title_key)
+            _INDEX_CACHE[path] = (signature, index)
+            print(f"DEBUG: Indexed {len(index)} recipes in {(time.time() - start) * 1000:.0f} ms.")
+            return index
+
+    def _dedupe_index(self) -> DedupeIndex:
+        """Near-duplicate index for this cookbook (call with _INDEX_LOCK held)."""
+        path = os.path.abspath(self.cookbook_file)
+        signature = self._signature()
+        cached = _DEDUPE_CACHE.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        start = time.time()
+        index = cached[1] if cached else DedupeIndex(title_key=title_key)
+        index.sync(self.load_recipes())
+        _DEDUPE_CACHE[path] = (signature, index)
+        print(f"DEBUG: Dedupe index ready for {len(index)} recipes in {(time.time() - start) * 1000:.0f} ms.")
+        return index
+
+    def _vector_index(self) -> VectorIndex:
+        """Similarity vectors for this cookbook; only changed recipes are re-vectorised, without _INDEX_LOCK held."""
+        path = os.path.abspath(self.cookbook_file)
+        with _INDEX_LOCK:
+            signature = self._signature()
+            cached = _VECTOR_CACHE.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        start = time.time()
+        index = cached[1] if cached else VectorIndex(self.state_dir)
+        # Signature taken before reading: a write in between only means another sync next time
+        changed = index.sync(self.load_recipes())
+        with _INDEX_LOCK:
+            _VECTOR_CACHE[path] = (signature, index)
+        if changed:
+            print(f"DEBUG: Updated {changed} recipe vector(s) in {(time.time() - start) * 1000:.0f} ms.")
+        return index
+
+    def similar_recipes(self, recipe_id, limit=5) -> List[dict]:
+        """Recipes closest to this one by title and ingredients, each with a 'similarity' (0-1)."""
+        matches = self._vector_index().similar(recipe_id, limit=limit)
+        return [dict(recipe, similarity=round(score, 2)) for recipe, score in matches]
+
+    def recipes_like(self, text, limit=5) -> List[dict]:
+        """Recipes closest to a free-text craving (e.g. a line of ideas.txt), each with a 'similarity'."""
+        if not text or not text.strip():
+            return []
+        matches = self._vector_index().query(text, limit=limit)
+        return [dict(recipe, similarity=round(score, 2)) for recipe, score in matches]
+
+    def find_duplicates(self, recipe: dict, limit=3) -> List[dict]:
+        """Existing recipes that look like the same dish as `recipe`, closest first."""
+        with _INDEX_LOCK:
+            return [match for match, _ in self._dedupe_index().find(recipe, limit=limit)]
+
+    def duplicate_report(self):
+        """Near-duplicate groups across the whole cookbook: [{"recipes": [...], "score": 0-1}].
+
+        Each group lists the copy worth keeping first (highest rated, then most complete).
+        Clustering runs on a snapshot, outside _INDEX_LOCK, so searches aren't held up.
+        """
+        with _INDEX_LOCK:
+            index = self._dedupe_index().copy()
+        groups = index.groups()
+        return [{"recipes": recipes, "score": round(score, 2)} for recipes, score in groups]
+
+    def search_recipes(self, query=None, category=None, protein=None, min_rating=None, limit=None) -> List[dict]:
+        """Ranked recipes matching all query words (prefixes count) and the filters.
+
+        The returned dicts are shared with the index; treat them as read-only.
+        """
+        return self.get_index().search(query, category=category, protein=protein, min_rating=min_rating, limit=limit)
 
     def get_recipe(self, recipe_id):
         recipes = self.load_recipes()
         return next((r for r in recipes if r['id'] == recipe_id), None)
 
     def find_recipe_by_name(self, name):
-        """Finds a recipe by name with fuzzy cleaning/matching."""
+        """Finds a recipe by name with fuzzy cleaning/matching (see RecipeIndex.find_title)."""
         if not name: return None
-        recipes = self.load_recipes()
-        
-        # Clean the input target
-        target = self._clean_title(name).lower().strip()
-        
-        # 0. Check if it's already an ID (unlikely but safe)
-        if len(name) > 30 and '-' in name:
-            for r in recipes:
-                if r['id'] == name: return r
+        return self.get_index().find_title(name)
 
-        # 1. Exact Name Match (case-insensitive)
-        for r in recipes:
-            if r['name'].lower().strip() == target:
-                return r
-                
-        # 2. Cleaned Name Match
-        for r in recipes:
-            if self._clean_title(r['name']).lower().strip() == target:
-                return r
-                
-        # 3. Substring Match: Recipe name is in Target (e.g. Target="Beef Stew (Leftovers)", Recipe="Beef Stew")
-        # Use cleaned versions for both
-        for r in recipes:
-            r_cleaned = self._clean_title(r['name']).lower().strip()
-            if r_cleaned and r_cleaned in target:
-                return r
+    def add_recipe(self, recipe_data: dict, on_duplicate="flag") -> Recipe:
+        """Adds a recipe, checking it against the cookbook for near-duplicates first.
 
-        # 4. Substring Match: Target is in Recipe name
-        for r in recipes:
-            r_cleaned = self._clean_title(r['name']).lower().strip()
-            if target and target in r_cleaned:
-                return r
-
-        # 5. Token overlap (Jaccard) fallback
-        # Useful for things like "Red Lentil Soup" matching "Creamy Red Lentil Soup with Aromatics"
-        best_match = None
-        best_score = 0.0
-        
-        target_tokens = set(target.split())
-        if not target_tokens: return None
-
-        for r in recipes:
-            r_name = self._clean_title(r['name']).lower().strip()
-            r_tokens = set(r_name.split())
-            if not r_tokens: continue
-            
-            intersection = len(target_tokens.intersection(r_tokens))
-            union = len(target_tokens.union(r_tokens))
-            score = intersection / union if union > 0 else 0
-            
-            # Threshold: at least 40% overlap or 2+ shared significant words (length > 3)
-            if score > best_score:
-                best_score = score
-                best_match = r
-        
-        # Checking if match is good enough
-        if best_score > 0.4:
-            return best_match
-            
-        return None
-
-    def add_recipe(self, recipe_data: dict) -> Recipe:
+        on_duplicate: "flag" adds it with duplicate_of set, "merge" folds it into the
+        existing recipe (filling empty fields) and returns that one if both have the same
+        ingredients and steps, flagging it otherwise, "allow" skips the check.
+        """
         recipes = self.load_recipes()
         
         # Ensure ID
@@ -267,11 +460,50 @@ class CookbookManager:
             
         # Validate with Schema (will raise if invalid)
         recipe = Recipe(**recipe_data)
+
+        matches = self.find_duplicates(recipe.model_dump(), limit=1) if on_duplicate != "allow" else []
+        if matches:
+            existing = next((r for r in recipes if r['id'] == matches[0]['id']), None)
+            if existing and on_duplicate == "merge" and same_content(existing, recipe.model_dump()):
+                print(f"DEBUG: '{recipe.name}' looks like '{existing['name']}'; merging instead of adding a copy.")
+                changed = self._merge_into(existing, [recipe.model_dump()])
+                if changed:
+                    self.save_recipes(recipes)
+                return Recipe(**existing)
+            if existing:
+                print(f"DEBUG: '{recipe.name}' looks like '{existing['name']}'; flagged as a duplicate.")
+                recipe.duplicate_of = existing['id']
         
         recipes.append(recipe.model_dump())
         self.save_recipes(recipes)
         return recipe
 
+    @staticmethod
+    def _merge_into(keep: dict, others: List[dict]) -> bool:
+        """Fills keep's empty fields from `others` and takes the best rating. Returns True if keep changed."""
+        before = json.dumps(keep, sort_keys=True)
+        for other in others:
+            for field in ('ingredients', 'instructions'):
+                if not any(line.strip() for line in keep.get(field) or []) and other.get(field):
+                    keep[field] = list(other[field])
+            keep['rating'] = max(keep.get('rating') or 0, other.get('rating') or 0)
+        keep['duplicate_of'] = None
+        return json.dumps(keep, sort_keys=True) != before
+
+    def merge_duplicates(self, keep_id, drop_ids: List[str]):
+        """Keeps one recipe of a duplicate group and deletes the rest (their PDFs are ignored from then on)."""
+        drop_ids = [i for i in drop_ids if i != keep_id]
+        recipes = self.load_recipes()
+        keep = next((r for r in recipes if r['id'] == keep_id), None)
+        if not keep or not drop_ids:
+            return False
+        self._merge_into(keep, [r for r in recipes if r['id'] in drop_ids])
+        for r in recipes:
+            if r.get('duplicate_of') in drop_ids:
+                r['duplicate_of'] = keep_id if r['id'] != keep_id else None
+        self.save_recipes(recipes)
+        return self.batch_delete_recipes(drop_ids)
+
     def update_recipe(self, recipe_id, updates: dict):
         recipes = self.load_recipes()
         for i, r in enumerate(recipes):
@@ -395,14 +627,35 @@ class CookbookManager:
                         shutil.copy2(src, dst)
                 print("Migration complete.")
 
-    def sync_library(self, progress_callback=None, model_id="gemini-1.5-flash", model_manager=None, cancel_check=None):
-        """Scans folder, adds new PDFs, removes missing ones.
+    def sync_library(self, progress_callback=None, model_id=DEFAULT_LIBRARIAN_MODEL, model_manager=None, cancel_check=None, workers=None,
+                     sync_state=None, paths=None, deleted=None):
+        """Scans folder, adds new PDFs, re-extracts edited ones and follows moved ones.
            progress_callback: func(current, total, status_msg)
            model_id: Model to use for extraction
-           model_manager: Agent's ModelManager instance (for non-Gemini models)
+           model_manager: Agent's ModelManager instance (text PDFs go through it, any provider)
            cancel_check: func() -> bool. If true, abort sync.
+           workers: PDFs extracted concurrently (default SYNC_WORKERS; 1 = serial).
+             All workers share the provider's rate limiter and 429 backoff.
+           sync_state: optional SyncState recording the queue and per-file outcomes. Files it
+             already lists as failed (a resumed run) are not retried.
+           paths / deleted: relpaths reported by the library watcher. When given, only these
+             are checked instead of walking the whole folder, and if another sync of this
+             cookbook doesn't finish within BATCH_LOCK_WAIT seconds SyncInProgress is raised
+             rather than holding the caller's worker for the length of that sync.
         """
-        if not self.client:
+        with _SYNC_LOCKS_GUARD:
+            lock = _SYNC_LOCKS.setdefault(os.path.abspath(self.cookbook_file), threading.Lock())
+        incremental = paths is not None or deleted is not None
+        if not lock.acquire(timeout=BATCH_LOCK_WAIT if incremental else -1):
+            raise SyncInProgress(self.cookbook_file)
+        try:
+            return self._sync_library(progress_callback, model_id, model_manager, cancel_check, workers,
+                                      sync_state, paths, deleted)
+        finally:
+            lock.release()
+
+    def _sync_library(self, progress_callback, model_id, model_manager, cancel_check, workers, sync_state, paths, deleted):
+        if not self.client and not (model_manager and self._pdf_text_model(model_id, model_manager)):
             print(f"DEBUG: No API Key found in CookbookManager. Keys: {self.api_key[:5] if self.api_key else 'None'}")
             print("No API Key, skipping AI sync.")
             if progress_callback: progress_callback(0, 0, "Error: No API Key found.")
@@ -418,154 +671,319 @@ class CookbookManager:
         blacklist = self.load_blacklist()
         
         # 1. Get current files
-        # Recursive os.walk
         pdf_files = []
-        for root, dirs, files in os.walk(self.library_path):
-            for file in files:
-                if file.lower().endswith('.pdf'):
-                    pdf_files.append(os.path.join(root, file))
-                
-        filenames = {os.path.basename(f) for f in pdf_files}
+        if paths is not None:
+            # Watcher batch: just the files it reported
+            for relpath in paths:
+                path = os.path.join(self.library_path, relpath)
+                if relpath.lower().endswith('.pdf') and os.path.isfile(path):
+                    pdf_files.append(path)
+        else:
+            # Recursive os.walk
+            for root, dirs, files in os.walk(self.library_path):
+                for file in files:
+                    if file.lower().endswith('.pdf'):
+                        pdf_files.append(os.path.join(root, file))
+
         total_files = len(pdf_files)
-        print(f"Found {total_files} PDF files in library.")
-        
+        print(f"Found {total_files} {'changed ' if paths is not None else ''}PDF files in library.")
+
         if progress_callback:
             progress_callback(0, total_files, f"Found {total_files} PDFs. Checking for new recipes...")
         
-        # 2. Prune recipes pointing to missing files
-        # (Optional: remove recipes whose PDFs are gone? Or keep them manual?)
-        # Current logic: We only add, we don't auto-delete unless explicit.
-        
-        known_filenames = {r.get('filename') for r in recipes if r.get('filename')}
+        # 2. Fingerprint files (only new or touched ones are hashed) and decide
+        # what each one needs. Recipes whose PDFs vanished are kept but marked orphaned.
+        manifest = SyncManifest(self.state_dir)
+        states = manifest.scan(self.library_path, pdf_files, progress=progress_callback,
+                               partial=paths is not None, removed=deleted or ())
+        manifest.save()
+        before = [(r.get('filename'), r.get('content_hash'), r.get('orphaned')) for r in recipes]
+        plan = classify(states, recipes, blacklist, present=set(manifest.files))
+        by_hash = {}
+        for relpath in sorted(manifest.files):
+            by_hash.setdefault(manifest.files[relpath].get('sha256'), relpath)
+        for recipe in recipes:
+            if recipe.get('source') == 'pdf' and recipe.get('filename'):
+                twin = by_hash.get(recipe.get('content_hash')) if recipe['filename'] not in manifest.files else None
+                if twin:
+                    # Another copy of the same PDF is still there (e.g. it was moved and copied, then the copy deleted)
+                    print(f"DEBUG: '{recipe['name']}' now points at {twin} ({recipe['filename']} is gone).")
+                    recipe['filename'] = twin
+                orphaned = recipe['filename'] not in manifest.files
+                if orphaned != bool(recipe.get('orphaned')):
+                    recipe['orphaned'] = orphaned
+                    print(f"DEBUG: '{recipe['name']}' {'lost' if orphaned else 'found'} its PDF ({recipe['filename']}).")
+        print(f"DEBUG: Sync plan: {len(plan['new'])} new, {len(plan['modified'])} modified, "
+              f"{len(plan['moved'])} moved, {len(plan['duplicate'])} duplicate, "
+              f"{len(plan['unchanged'])} unchanged, {len(plan['ignored'])} ignored.")
+        if before != [(r.get('filename'), r.get('content_hash'), r.get('orphaned')) for r in recipes]:
+            # Moves, orphans and first-time hash adoption only touch these fields
+            self.save_recipes(recipes)
 
-        # 3. Ingest new files
+        # 3. Report everything that needs no extraction straight away
         count = 0
-        added_names = []
-        
-        for i, file_path in enumerate(pdf_files):
-            # Check Cancellation
-            if cancel_check and cancel_check():
-                print("DEBUG: Sync Cancelled by User.")
-                if progress_callback: progress_callback(count, total_files, "Cancelled.")
-                return added_names
-
+        for state in plan['ignored']:
             count += 1
-            fname = os.path.basename(file_path)
-            
-            # Skip if blacklisted
-            if fname in blacklist:
-                print(f"Skipping ignored file: {fname}")
-                if progress_callback:
-                    progress_callback(count, total_files, f"Skipping ignored: {fname}")
-                continue
-                
-            if fname not in known_filenames:
-                print(f"New PDF found: {fname}. Extracting data...")
-                if progress_callback:
-                    progress_callback(count, total_files, f"Parsing with AI: {fname}")
-                
-                # RETRY LOOP FOR RATE LIMITS
-                max_retries = 3
-                for attempt in range(max_retries):
+            print(f"Skipping ignored file: {state.relpath}")
+            if progress_callback:
+                progress_callback(count, total_files, f"Skipping ignored: {state.relpath}")
+        for state, recipe in plan['moved']:
+            count += 1
+            print(f"DEBUG: '{recipe['name']}' moved to {state.relpath}")
+            if progress_callback:
+                progress_callback(count, total_files, f"Moved: {state.relpath}")
+        for state, original in plan['duplicate']:
+            count += 1
+            if progress_callback:
+                progress_callback(count, total_files, f"Skipping duplicate: {state.relpath}")
+        for state in plan['unchanged']:
+            count += 1
+            if progress_callback:
+                progress_callback(count, total_files, f"Skipping existing: {state.relpath}")
+
+        # New content gets a new recipe; changed content refreshes the recipe it came from
+        new_files = [(state, None) for state in plan['new']] + list(plan['modified'])
+        if sync_state:
+            # A resumed run doesn't retry files that already failed before the restart
+            failed = sync_state.data["failed"]
+            for state, _ in new_files:
+                if state.relpath in failed:
+                    count += 1
+                    if progress_callback:
+                        progress_callback(count, total_files, f"Skipping failed: {state.relpath}")
+            new_files = [f for f in new_files if f[0].relpath not in failed]
+            sync_state.set_queue(state.relpath for state, _ in new_files)
+
+        # 4. Extract new and modified files on a bounded pool
+        self.pdf_text_stats = {"local": 0, "uploaded": 0, "bytes_saved": 0, "tokens_saved": 0}
+        workers = max(1, int(workers or SYNC_WORKERS))
+        cancelled = lambda: bool(cancel_check and cancel_check())
+        added_names = []
+        started = time.time()
+        processed = 0
+        last_checkpoint = time.time()
+        journalled = 0
+
+        def throughput():
+            minutes = (time.time() - started) / 60
+            if not processed or minutes <= 0:
+                return ""
+            rate = processed / minutes
+            remaining = len(new_files) - processed
+            eta = remaining / rate if rate else 0
+            return f" · {rate:.1f} PDFs/min · ETA {_format_minutes(eta)}" if remaining else f" · {rate:.1f} PDFs/min"
+
+        def ingest(state):
+            """(recipe, None) on success, (None, reason) on failure, (None, None) when cancelled."""
+            for attempt in range(SYNC_MAX_RETRIES):
+                if cancelled():
+                    return None, None
+                try:
+                    recipe = self._extract_recipe_from_pdf(state.path, model_id, model_manager, cancel_check=cancelled)
+                except Exception as e:
+                    if is_rate_limit_error(e):
+                        # The provider's limiter is already paused, so one worker's 429 pauses all of them
+                        print(f"Rate Limit Hit. Pausing all sync workers {RATE_LIMIT_BACKOFF_SECONDS}s...")
+                        if sync_state:
+                            sync_state.retry(state.relpath)
+                        if progress_callback:
+                            progress_callback(count, total_files, f"Rate Limit (Quota). Pausing {RATE_LIMIT_BACKOFF_SECONDS}s...")
+                        continue
+                    # Other error? Log and Skip.
+                    print(f"Failed to parse {state.relpath}: {e}")
+                    return None, str(e)
+                if recipe is None and not cancelled():
+                    return None, "No recipe found in the PDF."
+                return recipe, None
+            return None, f"Still rate limited after {SYNC_MAX_RETRIES} attempts."
+
+        if new_files:
+            print(f"Extracting {len(new_files)} new PDFs with {workers} worker(s).")
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="arby-sync")
+        try:
+            pending = {}
+            queue = list(reversed(new_files))
+            while queue or pending:
+                # Keep at most `workers` files in flight so cancelling leaves little behind
+                while queue and len(pending) < workers and not cancelled():
+                    state, existing = queue.pop()
+                    print(f"{'Changed' if existing else 'New'} PDF found: {state.relpath}. Extracting data...")
+                    if progress_callback:
+                        progress_callback(count, total_files, f"Parsing with AI: {state.relpath}{throughput()}")
+                    pending[pool.submit(ingest, state)] = (state, existing)
+
+                if cancelled() and not pending:
+                    break
+                done, _ = wait(list(pending), timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    state, existing = pending.pop(future)
+                    fname = state.relpath
+                    count += 1
+                    processed += 1
                     try:
-                        extracted = self._extract_recipe_from_pdf(file_path, model_id, model_manager)
-                        if extracted:
-                            extracted['filename'] = fname
-                            extracted['source'] = 'pdf'
-                            extracted['id'] = str(uuid.uuid4())
-                            recipes.append(extracted)
-                            
-                            # SAVE IMMEDIATELY
-                            self.save_recipes(recipes)
-                            
-                            recipe_name = extracted['name']
-                            added_names.append(recipe_name)
-                            print(f"DEBUG: Saved recipe '{recipe_name}' from {fname}")
-                            if progress_callback:
-                                progress_callback(count, total_files, f"Added: {recipe_name}")
-                            
-                            
-                        # Success? Break.
-                        # Also add a small delay to be nice to the API
-                        time.sleep(2) 
-                        break
-                        
+                        recipe, reason = future.result()
                     except Exception as e:
-                        # Check for 429
-                        error_str = str(e)
-                        if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                            wait_time = 60
-                            print(f"Rate Limit Hit. Sleeping {wait_time}s...")
-                            if progress_callback:
-                                progress_callback(count, total_files, f"Rate Limit (Quota). Pausing {wait_time}s...")
-                            time.sleep(wait_time)
-                            # Retry
-                            continue
+                        print(f"Failed to parse {fname}: {e}")
+                        recipe, reason = None, str(e)
+                    if reason and sync_state:
+                        sync_state.fail(fname, reason)
+                    if recipe:
+                        recipe['filename'] = fname
+                        recipe['source'] = 'pdf'
+                        recipe['content_hash'] = state.sha256
+                        if existing is not None:
+                            # Edited PDF: refresh the extracted fields, keep id and rating
+                            recipe['id'] = existing['id']
+                            recipe['rating'] = existing.get('rating', 0)
+                            existing.clear()
+                            existing.update(recipe)
+                            recipe = existing
                         else:
-                            # Other error? Log and Skip.
-                            print(f"Failed to parse {fname}: {e}")
-                            break
-            else:
-                 # Already exists
-                 if progress_callback:
-                    progress_callback(count, total_files, f"Skipping existing: {fname}")
-        
-        self.save_recipes(recipes)
-        print("Sync Complete.")
+                            recipe['id'] = str(uuid.uuid4())
+                            with _INDEX_LOCK:
+                                dedupe = self._dedupe_index()
+                                matches = dedupe.find(recipe, limit=1)
+                                if matches:
+                                    recipe['duplicate_of'] = matches[0][0]['id']
+                                    print(f"DEBUG: {fname} looks like '{matches[0][0]['name']}' already in the cookbook; flagged.")
+                                dedupe.add(recipe)
+                            recipes.append(recipe)
+
+                        # Durable right away, merged into cookbook.json in batches
+                        self.journal.append(recipe)
+                        journalled += 1
+                        if journalled >= SYNC_CHECKPOINT_RECIPES or time.time() - last_checkpoint >= SYNC_CHECKPOINT_SECONDS:
+                            self.checkpoint()
+                            journalled, last_checkpoint = 0, time.time()
+
+                        if sync_state:
+                            sync_state.complete(fname, recipe['name'])
+                        added_names.append(recipe['name'])
+                        print(f"DEBUG: Journalled recipe '{recipe['name']}' from {fname}")
+                        if progress_callback:
+                            progress_callback(count, total_files, f"Added: {recipe['name']}{throughput()}")
+        finally:
+            pool.shutdown(wait=True)
+            # Whatever was extracted so far lands in the cookbook, even on cancel or error
+            self.checkpoint()
+
+        if cancelled():
+            print("DEBUG: Sync Cancelled by User.")
+            if progress_callback: progress_callback(count, total_files, "Cancelled.")
+            return added_names
+
+        stats = self.pdf_text_stats
+        if stats["local"] or stats["uploaded"]:
+            print(f"DEBUG: PDF text pre-pass: {stats['local']} read locally, {stats['uploaded']} needed an upload; "
+                  f"~{stats['bytes_saved'] // 1024} KB and ~{stats['tokens_saved']} page tokens not sent.")
+        print(f"Sync Complete.{throughput()}")
         return added_names
 
-    def _extract_recipe_from_pdf(self, file_path, model_id="gemini-1.5-flash", model_manager=None):
-        """Uses Gemini to parse PDF into structured Recipe."""
+    def _pdf_text_model(self, model_id, model_manager):
+        """Model to send extracted PDF text to: the librarian if it can run, else a usable Gemini model.
+
+        None when neither has a key (PDFs are then uploaded, if there is a Gemini client).
+        """
+        with self._stats_lock:
+            if model_id in self._text_models:
+                return self._text_models[model_id]
+        candidates = [model_id, DEFAULT_LIBRARIAN_MODEL] + \
+                     [m['id'] for m in model_manager.get_available_models() if m['provider'] == 'google']
+        chosen = next((c for c in candidates if model_manager.can_generate(c)), None)
+        if chosen != model_id:
+            print(f"DEBUG: Librarian model '{model_id}' is unknown or has no API key; "
+                  f"{'using ' + chosen if chosen else 'no text model available'} for PDF text.")
+        with self._stats_lock:
+            self._text_models[model_id] = chosen
+        return chosen
+
+    def _extract_recipe_from_pdf(self, file_path, model_id=DEFAULT_LIBRARIAN_MODEL, model_manager=None, cancel_check=None):
+        """Parses a PDF into a Recipe dict (None if cancelled while waiting for a slot).
+
+        Text PDFs are read locally and only their text goes to the librarian model
+        (or a Gemini fallback, see _pdf_text_model), whatever its provider.
+        Scanned/image PDFs are uploaded to Gemini instead.
+        """
         # Note: Exceptions are handled by caller to support rate-limit retries
+        try:
+            text, pages = extract_text(file_path)
+        except Exception as e:
+            print(f"DEBUG: Local text extraction failed for {os.path.basename(file_path)}: {e}")
+            text, pages = "", 0
+
+        text_model = self._pdf_text_model(model_id, model_manager) if model_manager else None
+        if text_model and is_usable(text, pages):
+            try:
+                data = model_manager.generate(
+                    text_model,
+                    PDF_EXTRACTION_PROMPT,
+                    f"Recipe text extracted from a PDF:\n\n{text}",
+                    schema=ExtractedRecipe,
+                    call_site="pdf_extract",
+                    cancel_check=cancel_check
+                )
+            except GenerationCancelled:
+                return None
+            self._record_pdf_route(file_path, text, pages)
+            return Recipe(id=str(uuid.uuid4()), **data).model_dump()
+
+        self._record_pdf_route(file_path, None, pages)
+        if text_model and text_model != model_id and text_model.startswith("gemini"):
+            model_id = text_model  # the librarian can't run; upload with the Gemini model that can
+        return self._extract_recipe_from_upload(file_path, model_id, cancel_check)
+
+    def _record_pdf_route(self, file_path, text, pages):
+        """Logs what the local text pre-pass saved for one PDF and adds it to pdf_text_stats."""
+        name = os.path.basename(file_path)
+        with self._stats_lock:
+            if text is None:
+                self.pdf_text_stats["uploaded"] += 1
+                print(f"DEBUG: {name}: no usable text layer ({pages} page(s)), uploading the PDF.")
+                return
+            size = os.path.getsize(file_path)
+            text_bytes = len(text.encode('utf-8'))
+            # An upload is billed per page image on top of the text the model reads out of it
+            tokens_saved = pages * PDF_PAGE_TOKENS
+            self.pdf_text_stats["local"] += 1
+            self.pdf_text_stats["bytes_saved"] += max(0, size - text_bytes)
+            self.pdf_text_stats["tokens_saved"] += tokens_saved
+        print(f"DEBUG: {name}: sent {text_bytes} B of text instead of a {size} B upload "
+              f"({pages} page(s), ~{estimate_tokens(text)} text tokens, ~{tokens_saved} page tokens saved).")
+
+    def _extract_recipe_from_upload(self, file_path, model_id=DEFAULT_LIBRARIAN_MODEL, cancel_check=None):
+        """Uses Gemini to read an uploaded PDF (for scans with no text layer)."""
+        if not self.client:
+            raise Exception("No usable text layer and no Gemini API key to upload the scan.")
 
         # FAILSAFE: This method uses google.genai SDK which only works with Gemini models
         # If the user selected GPT-4o/Claude as Sous Chef, we must fallback to a Gemini model
         # provided we have the key.
         if not model_id.startswith("gemini"):
-            print(f"DEBUG: Requested non-Gemini model '{model_id}' for PDF Sync. Falling back to gemini-1.5-flash.")
-            model_id = "gemini-1.5-flash"
-        
-        # Upload file using path string (SDK auto-detects mime_type from extension)
-        uploaded_file = self.client.files.upload(file=file_path)
-        
-        prompt = """
-        Extract the recipe from this PDF into JSON format.
-        
-        STRICT TITLE RULES:
-        1. Extract the name as a clean, concise title.
-        2. Remove subjective adjectives like "Best Ever", "Amazing", "Delicious", "Healthy", "Perfect". 
-        3. Remove duration indicators like "20 Minute", "30 Min".
-        4. Use Title Case. Do NEVER use ALL CAPS.
-        
-        STRICT CATEGORIZATION RULES:
-        1. "category": Must be one of ["Breakfast", "Main", "Side", "Dessert", "Drink"]. 
-           - "Main" applies to Lunch or Dinner.
-        2. "protein": Must be one of ["Chicken", "Pork", "Beef", "Salmon", "Tuna", "Trout", "Shrimp", "Crab", "Lobster", "Vegetarian", "Vegan"].
-           - If multiple meats, pick the dominant one.
-           - If no meat, use "Vegetarian" or "Vegan".
-        
-        Structure:
-        {
-            "name": "Recipe Title",
-            "category": "Main",
-            "protein": "Chicken",
-            "ingredients": ["1 cup flour", ...],
-            "instructions": ["Step 1...", "Step 2..."]
-        }
-        Only return the JSON.
-        """
-        
-        response = self.client.models.generate_content(
-            model=model_id,
-            contents=[uploaded_file, prompt],
-            config={
-                'response_mime_type': 'application/json',
-                'response_schema': Recipe
-            }
-        )
-        
+            print(f"DEBUG: Requested non-Gemini model '{model_id}' for PDF upload. Falling back to {DEFAULT_LIBRARIAN_MODEL}.")
+            model_id = DEFAULT_LIBRARIAN_MODEL
+
+        # Same limiter ModelManager.generate uses for Gemini ("google"), so uploads and text calls share one budget
+        limiter = limiter_for("google")
+        if not limiter.acquire(cancel_check=cancel_check):
+            return None
+        try:
+            # Upload file using path string (SDK auto-detects mime_type from extension)
+            uploaded_file = self.client.files.upload(file=file_path)
+            response = self.client.models.generate_content(
+                model=model_id,
+                contents=[uploaded_file, PDF_EXTRACTION_PROMPT],
+                config={
+                    'response_mime_type': 'application/json',
+                    'response_schema': ExtractedRecipe
+                }
+            )
+        except Exception as e:
+            if is_rate_limit_error(e):
+                limiter.backoff(RATE_LIMIT_BACKOFF_SECONDS)
+            raise
+
         if response.parsed:
-            return response.parsed.model_dump()
+            return Recipe(id=str(uuid.uuid4()), **response.parsed.model_dump()).model_dump()
         return None
 
 
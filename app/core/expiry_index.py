@@ -0,0 +1,64 @@
+import bisect
+from datetime import datetime, timedelta
+
+def effective_expiry(item):
+    """YYYY-MM-DD the item should be used by: the printed date, else purchase + estimated shelf life."""
+    if item.get('expiry_date'):
+        return item['expiry_date']
+    days = item.get('expiry_estimate_days')
+    bought = item.get('purchase_date') or item.get('added_on')
+    if days is None or not bought:
+        return None
+    try:
+        return (datetime.strptime(bought, "%Y-%m-%d") + timedelta(days=int(days))).strftime("%Y-%m-%d")
+    except (ValueError, TypeError):
+        return None
+
+class ExpiryIndex:
+    """Pantry item ids kept sorted by effective expiry (bisect on a sorted list).
+
+    Items without any date are tracked separately and always sort last.
+    """
+    def __init__(self, items=None):
+        self.entries = []   # sorted [(date, item_id)]
+        self.dates = {}     # item_id -> date (None for undated)
+        for item_id, item in (items or {}).items():
+            self.dates[item_id] = effective_expiry(item)
+        self.entries = sorted((d, i) for i, d in self.dates.items() if d)
+
+    def set(self, item_id, date):
+        """Adds, moves or removes (date=None) one item; O(log n) search."""
+        old = self.dates.get(item_id)
+        if item_id in self.dates and old == date:
+            return
+        if old:
+            pos = bisect.bisect_left(self.entries, (old, item_id))
+            if pos < len(self.entries) and self.entries[pos] == (old, item_id):
+                del self.entries[pos]
+        self.dates[item_id] = date
+        if date:
+            bisect.insort(self.entries, (date, item_id))
+
+    def remove(self, item_id):
+        self.set(item_id, None)
+        self.dates.pop(item_id, None)
+
+    def apply(self, before, after):
+        """Applies the difference between two {item_id: date} snapshots."""
+        for item_id in before.keys() - after.keys():
+            self.remove(item_id)
+        for item_id, date in after.items():
+            if before.get(item_id, ...) != date or item_id not in self.dates:
+                self.set(item_id, date)
+
+    def expiring_within(self, days, today=None):
+        """[(date, item_id)] for items due within `days` days (already-expired ones included)."""
+        today = today or datetime.now()
+        cutoff = (today + timedelta(days=days)).strftime("%Y-%m-%d")
+        # '￿' sorts after every id, so items dated on the cutoff day are included
+        return self.entries[:bisect.bisect_right(self.entries, (cutoff, "￿"))]
+
+    def ordered_ids(self, order=None):
+        """Every id: soonest expiry first, then undated items (in `order` if given)."""
+        undated = [i for i in (order or self.dates) if i in self.dates and not self.dates[i]]
+        return [i for _, i in self.entries] + undated
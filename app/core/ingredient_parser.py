@@ -0,0 +1,344 @@
+import re
+from fractions import Fraction
+
+# Lines scoring at or above this are trusted without asking the LLM
+CONFIDENCE_THRESHOLD = 0.75
+
+UNICODE_FRACTIONS = {
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
+    "⅕": "1/5", "⅖": "2/5", "⅗": "3/5", "⅘": "4/5", "⅙": "1/6", "⅚": "5/6",
+    "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8",
+}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "half": 0.5, "couple": 2, "dozen": 12,
+}
+
+# alias -> (canonical unit, factor). Canonical units match what the LLM prompt asks for
+# (oz, lb, kg, g, L, ml, ct); US volume measures are converted to metric.
+UNIT_ALIASES = {
+    "oz": ("oz", 1), "ounce": ("oz", 1), "ounces": ("oz", 1),
+    "lb": ("lb", 1), "lbs": ("lb", 1), "pound": ("lb", 1), "pounds": ("lb", 1),
+    "g": ("g", 1), "gr": ("g", 1), "gram": ("g", 1), "grams": ("g", 1),
+    "kg": ("kg", 1), "kgs": ("kg", 1), "kilo": ("kg", 1), "kilos": ("kg", 1), "kilogram": ("kg", 1), "kilograms": ("kg", 1),
+    "l": ("L", 1), "liter": ("L", 1), "liters": ("L", 1), "litre": ("L", 1), "litres": ("L", 1),
+    "ml": ("ml", 1), "milliliter": ("ml", 1), "milliliters": ("ml", 1), "millilitre": ("ml", 1), "millilitres": ("ml", 1),
+    "gal": ("L", 3.785), "gallon": ("L", 3.785), "gallons": ("L", 3.785),
+    "qt": ("L", 0.946), "quart": ("L", 0.946), "quarts": ("L", 0.946),
+    "pt": ("ml", 473), "pint": ("ml", 473), "pints": ("ml", 473),
+    "cup": ("ml", 240), "cups": ("ml", 240), "c": ("ml", 240),
+    "tbsp": ("ml", 15), "tablespoon": ("ml", 15), "tablespoons": ("ml", 15),
+    "tsp": ("ml", 5), "teaspoon": ("ml", 5), "teaspoons": ("ml", 5),
+    "fl oz": ("ml", 29.57), "fluid ounce": ("ml", 29.57), "fluid ounces": ("ml", 29.57),
+    "ct": ("ct", 1), "count": ("ct", 1), "each": ("ct", 1), "ea": ("ct", 1),
+    "pc": ("ct", 1), "pcs": ("ct", 1), "piece": ("ct", 1), "pieces": ("ct", 1),
+}
+
+# Packaging words: the quantity counts packages ("2 cans black beans" -> 2 ct)
+CONTAINERS = {
+    "can", "cans", "jar", "jars", "bag", "bags", "box", "boxes", "bottle", "bottles",
+    "carton", "cartons", "bunch", "bunches", "head", "heads", "clove", "cloves",
+    "pack", "packs", "package", "packages", "pkg", "loaf", "loaves", "stick", "sticks",
+    "tub", "tubs", "block", "blocks", "container", "containers", "tin", "tins",
+    "sleeve", "sleeves", "bar", "bars",
+}
+
+# Whole word matches (case-insensitive) are split off as the brand
+KNOWN_BRANDS = [
+    "Kerrygold", "Barilla", "De Cecco", "Rao's", "Mutti", "Muir Glen", "Heinz", "Kraft",
+    "Tillamook", "Cabot", "Philadelphia", "Land O Lakes", "Chobani", "Fage", "Siggi's",
+    "Stonyfield", "Oikos", "Yoplait", "Dannon", "Horizon", "Organic Valley", "Fairlife",
+    "Silk", "Oatly", "Califia", "Kirkland", "Trader Joe's", "Great Value",
+    "Bob's Red Mill", "King Arthur", "Goya", "Hellmann's", "Duke's", "Daisy", "Oscar Mayer",
+    "Perdue", "Tyson", "Applegate", "Hormel", "Boar's Head", "Hillshire Farm", "Johnsonville",
+    "Jennie-O", "Butterball", "Quaker", "Kellogg's", "General Mills", "Nature's Own",
+    "Dave's Killer Bread", "Pepperidge Farm", "Sara Lee", "Tropicana", "Folgers",
+    "Lavazza", "Starbucks", "Bonne Maman", "Smucker's", "Jif", "Skippy", "Siete",
+    "Old El Paso", "Frank's RedHot", "Huy Fong", "Kikkoman", "Lee Kum Kee", "Maldon",
+    "Morton", "Diamond Crystal", "McCormick", "Birds Eye", "Green Giant", "Del Monte",
+    "Dole", "Driscoll's", "Ben & Jerry's", "Häagen-Dazs", "Ore-Ida",
+]
+
+# Typical shelf life in days (fridge/pantry as usually stored). Longest phrase wins.
+SHELF_LIFE_DAYS = {
+    # Dairy & eggs
+    "milk": 7, "oat milk": 10, "almond milk": 10, "buttermilk": 14, "cream": 10,
+    "heavy cream": 10, "half and half": 10, "sour cream": 14, "cream cheese": 21,
+    "yogurt": 14, "greek yogurt": 14, "butter": 60, "cheese": 30, "cheddar": 30,
+    "parmesan": 90, "mozzarella": 14, "fresh mozzarella": 5, "feta": 21, "ricotta": 7,
+    "cottage cheese": 7, "eggs": 28, "egg": 28,
+    # Meat & fish
+    "chicken": 2, "chicken breast": 2, "chicken thighs": 2, "ground beef": 2, "beef": 3,
+    "steak": 3, "pork": 3, "pork chops": 3, "ground turkey": 2, "turkey": 2, "lamb": 3,
+    "sausage": 3, "bacon": 7, "ham": 5, "deli meat": 5, "salmon": 2, "fish": 2,
+    "shrimp": 2, "tuna": 2, "tofu": 7, "tempeh": 10,
+    # Produce
+    "onion": 30, "onions": 30, "garlic": 60, "shallot": 30, "potato": 30, "potatoes": 30,
+    "sweet potato": 21, "carrot": 21, "carrots": 21, "celery": 14, "lettuce": 5,
+    "spinach": 5, "kale": 7, "arugula": 4, "salad": 4, "broccoli": 5, "cauliflower": 7,
+    "cabbage": 30, "zucchini": 5, "cucumber": 7, "bell pepper": 7, "pepper": 7,
+    "peppers": 7, "jalapeno": 10, "tomato": 5, "tomatoes": 5, "mushroom": 5,
+    "mushrooms": 5, "avocado": 4, "avocados": 4, "lemon": 21, "lemons": 21, "lime": 21,
+    "limes": 21, "apple": 30, "apples": 30, "banana": 5, "bananas": 5, "orange": 21,
+    "oranges": 21, "berries": 4, "strawberries": 4, "blueberries": 7, "raspberries": 3,
+    "grapes": 7, "ginger": 21, "cilantro": 7, "parsley": 7, "basil": 5, "herbs": 7,
+    "green onions": 7, "scallions": 7, "corn": 3, "green beans": 5, "asparagus": 4,
+    # Bakery
+    "bread": 5, "tortillas": 14, "bagels": 5, "buns": 5, "pita": 7,
+    # Pantry staples
+    "rice": 365, "pasta": 365, "spaghetti": 365, "noodles": 365, "flour": 180,
+    "sugar": 730, "brown sugar": 365, "salt": 1825, "oats": 365, "cereal": 180,
+    "quinoa": 365, "lentils": 365, "beans": 365, "black beans": 365, "chickpeas": 365,
+    "olive oil": 540, "oil": 365, "vegetable oil": 365, "vinegar": 730,
+    "soy sauce": 730, "honey": 730, "maple syrup": 365, "peanut butter": 180,
+    "jam": 180, "ketchup": 180, "mustard": 365, "mayonnaise": 60, "mayo": 60,
+    "salsa": 14, "hot sauce": 365, "coffee": 180, "tea": 365, "broth": 365,
+    "stock": 365, "tomato sauce": 365, "crushed tomatoes": 365, "canned tomatoes": 365,
+    "tomato paste": 365, "pasta sauce": 365, "coconut milk": 365, "nuts": 180,
+    "almonds": 180, "walnuts": 180, "chocolate": 365, "baking soda": 540,
+    "baking powder": 540, "yeast": 120, "spices": 730, "cumin": 730, "paprika": 730,
+    "cinnamon": 730, "crackers": 180, "chips": 60,
+    # Frozen
+    "ice cream": 60, "frozen peas": 240, "frozen vegetables": 240,
+}
+
+# Words that turn any item into a long-keeping one
+PRESERVED_WORDS = {"frozen": 180, "canned": 365, "dried": 365}
+
+_NUM = r"(?:\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+)"
+_QTY_RE = re.compile(rf"^(?P<q1>{_NUM})(?:\s*(?:-|–|to)\s*(?P<q2>{_NUM}))?\s*(?:x\s+|×\s*)?")
+_TRAILING_QTY_RE = re.compile(rf"[\s,:\-–]+(?:x\s*)?(?P<q>{_NUM})\s*(?P<unit>[a-z. ]+?)?\s*$")
+_SIZE_PAREN_RE = re.compile(rf"\(\s*(?P<q>{_NUM})\s*-?\s*(?P<unit>[a-z. ]+?)\s*\)")
+_BULLET_RE = re.compile(r"^\s*(?:[-*•·]+|\[\s?[xX]?\s?\])\s*")
+_BY_BRAND_RE = re.compile(r"\s+(?:by|from)\s+(?P<brand>[A-Z0-9][\w&'.\-]*(?:\s+[A-Z0-9][\w&'.\-]*)*)\s*$")
+_BRAND_WORD_RE = re.compile(r"^(?P<brand>.+?)\s+brand\s+", re.IGNORECASE)
+_BRAND_PATTERNS = [
+    (brand, re.compile(r"(?<![\w'])" + re.escape(brand) + r"(?![\w'])", re.IGNORECASE))
+    for brand in sorted(KNOWN_BRANDS, key=len, reverse=True)
+]
+
+def _to_number(text):
+    """'1 1/2' -> 1.5, '3/4' -> 0.75, '.5' -> 0.5"""
+    total = Fraction(0)
+    for part in text.split():
+        total += Fraction(part)
+    return float(total)
+
+def _unit(text):
+    """Canonical (unit, factor) for a unit alias, or None."""
+    if not text:
+        return None
+    return UNIT_ALIASES.get(text.strip().rstrip(".").lower())
+
+def _take_unit(words):
+    """Matches a unit at the front of `words` (two-word aliases first). Returns ((unit, factor), used)."""
+    if len(words) >= 2:
+        found = _unit(f"{words[0]} {words[1]}")
+        if found:
+            return found, 2
+    if words:
+        found = _unit(words[0])
+        if found:
+            return found, 1
+    return None, 0
+
+def shelf_life_days(item):
+    """Typical shelf life for an item name, or None if it is not in the table."""
+    words = re.findall(r"[a-z]+", (item or "").lower())
+    days = None
+    # Longest phrase first so 'sour cream' beats 'cream'
+    for size in (3, 2, 1):
+        for i in range(len(words) - size + 1):
+            phrase = " ".join(words[i:i + size])
+            if phrase in SHELF_LIFE_DAYS:
+                days = SHELF_LIFE_DAYS[phrase]
+                break
+            if size == 1 and phrase.endswith("s") and phrase[:-1] in SHELF_LIFE_DAYS:
+                days = SHELF_LIFE_DAYS[phrase[:-1]]
+                break
+        if days is not None:
+            break
+    for word, preserved in PRESERVED_WORDS.items():
+        if word in words:
+            days = max(days or 0, preserved)
+    return days
+
+def _extract_brand(text):
+    match = _BY_BRAND_RE.search(text)
+    if match:
+        return match.group("brand"), text[:match.start()]
+    match = _BRAND_WORD_RE.match(text)
+    if match:
+        return match.group("brand").strip(), text[match.end():]
+    for brand, pattern in _BRAND_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return brand, (text[:match.start()] + " " + text[match.end():])
+    return None, text
+
+def parse_ingredient_line(line):
+    """Rule-based parse of one grocery line.
+
+    Returns a dict with the Ingredient fields plus 'confidence' (0-1), 'source' ("local")
+    and 'quantity_explicit' (False when the line gave no amount and quantity is the default 1).
+    Lines below CONFIDENCE_THRESHOLD should be handed to the LLM instead.
+    """
+    text = _BULLET_RE.sub("", line or "").strip()
+    for glyph, frac in UNICODE_FRACTIONS.items():
+        text = re.sub(rf"(\d){glyph}", rf"\1 {frac}", text).replace(glyph, frac)
+
+    result = {
+        "item": "", "brand": None, "quantity": 1.0, "unit": "ct",
+        "size_value": None, "size_unit": None, "purchase_date": None,
+        "expiry_date": None, "expiry_estimate_days": None,
+        "confidence": 0.0, "source": "local", "quantity_explicit": False,
+    }
+    if not text:
+        return result
+
+    brand, text = _extract_brand(text)
+    result["brand"] = brand
+    text = re.sub(r"\s+", " ", text.lower()).strip(" ,.;:-")
+
+    # Package size in parentheses: "1 (15 oz) can black beans"
+    size = _SIZE_PAREN_RE.search(text)
+    if size and _unit(size.group("unit")):
+        unit, factor = _unit(size.group("unit"))
+        result["size_value"] = round(_to_number(size.group("q")) * factor, 2)
+        result["size_unit"] = unit
+        text = (text[:size.start()] + " " + text[size.end():]).strip()
+        text = re.sub(r"\s+", " ", text)
+
+    quantity = None
+    unit_info = None
+
+    # Leading quantity: "2", "1 1/2", "2-3", "a dozen", "two"
+    match = _QTY_RE.match(text)
+    if match:
+        quantity = _to_number(match.group("q1"))
+        if match.group("q2"):
+            quantity = (quantity + _to_number(match.group("q2"))) / 2
+        text = text[match.end():]
+    else:
+        words = text.split()
+        if words and words[0] in NUMBER_WORDS:
+            quantity = NUMBER_WORDS[words[0]]
+            words = words[1:]
+            if words and words[0] == "dozen":
+                quantity *= 12
+                words = words[1:]
+            elif words and words[0] == "half" and quantity == 1:
+                quantity = 0.5
+                words = words[1:]
+            text = " ".join(words)
+
+    words = text.split()
+    # Package size without parentheses: "2 16 oz cans tomatoes", "3 12oz bottles"
+    if quantity is not None and len(words) >= 2:
+        size_value = size_unit = None
+        if len(words) >= 3 and re.fullmatch(_NUM, words[0]) and _unit(words[1]) and words[2] in CONTAINERS:
+            size_value, size_unit, words = words[0], words[1], words[2:]
+        else:
+            glued = re.fullmatch(rf"({_NUM})([a-z]+)", words[0])
+            if glued and _unit(glued.group(2)) and words[1] in CONTAINERS:
+                size_value, size_unit, words = glued.group(1), glued.group(2), words[1:]
+        if size_value:
+            unit, factor = _unit(size_unit)
+            result["size_value"] = round(_to_number(size_value) * factor, 2)
+            result["size_unit"] = unit
+
+    if quantity is not None:
+        unit_info, used = _take_unit(words)
+        words = words[used:]
+        if unit_info is None and words and words[0] in CONTAINERS:
+            unit_info = ("ct", 1)
+            words = words[1:]
+        elif unit_info and words and words[0] in CONTAINERS:
+            # "2 lb bag of rice": the measure wins, the package word is noise
+            words = words[1:]
+    elif words and words[0] in CONTAINERS:
+        # "bag of rice": one package
+        quantity = 1
+        unit_info = ("ct", 1)
+        words = words[1:]
+
+    if words and words[0] == "of":
+        words = words[1:]
+    text = " ".join(words)
+
+    # Trailing quantity: "milk 1 gallon", "eggs x12", "chicken breast - 2 lb"
+    if quantity is None:
+        match = _TRAILING_QTY_RE.search(text)
+        if match and (not match.group("unit") or _unit(match.group("unit"))):
+            quantity = _to_number(match.group("q"))
+            unit_info = _unit(match.group("unit")) if match.group("unit") else None
+            text = text[:match.start()]
+
+    item = re.sub(r"\s+", " ", re.sub(r"\([^)]*\)", " ", text)).strip(" ,.;:-")
+    result["item"] = item
+    if not item:
+        return result
+
+    if quantity is not None:
+        factor = unit_info[1] if unit_info else 1
+        result["quantity"] = round(float(quantity) * factor, 2)
+        result["quantity_explicit"] = True
+    if unit_info:
+        result["unit"] = unit_info[0]
+
+    days = shelf_life_days(item)
+    result["expiry_estimate_days"] = days
+
+    # Confidence: how much of the line we actually understood
+    score = 0.4
+    if quantity is not None:
+        score += 0.2
+    if unit_info or (quantity is not None and quantity == int(quantity)):
+        score += 0.1
+    if days is not None:
+        score += 0.3
+    if re.search(r"\d", item):
+        score -= 0.3  # leftover numbers: probably two items or an odd format
+    if re.search(r"\b(and|or|with)\b|&|/", item) and not re.search(r"\b(half and half|mac and cheese)\b", item):
+        score -= 0.2
+    if len(item.split()) > 5:
+        score -= 0.2
+    result["confidence"] = round(max(0.0, min(score, 1.0)), 2)
+    return result
+
+def _looks_like_item(segment):
+    segment = segment.strip().lower()
+    if not segment:
+        return False
+    if _QTY_RE.match(segment) or segment.split()[0] in NUMBER_WORDS:
+        return True
+    return len(segment.split()) <= 4 and shelf_life_days(segment) is not None
+
+def split_ingredient_text(text):
+    """Splits free text into one candidate line per item (newlines, semicolons, item lists with commas)."""
+    lines = []
+    for raw in re.split(r"[\n;]+", text or ""):
+        raw = raw.strip()
+        if not raw:
+            continue
+        segments = [s for s in raw.split(",") if s.strip()]
+        # Only split on commas when every piece reads as an item ("milk, eggs, 2 lb rice"),
+        # not when they are descriptors ("chicken breast, boneless")
+        if len(segments) > 1 and all(_looks_like_item(s) for s in segments):
+            lines.extend(s.strip() for s in segments)
+        else:
+            lines.append(raw)
+    return lines
+
+def parse_ingredient_text(text, threshold=CONFIDENCE_THRESHOLD):
+    """Parses every line locally. Returns (confident_items, uncertain_lines)."""
+    confident, uncertain = [], []
+    for line in split_ingredient_text(text):
+        parsed = parse_ingredient_line(line)
+        if parsed["confidence"] >= threshold:
+            confident.append(parsed)
+        else:
+            uncertain.append(line)
+    return confident, uncertain
@@ -1,8 +1,22 @@
 import json
 import os
+import re
 import time
-from datetime import datetime
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pydantic import BaseModel
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from app.core.ingredient_parser import CONFIDENCE_THRESHOLD, parse_ingredient_line, split_ingredient_text
+from app.core.pantry_matcher import PantryMatchIndex, normalize_tokens, query_name
+from app.core.expiry_index import ExpiryIndex, effective_expiry
+from app.core.units import BASE_UNITS, convert, group_totals, merge_quantities, normalize_bulk
+from app.core import pantry_context
 
 class Ingredient(BaseModel):
     item: str
@@ -20,56 +34,242 @@ class IngredientList(BaseModel):
 
 class ItemToRemoval(BaseModel):
     has_match: bool
-    inventory_index: int | None = None
+    item_id: str | None = None
     reason: str | None = None
 
 class MatchResult(BaseModel):
     has_match: bool
-    inventory_index: int | None = None
+    item_id: str | None = None
+
+class LineMatch(BaseModel):
+    line_index: int
+    item_id: str | None = None
+
+class LineMatchList(BaseModel):
+    matches: list[LineMatch]
+
+# Items due within this many days are "use soon"
+EXPIRING_SOON_DAYS = 3
+
+# Recipe amounts that use a bit of an item rather than a measurable quantity
+# ('2 cloves garlic' must not take two whole garlic heads off the pantry)
+PARTIAL_AMOUNT_RE = re.compile(r"\b(?:cloves?|pinch(?:es)?|dash(?:es)?|sprigs?|leaf|leaves|slices?|splash|drizzle|to taste|as needed|for serving|garnish)\b", re.IGNORECASE)
+# Quantities at or below this are treated as used up
+EMPTY_EPSILON = 0.01
+
+# Bulk imports send uncertain lines to the Sous Chef in chunks of this many, this many at a time
+IMPORT_CHUNK_LINES = 20
+IMPORT_WORKERS = int(os.environ.get("ARBY_IMPORT_WORKERS", 4))
+
+# One lock per inventory file, shared by every (per-request) InventoryManager
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+def _file_lock(path):
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(os.path.abspath(path), threading.RLock())
+
+# Expiry indexes cached per inventory file: path -> (file signature, ExpiryIndex)
+_EXPIRY_CACHE = {}
+
+# Prompt summaries cached per inventory file: path -> (file signature, {(projection, max_chars, day): (text, stats)})
+_SUMMARY_CACHE = {}
+
+def new_item_id():
+    """Short random id for a pantry item (stable across edits and reordering)."""
+    return uuid.uuid4().hex[:12]
 
 class InventoryManager:
+    """Pantry storage.
+
+    inventory.json holds {"version": 2, "items": {id: item}, "order": [id, ...]}.
+    Items are addressed by id, so concurrent edits never shift each other.
+    Old list-shaped files are migrated on first load.
+    """
     def __init__(self, inventory_file, model_manager=None):
         self.inventory_file = inventory_file
         self.model_manager = model_manager
+        self._lock = _file_lock(inventory_file)
+
+    # --- Storage ---
+
+    @contextmanager
+    def _file_guard(self):
+        """Thread lock plus (where available) an advisory lock for other processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.inventory_file)), exist_ok=True)
+            with open(self.inventory_file + ".lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_store(self):
+        if not os.path.exists(self.inventory_file):
+            return {"version": 2, "items": {}, "order": []}
+        with open(self.inventory_file, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            return self._migrate(data)
+        # Repair order drift (ids missing from order, or order entries without an item)
+        items = data.get('items', {})
+        order = [i for i in data.get('order', []) if i in items]
+        order += [i for i in items if i not in set(order)]
+        return {"version": 2, "items": items, "order": order}
+
+    def _migrate(self, rows):
+        """Position-indexed list -> id-keyed store."""
+        store = {"version": 2, "items": {}, "order": []}
+        for row in rows:
+            item_id = row.get('id') or new_item_id()
+            row['id'] = item_id
+            store['items'][item_id] = row
+            store['order'].append(item_id)
+        print(f"DEBUG: Migrated {len(rows)} pantry items to id-keyed storage.")
+        self._write_store(store)
+        return store
+
+    def _write_store(self, store):
+        tmp = self.inventory_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(store, f, indent=4)
+        os.replace(tmp, self.inventory_file)
+
+    def load_store(self):
+        with self._file_guard():
+            return self._read_store()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.inventory_file)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    @contextmanager
+    def mutate(self):
+        """Read-modify-write of the store under the file lock.
+
+        A cached expiry index is patched with just the items whose dates changed;
+        cached prompt summaries are dropped.
+        """
+        with self._file_guard():
+            signature = self._signature()
+            store = self._read_store()
+            before = {i: effective_expiry(item) for i, item in store['items'].items()}
+            yield store
+            self._write_store(store)
+
+            path = os.path.abspath(self.inventory_file)
+            _SUMMARY_CACHE.pop(path, None)
+            cached = _EXPIRY_CACHE.get(path)
+            if cached and cached[0] == signature:
+                after = {i: effective_expiry(item) for i, item in store['items'].items()}
+                cached[1].apply(before, after)
+                _EXPIRY_CACHE[path] = (self._signature(), cached[1])
+            else:
+                _EXPIRY_CACHE.pop(path, None)
+
+    def _expiry_index(self):
+        """(ExpiryIndex, store or None) for the current file; rebuilt only when another writer changed it."""
+        path = os.path.abspath(self.inventory_file)
+        with self._file_guard():
+            signature = self._signature()
+            cached = _EXPIRY_CACHE.get(path)
+            if cached and cached[0] == signature:
+                return cached[1], None
+            store = self._read_store()
+            index = ExpiryIndex(store['items'])
+            _EXPIRY_CACHE[path] = (signature, index)
+            return index, store
+
+    def expiring_within(self, days, today=None):
+        """Items due within `days` days, soonest first, each with 'use_by' and 'days_left'."""
+        index, store = self._expiry_index()
+        due = index.expiring_within(days, today)
+        if not due:
+            return []
+        items = (store or self.load_store())['items']
+        today_str = (today or datetime.now()).strftime("%Y-%m-%d")
+        result = []
+        for date, item_id in due:
+            item = items.get(item_id)
+            if item is None:
+                continue
+            days_left = (datetime.strptime(date, "%Y-%m-%d") - datetime.strptime(today_str, "%Y-%m-%d")).days
+            result.append(dict(item, use_by=date, days_left=days_left))
+        return result
+
+    def _insert(self, store, entry):
+        item_id = entry.get('id') or new_item_id()
+        entry['id'] = item_id
+        store['items'][item_id] = entry
+        store['order'].append(item_id)
+        return item_id
 
     def load_inventory(self):
-        if os.path.exists(self.inventory_file):
-            with open(self.inventory_file, 'r') as f:
-                return json.load(f)
-        return []
+        """Items in display order (each carries its 'id')."""
+        store = self.load_store()
+        return [store['items'][i] for i in store['order']]
 
     def save_inventory(self, items):
-        with open(self.inventory_file, 'w') as f:
-            json.dump(items, f, indent=4)
-
-    def delete_item(self, index):
-        inventory = self.load_inventory()
-        if 0 <= index < len(inventory):
-            del inventory[index]
-            self.save_inventory(inventory)
+        """Replaces the whole pantry with `items` (ids are kept or assigned)."""
+        with self.mutate() as store:
+            store['items'], store['order'] = {}, []
+            for item in items:
+                self._insert(store, item)
+
+    def get_item(self, item_id):
+        return self.load_store()['items'].get(item_id)
+
+    def delete_item(self, item_id):
+        with self.mutate() as store:
+            if item_id not in store['items']:
+                return False
+            del store['items'][item_id]
+            store['order'].remove(item_id)
             return True
-        return False
-
-    def update_item(self, index, data):
-        inventory = self.load_inventory()
-        if 0 <= index < len(inventory):
-            # Preserve fields not in data if needed, or strictly overwrite? 
-            # We'll merge data into existing
-            inventory[index].update(data)
-            self.save_inventory(inventory)
+
+    def update_item(self, item_id, data):
+        with self.mutate() as store:
+            item = store['items'].get(item_id)
+            if item is None:
+                return False
+            # Merge data into existing; the id never changes
+            data = {k: v for k, v in data.items() if k != 'id'}
+            item.update(data)
             return True
-        return False
+
+    def increment_item(self, item_id, amount=1):
+        """Adds `amount` to an item's quantity. Returns the new quantity, or None if it's gone."""
+        with self.mutate() as store:
+            item = store['items'].get(item_id)
+            if item is None:
+                return None
+            item['quantity'] = round(item['quantity'] + amount, 2)
+            item['updated_on'] = datetime.now().strftime("%Y-%m-%d")
+            return item['quantity']
 
     def _title_case(self, s):
         if not s:
             return s
         return " ".join([word.capitalize() for word in s.split()])
 
-    def parse_and_add(self, natural_language_input):
-        """Uses Gemini to parse natural language ingredients into structured JSON."""
-        
+    def _parse_with_llm(self, lines):
+        """One batched Sous Chef call for the lines the local parser was unsure about."""
+        if not lines:
+            return []
+        if not self.model_manager:
+            raise ValueError("ModelManager not initialized in InventoryManager.")
+
+        text = "\n".join(lines)
         prompt = f"""
-        Extract the ingredients from this text: "{natural_language_input}"
+        Extract the ingredients from this text (one per line): 
+        {text}
         
         Rules:
         1. Always capitalize the first letter of each word in 'item' and 'brand' (e.g., "Olive Oil", "Katz Farms").
@@ -79,59 +279,160 @@ class InventoryManager:
         5. If brand is mentioned, extract it.
         """
 
+        model_id = self.model_manager.get_sous_chef_model_id()
+        result = self.model_manager.generate(
+            model_id=model_id,
+            system_instruction=prompt,
+            user_prompt=f"Parse these items:\n{text}",
+            schema=IngredientList,
+            call_site="pantry_parse",
+            units=len(lines)
+        )
+        return [Ingredient(**i).model_dump() for i in result.get('ingredients', [])]
+
+    def _new_entry(self, item):
+        """Inventory row for a parsed ingredient dict."""
+        return {
+            "item": self._title_case(item['item']),
+            "brand": self._title_case(item.get('brand')),
+            "quantity": item['quantity'],
+            "unit": item['unit'].lower() if item.get('unit') else "ct",
+            "size_value": item.get('size_value'),
+            "size_unit": item['size_unit'].lower() if item.get('size_unit') else None,
+            "purchase_date": datetime.now().strftime("%Y-%m-%d"),
+            "expiry_date": item.get('expiry_date'),
+            "expiry_estimate_days": item.get('expiry_estimate_days'),
+            "added_on": datetime.now().strftime("%Y-%m-%d")
+        }
+
+    def _merge_key(self, name):
+        return " ".join(normalize_tokens(name))
+
+    def _consolidate(self, store, only_keys=None):
+        """Merges rows with the same normalised name whose units convert into each other.
+
+        The first row of each name keeps its unit and absorbs the others; rows whose
+        units can't be bridged (e.g. 'bunch', or count vs volume without a hint) stay.
+        Returns the number of rows folded away.
+        """
+        rows = [store['items'][i] for i in store['order']]
+        keys = [self._merge_key(r['item']) for r in rows]
+        dims, base = normalize_bulk([r.get('quantity') or 0 for r in rows], [r.get('unit') or 'ct' for r in rows])
+        totals = group_totals(keys, dims, base)
+
+        keepers = {}
+        for row, key, dim in zip(rows, keys, dims):
+            if dim is not None and (only_keys is None or key in only_keys):
+                keepers.setdefault(key, row)
+
+        absorbed = {}  # (key, dim) -> keeper id, for groups that converted
+        for key, keeper in keepers.items():
+            quantity = 0.0
+            for (group_key, dim), total in totals.items():
+                if group_key != key or dim is None:
+                    continue
+                converted = convert(total, BASE_UNITS[dim], keeper['unit'], keeper['item'])
+                if converted is not None:
+                    quantity += converted
+                    absorbed[(key, dim)] = keeper['id']
+            keeper['quantity'] = round(quantity, 2)
+
+        folded = 0
+        today = datetime.now().strftime("%Y-%m-%d")
+        for row, key, dim in zip(rows, keys, dims):
+            keeper_id = absorbed.get((key, dim))
+            if keeper_id is None or keeper_id == row['id']:
+                continue
+            keeper = store['items'][keeper_id]
+            # Keep the earliest known expiry so nothing goes off unnoticed
+            expiries = [e for e in (keeper.get('expiry_date'), row.get('expiry_date')) if e]
+            if expiries:
+                keeper['expiry_date'] = min(expiries)
+            keeper['updated_on'] = today
+            del store['items'][row['id']]
+            store['order'].remove(row['id'])
+            folded += 1
+        return folded
+
+    def consolidate(self):
+        """Merges duplicate rows across the whole pantry. Returns how many were folded."""
+        with self.mutate() as store:
+            return self._consolidate(store)
+
+    def import_stream(self, natural_language_input, chunk_lines=IMPORT_CHUNK_LINES, workers=IMPORT_WORKERS):
+        """Bulk pantry import that yields progress events as it goes.
+
+        Every line is parsed locally first; the uncertain ones are split into chunks
+        and sent to the Sous Chef concurrently. A chunk that fails is reported and
+        skipped without losing the others. Everything parsed is inserted (and merged
+        with matching rows) in a single write at the end.
+
+        Yields {"stage": "parsed"|"chunk"|"done", ...} dicts; the last one carries
+        "added" and the "failed_lines" that could not be parsed.
+        """
+        lines = split_ingredient_text(natural_language_input)
+        new_items, uncertain = [], []
+        for line in lines:
+            parsed = parse_ingredient_line(line)
+            if parsed['confidence'] >= CONFIDENCE_THRESHOLD:
+                new_items.append(parsed)
+            else:
+                uncertain.append(line)
+        chunks = [uncertain[i:i + chunk_lines] for i in range(0, len(uncertain), chunk_lines)]
+        print(f"DEBUG: Import of {len(lines)} lines: {len(new_items)} parsed locally, "
+              f"{len(uncertain)} sent to the Sous Chef in {len(chunks)} chunks.")
+        failed_lines = []
+        closed = False
         try:
-            # Resolve Model ID (Sous Chef)
-            model_id = self.model_manager.get_sous_chef_model_id() if self.model_manager else "gemini-2.0-flash"
-            
-            # Use ModelManager for generation
-            if not self.model_manager:
-                raise ValueError("ModelManager not initialized in InventoryManager.")
+            yield {"stage": "parsed", "lines": len(lines), "local": len(new_items), "chunks": len(chunks)}
+        except GeneratorExit:
+            closed = True
 
-            result = self.model_manager.generate(
-                model_id=model_id,
-                system_instruction=prompt,
-                user_prompt=f"Parse these items: {natural_language_input}",
-                schema=IngredientList
-            )
-            new_items = result.get('ingredients', [])
-            
-            inventory = self.load_inventory()
-            
-            for item in new_items:
-                item_name = self._title_case(item.item)
-                brand_name = self._title_case(item.brand)
-
-                # Find Match in current inventory
-                match_found = False
-                # Simple name + unit match for efficiency during bulk add, 
-                # or we can use the same LLM logic but LLM for each item in a loop might be slow.
-                # Let's use a simpler heuristic for bulk, or just iterate and use the LLM if we want to be "Arby-smart".
-                
-                # Given we want to be smart:
-                for existing in inventory:
-                    if existing['item'].lower() == item_name.lower() and existing['unit'].lower() == item.unit.lower():
-                        existing['quantity'] += item.quantity
-                        existing['updated_on'] = datetime.now().strftime("%Y-%m-%d")
-                        match_found = True
-                        break
-                
-                if not match_found:
-                    entry = {
-                        "item": item_name,
-                        "brand": brand_name,
-                        "quantity": item.quantity,
-                        "unit": item.unit.lower() if item.unit else "ct",
-                        "size_value": item.size_value,
-                        "size_unit": item.size_unit.lower() if item.size_unit else None,
-                        "purchase_date": datetime.now().strftime("%Y-%m-%d"),
-                        "expiry_date": item.expiry_date,
-                        "expiry_estimate_days": item.expiry_estimate_days,
-                        "added_on": datetime.now().strftime("%Y-%m-%d")
-                    }
-                    inventory.append(entry)
-                
-            self.save_inventory(inventory)
-            return len(new_items)
+        if chunks:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+                futures = {pool.submit(self._parse_with_llm, chunk): n for n, chunk in enumerate(chunks)}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    n = futures[future]
+                    event = {"stage": "chunk", "chunk": n, "completed": done, "chunks": len(chunks)}
+                    try:
+                        parsed = future.result()
+                        new_items.extend(parsed)
+                        event.update(status="ok", parsed=len(parsed))
+                    except Exception as e:
+                        print(f"Error parsing import chunk {n + 1}/{len(chunks)}: {e}")
+                        failed_lines.extend(chunks[n])
+                        event.update(status="failed", error=str(e), lines=chunks[n])
+                    if not closed:
+                        try:
+                            yield event
+                        except GeneratorExit:
+                            # Client went away: finish the import quietly rather than lose it
+                            closed = True
+
+        if new_items:
+            with self.mutate() as store:
+                # Insert everything, then fold rows that name the same ingredient
+                # (converting units where possible) in one vectorised pass
+                touched = set()
+                for item in new_items:
+                    entry = self._new_entry(item)
+                    self._insert(store, entry)
+                    touched.add(self._merge_key(entry['item']))
+                self._consolidate(store, only_keys=touched)
+        if not closed:
+            yield {"stage": "done", "added": len(new_items), "failed_lines": failed_lines}
+
+    def parse_and_add(self, natural_language_input):
+        """Parses natural language ingredients into inventory rows; returns how many were added.
+
+        Runs the bulk import pipeline to completion (see import_stream).
+        """
+        try:
+            added = 0
+            for event in self.import_stream(natural_language_input):
+                if event["stage"] == "done":
+                    added = event["added"]
+            return added
         except Exception as e:
             print(f"Error parsing ingredients: {e}")
             return 0
@@ -139,8 +440,6 @@ class InventoryManager:
     def add_item(self, item_data):
         """Adds a single item manually to the inventory."""
         try:
-            inventory = self.load_inventory()
-            
             # Basic validation/defaults
             entry = {
                 "item": self._title_case(item_data.get('item', 'Unknown Item')),
@@ -154,8 +453,8 @@ class InventoryManager:
                 "added_on": datetime.now().strftime("%Y-%m-%d")
             }
             
-            inventory.append(entry)
-            self.save_inventory(inventory)
+            with self.mutate() as store:
+                self._insert(store, entry)
             return True
         except Exception as e:
             print(f"Error adding manual item: {e}")
@@ -163,124 +462,329 @@ class InventoryManager:
 
     def add_one_smartly(self, ingredient_str):
         """Parses a single ingredient string and either updates existing or adds new."""
-        # 1. Parse it
-        prompt = f"""
-        Extract the ingredient from this text: "{ingredient_str}"
-        Rules:
-        1. Always capitalize the first letter of each word in 'item' and 'brand'.
-        2. Use standardized lowercase units (oz, lb, kg, L, ml, ct).
-        3. Estimate 'expiry_estimate_days'.
-        """
-        
+        # 1. Parse it (locally when the line is unambiguous)
         try:
             model_id = self.model_manager.get_sous_chef_model_id() if self.model_manager else "gemini-2.0-flash"
-            
-            if not self.model_manager:
-                raise ValueError("ModelManager not initialized in InventoryManager.")
 
-            result = self.model_manager.generate(
-                model_id=model_id,
-                system_instruction=prompt,
-                user_prompt=f"Parse: {ingredient_str}",
-                schema=IngredientList
-            )
-            parsed = IngredientList(**result)
-            
-            if not parsed.ingredients:
-                return False, "Could not parse ingredient."
+            parsed = parse_ingredient_line(ingredient_str)
+            if parsed['confidence'] < CONFIDENCE_THRESHOLD:
+                llm_items = self._parse_with_llm([ingredient_str])
+                if not llm_items:
+                    return False, "Could not parse ingredient."
+                parsed = llm_items[0]
             
-            new_item = parsed.ingredients[0]
+            new_item = Ingredient(**{k: parsed.get(k) for k in Ingredient.model_fields})
             new_item.item = self._title_case(new_item.item)
             new_item.brand = self._title_case(new_item.brand)
             
-            inventory = self.load_inventory()
+            items = self.load_store()['items']
             
-            # 2. Find Match
-            match_prompt = f"""
+            # 2. Find Match (locally; only ambiguous names go to the Sous Chef)
+            item_id = None
+            verdict, found = PantryMatchIndex.from_inventory(items).resolve(new_item.item)
+            if verdict == "match":
+                item_id = found
+            elif verdict == "ambiguous":
+                candidate_ids = [key for key, _ in found]
+                match_prompt = f"""
             We are adding this item: "{new_item.item} ({new_item.brand or 'No Brand'})"
-            Does this match any item already in the pantry?
+            Does this match any of these pantry items?
             
-            Inventory:
-            {self.get_summary()}
+            Candidates:
+            {self._candidate_summary(items, candidate_ids)}
             
             Rules:
             1. Only return has_match=true if it's clearly the same ingredient (e.g. 'Onion' and 'Yellow Onion' is a match).
             2. If brand is different but item is common, it's still a match (e.g. 'Whole Milk' vs 'Milk').
+            3. item_id must be one of the bracketed candidate ids.
             """
-            
-            if not self.model_manager:
-                raise ValueError("ModelManager not initialized in InventoryManager.")
+                
+                if not self.model_manager:
+                    raise ValueError("ModelManager not initialized in InventoryManager.")
 
-            result = self.model_manager.generate(
-                model_id=model_id,
-                system_instruction=match_prompt,
-                user_prompt="Analyze",
-                schema=MatchResult
-            )
-            match_result = MatchResult(**result)
+                result = self.model_manager.generate(
+                    model_id=model_id,
+                    system_instruction=match_prompt,
+                    user_prompt="Analyze",
+                    schema=MatchResult,
+                    call_site="pantry_match",
+                    units=len(candidate_ids)
+                )
+                match_result = MatchResult(**result)
+                if match_result.has_match and match_result.item_id in candidate_ids:
+                    item_id = match_result.item_id
             
-            if match_result.has_match and match_result.inventory_index is not None:
-                idx = match_result.inventory_index
-                if 0 <= idx < len(inventory):
-                    existing = inventory[idx]
-                    # Update quantity if units match, otherwise overwrite
-                    if existing['unit'].lower() == new_item.unit.lower():
-                        existing['quantity'] += new_item.quantity
+            with self.mutate() as store:
+                # The item may have been deleted while we were matching; then it's a new add
+                existing = store['items'].get(item_id) if item_id else None
+                if existing:
+                    # Add in the existing row's unit when the units convert, otherwise overwrite
+                    merged = merge_quantities(existing['quantity'], existing['unit'], new_item.quantity, new_item.unit, existing['item'])
+                    if merged is not None:
+                        existing['quantity'] = merged
                     else:
                         existing['quantity'] = new_item.quantity
                         existing['unit'] = new_item.unit.lower()
-                    
                     existing['updated_on'] = datetime.now().strftime("%Y-%m-%d")
-                    self.save_inventory(inventory)
                     return True, f"Updated {existing['item']} in pantry."
-            
-            # 3. Add as new
-            entry = {
-                "item": new_item.item,
-                "brand": new_item.brand,
-                "quantity": new_item.quantity,
-                "unit": new_item.unit.lower() if new_item.unit else "ct",
-                "size_value": new_item.size_value,
-                "size_unit": new_item.size_unit.lower() if new_item.size_unit else None,
-                "purchase_date": datetime.now().strftime("%Y-%m-%d"),
-                "expiry_date": new_item.expiry_date,
-                "expiry_estimate_days": new_item.expiry_estimate_days,
-                "added_on": datetime.now().strftime("%Y-%m-%d")
-            }
-            inventory.append(entry)
-            self.save_inventory(inventory)
+                
+                # 3. Add as new
+                self._insert(store, self._new_entry(new_item.model_dump()))
             return True, f"Added {new_item.item} to pantry."
 
         except Exception as e:
             print(f"Error in add_one_smartly: {e}")
             return False, str(e)
 
-    def get_summary(self):
-        inventory = self.load_inventory()
-        if not inventory:
+    def get_summary(self, projection="planner", max_chars=None):
+        """Compact pantry text for a prompt, memoised until the pantry changes.
+
+        Projections:
+          "planner" - names and amounts grouped by aisle, use-soon items first (planning, grocery checks)
+          "matcher" - one "[id] Name" line per item (prompts that must answer with an id)
+          "full"    - the original one-line-per-item listing
+        max_chars trims the planner text with a count of what was left out.
+        """
+        path = os.path.abspath(self.inventory_file)
+        day = datetime.now().strftime("%Y-%m-%d")
+        key = (projection, max_chars, day)
+        signature = self._signature()
+        cached = _SUMMARY_CACHE.get(path)
+        if cached and cached[0] == signature and key in cached[1]:
+            text, stats = cached[1][key]
+            self._report_summary(projection, stats, cached=True)
+            return text
+
+        index, store = self._expiry_index()
+        store = store or self.load_store()
+        items, order = store['items'], store['order']
+        if not items:
             return "Pantry is empty."
-        return ", ".join([f"[{idx}] {i['quantity']} {i['unit']} of {i['item']} ({i.get('brand', 'No Brand')})" for idx, i in enumerate(inventory)])
+
+        if projection == "matcher":
+            text = pantry_context.matcher_context(items, order)
+        elif projection == "full":
+            text = pantry_context.full_listing(items, order)
+        else:
+            soon = (datetime.now() + timedelta(days=EXPIRING_SOON_DAYS)).strftime("%Y-%m-%d")
+            text = pantry_context.planner_context(items, order, index.dates, soon, max_chars=max_chars)
+
+        baseline = pantry_context.estimate_tokens(pantry_context.full_listing(items, order))
+        tokens = pantry_context.estimate_tokens(text)
+        stats = {"items": len(order), "tokens": tokens, "baseline_tokens": baseline, "tokens_saved": baseline - tokens}
+
+        if not cached or cached[0] != signature:
+            cached = (signature, {})
+            _SUMMARY_CACHE[path] = cached
+        cached[1][key] = (text, stats)
+        self._report_summary(projection, stats, cached=False)
+        return text
+
+    def _report_summary(self, projection, stats, cached):
+        self.last_summary_stats = dict(stats, projection=projection, cached=cached)
+        print(f"DEBUG: Pantry summary ({projection}{', cached' if cached else ''}): "
+              f"{stats['items']} items, ~{stats['tokens']} tokens, ~{stats['tokens_saved']} saved vs full listing.")
+
+    def _candidate_summary(self, items, item_ids):
+        """Matcher projection restricted to a few candidate rows, for escalation prompts."""
+        return pantry_context.matcher_context(items, item_ids)
+
+    def _match_lines_with_llm(self, lines, candidates, items):
+        """One Sous Chef call for every line the local matcher couldn't settle.
+
+        `candidates` maps line index -> candidate ids. Returns {line index: item id}.
+        """
+        if not self.model_manager:
+            raise ValueError("ModelManager not initialized in InventoryManager.")
+        candidate_ids = list(dict.fromkeys(i for ids in candidates.values() for i in ids))
+        numbered = "\n".join(f"{n}. {lines[n]}" for n in candidates)
+        prompt = f"""
+        A user just cooked a meal. For each numbered recipe line, pick the pantry item it used up.
+
+        Recipe lines:
+        {numbered}
+
+        Pantry candidates:
+        {self._candidate_summary(items, candidate_ids)}
+
+        Rules:
+        1. Return one entry per line_index; item_id must be one of the bracketed candidate ids.
+        2. Only match the same ingredient (e.g. 'Onion' and 'Yellow Onion'); 'Peanut Butter' is not 'Butter'.
+        3. If no candidate fits a line, set its item_id to null.
+        """
+        result = self.model_manager.generate(
+            model_id=self.model_manager.get_sous_chef_model_id(),
+            system_instruction=prompt,
+            user_prompt="Analyze",
+            schema=LineMatchList,
+            call_site="pantry_consume",
+            units=len(candidates)
+        )
+        matches = {}
+        for match in LineMatchList(**result).matches:
+            if match.line_index in candidates and match.item_id in candidates[match.line_index]:
+                matches[match.line_index] = match.item_id
+        return matches
+
+    def _line_amount(self, line, item):
+        """How much of `item`, in the item's own unit, a recipe line calls for; None if unmeasurable.
+
+        Lines without an amount ("Kosher salt") are unmeasurable too, not a default of 1.
+        """
+        if PARTIAL_AMOUNT_RE.search(line):
+            return None
+        parsed = parse_ingredient_line(line)
+        if not parsed['quantity_explicit']:
+            return None
+        if (parsed['unit'] or '').lower() == (item['unit'] or '').lower():
+            return parsed['quantity']
+        return convert(parsed['quantity'], parsed['unit'], item['unit'], item['item'])
+
+    def check_lines(self, lines):
+        """Local pantry check for grocery lines: one (verdict, candidate ids) per line.
+
+        "have"    - a clear match with enough left (lines sharing an item draw it down in order),
+                    or a pinch/'to taste'/no amount at all of something that is stocked
+        "missing" - no candidate at all, or a clear match that is measurably short
+        "unsure"  - ambiguous names or amounts that can't be compared; worth asking the Sous Chef
+        """
+        items = self.load_store()['items']
+        if not items:
+            return [("missing", []) for _ in lines]
+        index = PantryMatchIndex.from_inventory(items)
+        left = {}
+        results = []
+        for line in lines:
+            verdict, found = index.resolve(query_name(line))
+            if verdict == "none":
+                results.append(("missing", []))
+                continue
+            if verdict == "ambiguous":
+                results.append(("unsure", [key for key, _ in found]))
+                continue
+            item = items[found]
+            if PARTIAL_AMOUNT_RE.search(line) or not parse_ingredient_line(line)['quantity_explicit']:
+                results.append(("have", [found]))
+                continue
+            needed = self._line_amount(line, item)
+            if needed is None:
+                results.append(("unsure", [found]))
+                continue
+            remaining = left.get(found, item.get('quantity') or 0) - needed
+            left[found] = remaining
+            results.append(("have" if remaining >= -EMPTY_EPSILON else "missing", [found]))
+        return results
+
+    def version(self):
+        """Changes whenever the pantry file does; for caching results derived from it."""
+        return self._signature()
+
+    def subset_summary(self, item_ids):
+        """Planner projection (names and amounts) of just these items."""
+        items = self.load_store()['items']
+        ids = [i for i in dict.fromkeys(item_ids) if i in items]
+        return pantry_context.planner_context(items, ids, {}, "")
+
+    def consume_lines(self, ingredient_lines):
+        """Takes a cooked meal's ingredients off the pantry in one write.
+
+        Lines are matched locally; only ambiguous ones go to the Sous Chef, all in
+        one call. Clear misses are left alone (the ingredient isn't in the pantry).
+        Amounts are converted into each item's unit and subtracted; items that reach
+        zero are removed. Lines whose amount can't be measured against the item
+        ('2 cloves garlic' vs '1 head') or that give no amount ('Kosher salt') leave
+        it untouched and are reported as skipped.
+        Returns {"used": [...], "removed": [...], "skipped": [...], "unmatched": [...]}.
+        """
+        report = {"used": [], "removed": [], "skipped": [], "unmatched": []}
+        lines = [l.strip() for l in ingredient_lines if l and l.strip()]
+        items = self.load_store()['items']
+        if not lines or not items:
+            report["unmatched"] = lines
+            return report
+
+        index = PantryMatchIndex.from_inventory(items)
+        matched, ambiguous = {}, {}
+        for n, line in enumerate(lines):
+            verdict, found = index.resolve(query_name(line))
+            if verdict == "match":
+                matched[n] = found
+            elif verdict == "ambiguous":
+                ambiguous[n] = [key for key, _ in found]
+        if ambiguous:
+            print(f"DEBUG: Matched {len(matched)} of {len(lines)} meal lines locally, asking the Sous Chef about {len(ambiguous)}.")
+            try:
+                matched.update(self._match_lines_with_llm(lines, ambiguous, items))
+            except Exception as e:
+                print(f"Error matching meal lines with the Sous Chef: {e}")
+        report["unmatched"] = [line for n, line in enumerate(lines) if n not in matched]
+
+        with self.mutate() as store:
+            today = datetime.now().strftime("%Y-%m-%d")
+            for n in sorted(matched):
+                line, item = lines[n], store['items'].get(matched[n])
+                if item is None:
+                    # Removed by an earlier line of this meal, or deleted meanwhile
+                    report["unmatched"].append(line)
+                    continue
+                used = self._line_amount(line, item)
+                if used is None:
+                    report["skipped"].append({"line": line, "item": item['item']})
+                    continue
+                remaining = round(item['quantity'] - used, 2)
+                if remaining <= EMPTY_EPSILON:
+                    del store['items'][item['id']]
+                    store['order'].remove(item['id'])
+                    report["removed"].append(item['item'])
+                else:
+                    item['quantity'] = remaining
+                    item['updated_on'] = today
+                    report["used"].append({"line": line, "item": item['item'], "remaining": remaining, "unit": item['unit']})
+        print(f"DEBUG: Consumed meal: {len(report['used'])} reduced, {len(report['removed'])} used up, "
+              f"{len(report['skipped'])} unmeasured, {len(report['unmatched'])} not in pantry.")
+        return report
+
+    def _remove(self, item_id):
+        """Deletes an item by id; returns its name, or None if it was already gone."""
+        with self.mutate() as store:
+            item = store['items'].pop(item_id, None)
+            if item is None:
+                return None
+            store['order'].remove(item_id)
+            return item['item']
 
     def remove_by_recipe_item(self, recipe_ingredient_str):
-        """Uses Gemini to find the best match in inventory and remove it."""
-        inventory = self.load_inventory()
-        if not inventory:
+        """Finds the best pantry match for a recipe ingredient and removes it.
+
+        Clear matches (and clear misses) are decided locally; only ambiguous
+        candidates are shown to the Sous Chef.
+        """
+        items = self.load_store()['items']
+        if not items:
             return False, "Pantry is empty"
 
-        inventory_summary = self.get_summary()
+        verdict, found = PantryMatchIndex.from_inventory(items).resolve(query_name(recipe_ingredient_str))
+        if verdict == "none":
+            return False, "No matching item found in pantry."
+        if verdict == "match":
+            item_name = self._remove(found)
+            if item_name:
+                return True, f"Removed {item_name} from pantry."
+            return False, "No matching item found in pantry."
 
+        candidate_ids = [key for key, _ in found]
         prompt = f"""
         A user is cooking and says they are 'out of' this ingredient from a recipe: "{recipe_ingredient_str}"
         
-        Review the current inventory and find the best match to remove.
+        Review these pantry candidates and find the best match to remove.
         
-        Inventory:
-        {inventory_summary}
+        Candidates:
+        {self._candidate_summary(items, candidate_ids)}
         
         Rules:
-        1. If a clear match exists (even with fuzzy naming like 'Onion' vs 'Yellow Onion'), identify its index.
-        2. If multiple items match, pick the one that is most likely intended (e.g. correct brand or closest quantity).
-        3. If NO match exists in the inventory, set has_match to false.
+        1. If a clear match exists (even with fuzzy naming like 'Onion' vs 'Yellow Onion'), identify its item_id (the bracketed id).
+        2. If multiple items match, pick the one that is most likely intended (e.g. correct brand or most specific name).
+        3. If NO candidate matches, set has_match to false.
         """
 
         try:
@@ -293,16 +797,15 @@ class InventoryManager:
                 model_id=model_id,
                 system_instruction=prompt,
                 user_prompt="Analyze",
-                schema=ItemToRemoval
+                schema=ItemToRemoval,
+                call_site="pantry_remove",
+                units=len(candidate_ids)
             )
             result = ItemToRemoval(**result)
             
-            if result.has_match and result.inventory_index is not None:
-                idx = result.inventory_index
-                if 0 <= idx < len(inventory):
-                    item_name = inventory[idx]['item']
-                    del inventory[idx]
-                    self.save_inventory(inventory)
+            if result.has_match and result.item_id in candidate_ids:
+                item_name = self._remove(result.item_id)
+                if item_name:
                     return True, f"Removed {item_name} from pantry."
             
             return False, result.reason or "No matching item found in pantry."
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+
+# Statuses a job can no longer leave
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+# Lane for job kinds registered without one
+DEFAULT_LANE = "default"
+
+# A running job whose owner stopped heartbeating for this long is assumed dead and requeued
+STALE_AFTER_SECONDS = 90
+HEARTBEAT_SECONDS = 15
+# A job that has gone stale this many times is failed instead of requeued again
+MAX_ATTEMPTS = 3
+# JobContext.cancelled() re-reads the flag at most this often (handlers poll it in tight loops)
+CANCEL_POLL_SECONDS = 1.0
+# Finished jobs are kept this long for the status page, then pruned
+RETENTION_SECONDS = 7 * 24 * 3600
+
+class JobCancelled(Exception):
+    """Raised by a handler (via JobContext.check_cancelled) to stop early."""
+
+class JobFailed(Exception):
+    """Raised by a handler to fail a job with a user-facing message."""
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation checks."""
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def progress(self, percent, message=None):
+        fields = {"progress": int(percent)}
+        if message:
+            fields["message"] = message
+        self.queue._update(self.job_id, **fields)
+
+    def cancelled(self):
+        now = time.time()
+        if not self._cancelled and now - self._checked_at >= CANCEL_POLL_SECONDS:
+            self._checked_at = now
+            job = self.queue.get(self.job_id)
+            self._cancelled = bool(job and job["cancel_requested"])
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+class JobQueue:
+    """Persistent background job queue backed by SQLite (no external broker).
+
+    Handlers are registered per job kind and run on worker threads:
+        handler(user_id, payload, ctx) -> JSON-serialisable result
+    Each kind belongs to a lane with its own workers, so long-running kinds (a
+    library sync can take hours) never hold the workers interactive jobs need.
+    Several processes (gunicorn workers) can share one database; each claims
+    jobs atomically and heartbeats the ones it is running. The database needs a
+    local filesystem (WAL and locking don't work on FUSE mounts such as gcsfuse).
+    """
+    def __init__(self, db_path, workers=2, lane_workers=None):
+        self.db_path = db_path
+        # lane -> worker threads; `workers` is the default lane's share
+        self.lane_workers = {DEFAULT_LANE: max(int(workers), 1)}
+        for lane, count in (lane_workers or {}).items():
+            self.lane_workers[lane] = max(int(count), 1)
+        self.handlers = {}
+        self.lanes = {}     # kind -> lane
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakes = {lane: threading.Event() for lane in self.lane_workers}
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._started = False
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._init_db()
+
+    # --- Storage ---
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress INTEGER DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    cancel_requested INTEGER DEFAULT 0,
+                    owner TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, kind, status)")
+
+    def _row_to_dict(self, row):
+        if not row:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+    # --- Public API ---
+
+    def register(self, kind, handler, lane=DEFAULT_LANE):
+        if lane not in self.lane_workers:
+            raise ValueError(f"Unknown job lane '{lane}'.")
+        self.handlers[kind] = handler
+        self.lanes[kind] = lane
+
+    def enqueue(self, user_id, kind, payload=None, dedupe=True):
+        """Queues a job and returns its id. An identical queued/running job for the user is reused."""
+        payload_json = json.dumps(payload or {}, sort_keys=True)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe:
+                    row = conn.execute(
+                        "SELECT id FROM jobs WHERE user_id = ? AND kind = ? AND payload = ? "
+                        "AND status IN ('queued', 'running') AND cancel_requested = 0",
+                        (user_id, kind, payload_json)
+                    ).fetchone()
+                    if row:
+                        conn.execute("COMMIT")
+                        return row["id"]
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, user_id, kind, payload, status, message, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'queued', 'Waiting for a free chef...', ?, ?)",
+                    (job_id, user_id, kind, payload_json, now, now)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        self._wakes[self.lanes.get(kind, DEFAULT_LANE)].set()
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def cancel(self, job_id):
+        """Cancels a queued job outright; running jobs are flagged and stop at their next checkpoint."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', message = 'Cancelled.', updated_at = ? "
+                "WHERE id = ? AND status = 'queued'", (now, job_id))
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, message = 'Cancelling...', updated_at = ? "
+                "WHERE id = ? AND status = 'running'", (now, job_id))
+        return self.get(job_id)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._prune()
+        for lane, count in self.lane_workers.items():
+            for i in range(count):
+                threading.Thread(target=self._worker_loop, args=(lane,), name=f"arby-job-{lane}-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="arby-job-heartbeat", daemon=True).start()
+        lanes = ", ".join(f"{count} {lane}" for lane, count in self.lane_workers.items())
+        print(f"DEBUG: Job queue started with {lanes} workers ({self.db_path}).")
+
+    # --- Workers ---
+
+    def _prune(self):
+        cutoff = time.time() - RETENTION_SECONDS
+        with self._connect() as conn:
+            conn.execute(
+                f"DELETE FROM jobs WHERE status IN {TERMINAL_STATUSES} AND updated_at < ?", (cutoff,))
+
+    def _requeue_stale(self, conn):
+        stale = time.time() - STALE_AFTER_SECONDS
+        # Jobs that keep dying (e.g. crashing the worker) stop being retried
+        message = f"Stopped after {MAX_ATTEMPTS} interruptions."
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', owner = NULL, message = ?, error = ?, updated_at = ? "
+            "WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?) AND attempts >= ?",
+            (message, message, time.time(), stale, MAX_ATTEMPTS)
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, message = 'Restarting after an interruption...' "
+            "WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+            (stale,)
+        )
+
+    def _lane_filter(self, lane):
+        """SQL condition (and params) selecting the job kinds a lane's workers run."""
+        if lane == DEFAULT_LANE:
+            # Also picks up kinds this process has no handler for, so they fail visibly
+            others = [kind for kind, l in self.lanes.items() if l != DEFAULT_LANE]
+            if not others:
+                return "1 = 1", ()
+            return f"kind NOT IN ({', '.join('?' * len(others))})", tuple(others)
+        kinds = [kind for kind, l in self.lanes.items() if l == lane]
+        return f"kind IN ({', '.join('?' * len(kinds))})", tuple(kinds)
+
+    def _claim(self, lane=DEFAULT_LANE):
+        condition, params = self._lane_filter(lane)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._requeue_stale(conn)
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE status = 'queued' AND {condition} ORDER BY created_at LIMIT 1",
+                    params).fetchone()
+                if row:
+                    now = time.time()
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, message = 'Working...', "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?", (self.owner, now, now, row["id"]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row_to_dict(row)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._running_lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    with self._connect() as conn:
+                        conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?",
+                                     (time.time(), job_id, self.owner))
+                except Exception as e:
+                    print(f"DEBUG: Job heartbeat failed for {job_id}: {e}")
+
+    def _worker_loop(self, lane=DEFAULT_LANE):
+        wake = self._wakes[lane]
+        while True:
+            try:
+                job = self._claim(lane)
+            except Exception as e:
+                print(f"DEBUG: Job claim failed: {e}")
+                job = None
+            if not job:
+                wake.wait(timeout=2)
+                wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job["id"]
+        handler = self.handlers.get(job["kind"])
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            if not handler:
+                raise JobFailed(f"No handler registered for job kind '{job['kind']}'.")
+            result = handler(job["user_id"], job["payload"], JobContext(self, job_id))
+            self._update(job_id, status="done", progress=100, message="Done!", result=json.dumps(result))
+        except JobCancelled:
+            self._update(job_id, status="cancelled", message="Cancelled.")
+        except JobFailed as e:
+            self._update(job_id, status="failed", message=str(e), error=str(e))
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status="failed", message=f"Error: {e}", error=traceback.format_exc())
+        finally:
+            with self._running_lock:
+                self._running.discard(job_id)
@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# Quiet period before a burst of events is reported (a multi-file copy arrives as one batch)
+DEBOUNCE_SECONDS = 2.0
+# How often the polling fallback re-stats the folder
+POLL_SECONDS = 30.0
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (then the name)
+
+def _load_libc():
+    """libc with inotify bound, or None off Linux / without inotify."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def _is_pdf(name):
+    return name.lower().endswith('.pdf')
+
+def snapshot(library_path):
+    """relpath -> (size, mtime_ns) for every PDF under the folder."""
+    files = {}
+    for root, dirs, names in os.walk(library_path):
+        for name in names:
+            if not _is_pdf(name):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, library_path).replace(os.sep, '/')] = (st.st_size, st.st_mtime_ns)
+    return files
+
+class LibraryWatcher:
+    """Watches a library folder and reports PDFs that changed or went away, in debounced batches.
+
+    Uses inotify (through ctypes) on Linux and falls back to polling size/mtime
+    elsewhere, when inotify can't be set up, or when mode="poll" (network mounts
+    such as GCS don't deliver inotify events). Runs on a daemon thread and calls
+        on_changes(changed, deleted, rescan)
+    with sets of relative paths; rescan=True means events were lost and a full
+    sync is needed. on_ready(files), if given, is called once with the first
+    snapshot() so the caller can catch up on changes made while nothing watched.
+    """
+    def __init__(self, library_path, on_changes, mode="auto", debounce=DEBOUNCE_SECONDS, poll_interval=POLL_SECONDS,
+                 on_ready=None):
+        self.library_path = library_path
+        self.on_changes = on_changes
+        self.on_ready = on_ready
+        self.mode = mode
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.backend = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._changed, self._deleted = set(), set()
+        self._last_event = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="arby-library-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # --- Batching ---
+
+    def _mark(self, relpath, deleted=False):
+        if deleted:
+            self._changed.discard(relpath)
+            self._deleted.add(relpath)
+        else:
+            self._deleted.discard(relpath)
+            self._changed.add(relpath)
+        self._last_event = time.time()
+
+    def _flush(self, rescan=False):
+        changed, deleted = self._changed, self._deleted
+        self._changed, self._deleted = set(), set()
+        if not (changed or deleted or rescan):
+            return
+        print(f"DEBUG: Library watcher ({self.backend}): {len(changed)} changed, {len(deleted)} deleted"
+              f"{', rescan needed' if rescan else ''} in {self.library_path}")
+        try:
+            self.on_changes(changed, deleted, rescan)
+        except Exception as e:
+            print(f"DEBUG: Library watcher callback failed: {e}")
+
+    def _ready(self, files):
+        if not self.on_ready:
+            return
+        try:
+            self.on_ready(files)
+        except Exception as e:
+            print(f"DEBUG: Library watcher start-up check failed: {e}")
+
+    def _due(self):
+        return (self._changed or self._deleted) and time.time() - self._last_event >= self.debounce
+
+    # --- Backends ---
+
+    def _run(self):
+        libc = _load_libc() if self.mode != "poll" else None
+        if libc is not None:
+            try:
+                self._run_inotify(libc)
+                return
+            except OSError as e:
+                print(f"DEBUG: inotify unavailable for {self.library_path} ({e}); polling instead.")
+        self._run_poll()
+
+    def _run_inotify(self, libc):
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.backend = "inotify"
+        dirs = {}   # wd -> directory relpath ('' for the root)
+        known = set()
+
+        def add_tree(rel_dir):
+            """Watches a directory and everything below it; returns the PDFs found there."""
+            found = []
+            top = os.path.join(self.library_path, rel_dir) if rel_dir else self.library_path
+            for root, subdirs, names in os.walk(top):
+                rel_root = os.path.relpath(root, self.library_path).replace(os.sep, '/')
+                rel_root = '' if rel_root == '.' else rel_root
+                wd = libc.inotify_add_watch(fd, os.fsencode(root), WATCH_MASK)
+                if wd < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.ENOSPC:
+                        raise OSError(err, "inotify watch limit reached")
+                    continue
+                dirs[wd] = rel_root
+                found.extend(f"{rel_root}/{n}" if rel_root else n for n in names if _is_pdf(n))
+            return found
+
+        def drop_tree(rel_dir):
+            prefix = rel_dir + '/'
+            for wd, path in list(dirs.items()):
+                if path == rel_dir or path.startswith(prefix):
+                    libc.inotify_rm_watch(fd, wd)
+                    dirs.pop(wd, None)
+            return [p for p in known if p.startswith(prefix)]
+
+        try:
+            add_tree('')
+            # Taken once the watches are in place, so nothing falls between it and the events
+            files = snapshot(self.library_path)
+            known = set(files)
+            self._ready(files)
+            while not self._stop.is_set():
+                timeout = self.debounce if (self._changed or self._deleted) else 1.0
+                readable, _, _ = select.select([fd], [], [], timeout)
+                if readable:
+                    try:
+                        data = os.read(fd, 64 * 1024)
+                    except BlockingIOError:
+                        data = b""
+                    offset = 0
+                    while offset + _EVENT.size <= len(data):
+                        wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                        raw = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                        offset += _EVENT.size + length
+                        if mask & IN_Q_OVERFLOW:
+                            known = set(snapshot(self.library_path))
+                            self._flush(rescan=True)
+                            continue
+                        if mask & IN_IGNORED:
+                            dirs.pop(wd, None)
+                            continue
+                        parent = dirs.get(wd)
+                        if parent is None:
+                            continue
+                        if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and parent == '':
+                            raise OSError(errno.ENOENT, "library folder removed or moved")
+                        name = os.fsdecode(raw)
+                        if not name:
+                            continue
+                        relpath = f"{parent}/{name}" if parent else name
+                        if mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO):
+                                for path in add_tree(relpath):
+                                    known.add(path)
+                                    self._mark(path)
+                            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                                for path in drop_tree(relpath):
+                                    known.discard(path)
+                                    self._mark(path, deleted=True)
+                        elif _is_pdf(name):
+                            # IN_CREATE alone is a file still being written; wait for the close
+                            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                                known.add(relpath)
+                                self._mark(relpath)
+                            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                                known.discard(relpath)
+                                self._mark(relpath, deleted=True)
+                if self._due():
+                    self._flush()
+        finally:
+            os.close(fd)
+        self._flush()
+
+    def _run_poll(self):
+        self.backend = "poll"
+        reported = snapshot(self.library_path) if os.path.isdir(self.library_path) else {}
+        if os.path.isdir(self.library_path):
+            self._ready(dict(reported))
+        last = dict(reported)
+        while not self._stop.wait(self.poll_interval):
+            if not os.path.isdir(self.library_path):
+                continue  # unmounted for now; don't report everything as deleted
+            current = snapshot(self.library_path)
+            for relpath, sig in current.items():
+                # Only report files that looked the same on two polls in a row (not mid-copy)
+                if reported.get(relpath) != sig and last.get(relpath) == sig:
+                    reported[relpath] = sig
+                    self._mark(relpath)
+            for relpath in [p for p in reported if p not in current]:
+                del reported[relpath]
+                self._mark(relpath, deleted=True)
+            last = current
+            self._flush()
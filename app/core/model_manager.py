@@ -1,6 +1,8 @@
 import os
 import json
 import time
+import threading
+from types import MappingProxyType
 import google.genai as genai
 try:
     from openai import OpenAI
@@ -11,6 +13,173 @@ try:
 except ImportError:
     Anthropic = None
 from app.core.schemas import WeeklyPlan
+from app.core.usage_manager import UsageManager
+from app.core.replay_provider import ReplayProvider
+from app.core.rate_limiter import is_rate_limit_error, limiter_for
+
+# --- OUTPUT BUDGETS ---
+# Fallback ceiling when a caller does not size the output itself.
+DEFAULT_MAX_OUTPUT_TOKENS = 8192
+
+# Known output ceilings (longest matching prefix wins). Anthropic is kept below
+# the SDK's non-streaming threshold.
+MODEL_OUTPUT_LIMITS = {
+    "gemini-3": 65536,
+    "gemini-2.5": 65536,
+    "gemini-2.0": 8192,
+    "claude-": 16384,
+    "gpt-5": 128000,
+    "gpt-4.1": 32768,
+    "gpt-4o": 16384,
+}
+
+# Rough cost of one meal slot (recipe + its share of the shopping list) and the
+# fixed overhead of a plan (summary message, JSON scaffolding).
+PLAN_TOKENS_BASE = 1024
+PLAN_TOKENS_PER_SLOT = 800
+
+# --- MODEL REGISTRY ---
+# Built-in models; model_config.json can hide these or add custom ones.
+DEFAULT_MODELS = [
+    # Google
+    {"id": "gemini-3-pro-preview", "name": "Gemini 3 Pro (Preview)", "provider": "google", "top_pick": True, "recommended": True, "description": "Deep Reasoning. The smartest model available.", "default_cost_in": 2.00, "default_cost_out": 12.00},
+    {"id": "gemini-3-flash-preview", "name": "Gemini 3 Flash (Preview)", "provider": "google", "recommended": True, "description": "High Speed Agent. Smartest 'fast' model.", "default_cost_in": 0.50, "default_cost_out": 3.00},
+    {"id": "gemini-2.5-flash", "name": "Gemini 2.5 Flash", "provider": "google", "description": "The perfect balance of smarts & speed for Arby.", "default_cost_in": 0.30, "default_cost_out": 2.50},
+    {"id": "gemini-2.5-flash-lite", "name": "Gemini 2.5 Flash-Lite", "provider": "google", "description": "Bulk Processing. Great for large PDF libraries.", "default_cost_in": 0.10, "default_cost_out": 0.40},
+    {"id": "gemini-2.5-pro", "name": "Gemini 2.5 Pro", "provider": "google", "description": "Complex Logic. Use if Flash fails.", "default_cost_in": 1.25, "default_cost_out": 10.00},
+    {"id": "gemini-2.0-flash", "name": "Gemini 2.0 Flash", "provider": "google", "description": "Reliability. The 'old reliable' from late 2025.", "default_cost_in": 0.10, "default_cost_out": 0.40},
+
+    # Anthropic
+    {"id": "claude-opus-4-5-20251101", "name": "Claude 4.5 Opus", "provider": "anthropic", "recommended": True, "top_pick": True, "description": "The absolute peak of Claude architecture.", "default_cost_in": 15.00, "default_cost_out": 75.00},
+    {"id": "claude-sonnet-4-5-20250929", "name": "Claude 4.5 Sonnet", "provider": "anthropic", "recommended": True, "description": "Ultra-fast, ultra-smart creative partner.", "default_cost_in": 3.00, "default_cost_out": 15.00},
+    {"id": "claude-haiku-4-5-20251001", "name": "Claude 4.5 Haiku", "provider": "anthropic", "description": "Fast and intelligent ultra-efficient model.", "default_cost_in": 0.25, "default_cost_out": 1.25},
+    
+    # OpenAI
+    {"id": "gpt-5", "name": "GPT-5", "provider": "openai", "recommended": True, "top_pick": True, "description": "The current flagship from OpenAI.", "default_cost_in": 5.00, "default_cost_out": 15.00},
+    {"id": "gpt-5-mini", "name": "GPT-5 Mini", "provider": "openai", "description": "Fast and smart miniature flagship.", "default_cost_in": 0.30, "default_cost_out": 1.20},
+    {"id": "gpt-4.1", "name": "GPT-4.1", "provider": "openai", "description": "Reliable legacy flagship.", "default_cost_in": 2.50, "default_cost_out": 10.00},
+    {"id": "gpt-4o", "name": "GPT-4o", "provider": "openai", "recommended": True, "description": "Standard multimodal model.", "default_cost_in": 2.50, "default_cost_out": 10.00},
+    {"id": "o1", "name": "OpenAI o1", "provider": "openai", "description": "Reasoning & coding specialist.", "default_cost_in": 15.00, "default_cost_out": 60.00},
+    {"id": "o3", "name": "OpenAI o3", "provider": "openai", "description": "Next-gen reasoning model.", "default_cost_in": 3.00, "default_cost_out": 12.00},
+    {"id": "o3-mini", "name": "OpenAI o3-mini", "provider": "openai", "description": "Reasoning speedster.", "default_cost_in": 1.10, "default_cost_out": 4.40},
+    {"id": "o4-mini", "name": "OpenAI o4-mini", "provider": "openai", "description": "Efficient next-gen reasoning.", "default_cost_in": 0.50, "default_cost_out": 2.00},
+    
+    # xAI
+    {"id": "grok-4-1-fast-reasoning", "name": "Grok 4.1 Fast", "provider": "xai", "recommended": True, "top_pick": True, "description": "Advanced reasoning from xAI.", "default_cost_in": 5.00, "default_cost_out": 20.00},
+    {"id": "grok-4-0709", "name": "Grok 4", "provider": "xai", "recommended": True, "description": "Latest xAI frontier model.", "default_cost_in": 5.00, "default_cost_out": 20.00},
+    {"id": "grok-3", "name": "Grok 3", "provider": "xai", "description": "Stable Grok flagship.", "default_cost_in": 2.00, "default_cost_out": 10.00},
+    {"id": "grok-3-mini", "name": "Grok 3 Mini", "provider": "xai", "description": "Efficient Grok model.", "default_cost_in": 0.50, "default_cost_out": 2.00},
+    {"id": "grok-2-vision-1212", "name": "Grok 2 Vision", "provider": "xai", "description": "Visual intelligence from Grok.", "default_cost_in": 2.00, "default_cost_out": 10.00},
+]
+
+# Role defaults when the user has not picked a model
+DEFAULT_SOUS_CHEF_MODEL = 'gemini-1.5-flash'
+DEFAULT_LIBRARIAN_MODEL = 'gemini-2.5-flash-lite'
+
+class ModelRegistry:
+    """Immutable snapshot of one user's visible models, keyed by id.
+
+    Built from DEFAULT_MODELS plus model_config.json (hidden ids, custom models,
+    cost overrides, health, role assignments) and the set of configured keys.
+    `version` increases every time the snapshot is rebuilt.
+    """
+    def __init__(self, models, signature, version):
+        self.models = tuple(models)
+        self.by_id = MappingProxyType({m["id"]: m for m in self.models})
+        self.signature = signature
+        self.version = version
+
+    def get(self, model_id):
+        return self.by_id.get(model_id)
+
+    def stale(self):
+        """Same snapshot with a signature that never matches, forcing the next lookup to rebuild."""
+        return ModelRegistry(self.models, object(), self.version)
+
+    @classmethod
+    def build(cls, config, keys, signature, version, safe_float):
+        hidden = set(config.get('hidden_ids', []))
+        saved_costs = config.get('costs', {})
+        health_status = config.get('health', {})
+        core_model = config.get('core_model', 'gemini-2.5-flash') # Updated default to match new list
+        sous_chef_model = config.get('sous_chef_model', DEFAULT_SOUS_CHEF_MODEL)
+        librarian_model = config.get('librarian_model', DEFAULT_LIBRARIAN_MODEL)
+
+        # Filter hidden
+        active_models = [dict(m) for m in DEFAULT_MODELS if m['id'] not in hidden]
+
+        # Add Custom
+        for c in config.get('custom_models', []):
+            c = dict(c)
+            c['is_custom'] = True # Flag for UI to allow deletion
+            active_models.append(c)
+
+        entries = []
+        for m in active_models:
+            mid = m['id']
+            # Locked Status
+            provider = m["provider"]
+            if provider == 'custom':
+                 has_own_key = bool(m.get('api_key'))
+                 has_default_key = bool(keys.get('openai'))
+                 m["locked"] = not (has_own_key or has_default_key)
+            else:
+                m["locked"] = not bool(keys.get(provider))
+
+            # Cost Rates
+            cost_entry = saved_costs.get(mid, {})
+            user_in = cost_entry.get('in') if isinstance(cost_entry, dict) else None
+            user_out = cost_entry.get('out') if isinstance(cost_entry, dict) else None
+
+            m['cost_in'] = safe_float(user_in, m.get('default_cost_in', 0.0))
+            m['cost_out'] = safe_float(user_out, m.get('default_cost_out', 0.0))
+
+            # Health Status
+            m['health'] = health_status.get(mid, {"status": "unchecked"})
+            
+            # Dynamic Recommendation: Unrecommend if health is bad
+            if m.get('recommended') and m['health']['status'] in ['rate_limit', 'auth_error', 'error']:
+                m['recommended'] = False
+            
+            # DYNAMIC DEMOTION: If health is bad, remove recommendations
+            if m['health']['status'] in ['error', 'auth_error']:
+                m['recommended'] = False
+                m['top_pick'] = False
+                
+            # Core and Sous Chef Flags
+            if mid == core_model:
+                m['is_core'] = True
+            if mid == sous_chef_model:
+                m['is_sous_chef'] = True
+            if mid == librarian_model:
+                m['is_librarian'] = True
+
+            entries.append(MappingProxyType(m))
+        return cls(entries, signature, version)
+
+# Snapshots shared by every (per-request) ModelManager: (config_path, key presence) -> ModelRegistry
+_REGISTRY_CACHE = {}
+_REGISTRY_LOCK = threading.Lock()
+
+class TruncatedResponseError(Exception):
+    """Raised when a provider stopped because it ran out of output tokens."""
+    def __init__(self, message, partial_text=None):
+        super().__init__(message)
+        self.partial_text = partial_text
+
+class GenerationCancelled(Exception):
+    """Raised by generate() when cancel_check fired while waiting for a rate-limit slot."""
+
+def _finish_reason_name(reason):
+    return str(getattr(reason, 'name', reason) or '').upper()
+
+def _fill_usage(usage, input_tokens=0, output_tokens=0, cached_tokens=0):
+    """Copies provider token counts into the caller's usage dict (if one was passed)."""
+    if usage is None:
+        return
+    usage["input_tokens"] = input_tokens or 0
+    usage["output_tokens"] = output_tokens or 0
+    usage["cached_tokens"] = cached_tokens or 0
 
 # --- PROVIER WRAPPERS ---
 
@@ -31,7 +200,7 @@ class GeminiProvider:
             print(f"DEBUG: Gemini Ping Failed: {e}")
             raise e
 
-    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan):
+    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan, max_output_tokens=None, usage=None):
         content_parts = []
         if files:
             for f in files:
@@ -45,9 +214,20 @@ class GeminiProvider:
                 system_instruction=system_instruction,
                 response_mime_type="application/json",
                 response_schema=schema,
-                max_output_tokens=8192
+                max_output_tokens=max_output_tokens or DEFAULT_MAX_OUTPUT_TOKENS
             )
         )
+        meta = response.usage_metadata
+        if meta:
+            _fill_usage(
+                usage,
+                input_tokens=meta.prompt_token_count,
+                output_tokens=(meta.candidates_token_count or 0) + (meta.thoughts_token_count or 0),
+                cached_tokens=meta.cached_content_token_count
+            )
+        candidates = response.candidates or []
+        if candidates and _finish_reason_name(candidates[0].finish_reason) == "MAX_TOKENS":
+            raise TruncatedResponseError("Gemini response truncated (MAX_TOKENS)", partial_text=response.text)
         if response.parsed:
             return response.parsed.model_dump()
         else:
@@ -88,23 +268,49 @@ class OpenAIProvider:
             print(f"DEBUG: OpenAI Ping Failed: {e}")
             raise e
 
-    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan):
+    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan, max_output_tokens=None, usage=None):
         # OpenAI doesn't support file URIs the same way Gemini does (context caching).
         # handling file inputs for LLMs without native file-handle support is complex.
-        
+        params = {
+            "model": model_id,
+            "messages": [
+                {"role": "system", "content": system_instruction},
+                {"role": "user", "content": user_prompt},
+            ],
+            "response_format": schema,
+        }
+        # Reasoning models spend part of the completion budget thinking, so only
+        # cap the classic chat models.
+        if max_output_tokens and not model_id.startswith(("o1", "o3", "o4", "gpt-5")):
+            params["max_tokens"] = max_output_tokens
+
         try:
-            completion = self.client.beta.chat.completions.parse(
-                model=model_id,
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": user_prompt},
-                ],
-                response_format=schema,
-            )
+            completion = self.client.beta.chat.completions.parse(**params)
+            self._record_usage(completion, usage)
             return completion.choices[0].message.parsed.model_dump()
         except Exception as e:
+            # The SDK raises LengthFinishReasonError when finish_reason == "length"
+            if type(e).__name__ == "LengthFinishReasonError":
+                partial = None
+                completion = getattr(e, 'completion', None)
+                self._record_usage(completion, usage)
+                if completion and completion.choices:
+                    partial = completion.choices[0].message.content
+                raise TruncatedResponseError("OpenAI/xAI response truncated (length)", partial_text=partial)
             raise Exception(f"OpenAI/xAI Generation Error: {e}")
 
+    def _record_usage(self, completion, usage):
+        meta = getattr(completion, 'usage', None)
+        if not meta:
+            return
+        details = getattr(meta, 'prompt_tokens_details', None)
+        _fill_usage(
+            usage,
+            input_tokens=meta.prompt_tokens,
+            output_tokens=meta.completion_tokens,
+            cached_tokens=getattr(details, 'cached_tokens', 0) if details else 0
+        )
+
     def simple_generate(self, model_id, system_instruction, user_prompt):
         completion = self.client.chat.completions.create(
             model=model_id,
@@ -139,7 +345,7 @@ class AnthropicProvider:
             print(f"DEBUG: Anthropic Ping Failed: {e}")
             raise e
 
-    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan):
+    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan, max_output_tokens=None, usage=None):
         # Anthropic Tool Use for structured output
         schema_json = schema.model_json_schema()
         
@@ -157,7 +363,7 @@ class AnthropicProvider:
 
             message = self.client.messages.create(
                 model=model_id,
-                max_tokens=8192,
+                max_tokens=max_output_tokens or DEFAULT_MAX_OUTPUT_TOKENS,
                 system=system_instruction,
                 tools=tools,
                 tool_choice={"type": "tool", "name": tool_name},
@@ -167,6 +373,20 @@ class AnthropicProvider:
             )
             
             print(f"DEBUG: Anthropic Response received. Stop Reason: {message.stop_reason}")
+            if message.usage:
+                _fill_usage(
+                    usage,
+                    input_tokens=message.usage.input_tokens,
+                    output_tokens=message.usage.output_tokens,
+                    cached_tokens=getattr(message.usage, 'cache_read_input_tokens', 0)
+                )
+
+            if message.stop_reason == "max_tokens":
+                partial = next((c.input for c in message.content if c.type == "tool_use"), None)
+                raise TruncatedResponseError(
+                    "Anthropic response truncated (max_tokens)",
+                    partial_text=json.dumps(partial) if partial else None
+                )
             
             # Extract tool use
             for content in message.content:
@@ -175,6 +395,8 @@ class AnthropicProvider:
             
             raise Exception("Anthropic did not use the tool.")
             
+        except TruncatedResponseError:
+            raise
         except Exception as e:
             print(f"DEBUG: Anthropic Generation Error: {e}")
             raise Exception(f"Anthropic Generation Error: {e}")
@@ -205,6 +427,9 @@ class ModelManager:
             self.config_path = os.path.join(self.base_dir, 'state', 'users', self.user_id, 'model_config.json')
         else:
             self.config_path = os.path.join(self.base_dir, 'state', 'model_config.json')
+
+        # Token/cost ledger lives next to the model config
+        self.usage_manager = UsageManager(os.path.dirname(self.config_path))
         
         # Load keys - User Preferences > (Conditional) System Env
         def get_initial(name, user_key_type):
@@ -253,6 +478,27 @@ class ModelManager:
             except Exception as e:
                 print(f"DEBUG: Error initializing {provider_name} Provider: {e}")
 
+        # Offline benchmarking: ARBY_REPLAY_MODE=record|replay (see ReplayProvider)
+        self.replay_mode = os.environ.get("ARBY_REPLAY_MODE", "").lower() or None
+        if self.replay_mode in ("record", "replay"):
+            self._replay_dir = os.environ.get("ARBY_REPLAY_DIR") or os.path.join(self.base_dir, 'state', 'replay')
+            self._replay_latency = os.environ.get("ARBY_REPLAY_LATENCY", "recorded")
+            if self.replay_mode == "replay":
+                # Every provider is served from disk, so nothing should look locked
+                for provider_name in self.keys:
+                    self.keys[provider_name] = self.keys[provider_name] or "replay"
+                    self.providers[provider_name] = self._wrap_for_replay(None)
+            else:
+                for provider_name, provider in list(self.providers.items()):
+                    self.providers[provider_name] = self._wrap_for_replay(provider)
+        else:
+            self.replay_mode = None
+
+    def _wrap_for_replay(self, provider):
+        if not self.replay_mode:
+            return provider
+        return ReplayProvider(self.replay_mode, self._replay_dir, inner=provider, latency=self._replay_latency)
+
     def _resolve_key(self, key_string):
         if not key_string:
             return None
@@ -304,6 +550,10 @@ class ModelManager:
     def save_config(self, config):
         with open(self.config_path, 'w') as f:
             json.dump(config, f, indent=4)
+        # mtime can be too coarse to notice two quick writes, so drop this file's snapshots explicitly
+        with _REGISTRY_LOCK:
+            for cache_key in [k for k in _REGISTRY_CACHE if k[0] == self.config_path]:
+                _REGISTRY_CACHE[cache_key] = _REGISTRY_CACHE[cache_key].stale()
 
     def load_config(self):
         if os.path.exists(self.config_path):
@@ -326,99 +576,46 @@ class ModelManager:
         except (ValueError, TypeError):
             return default
 
-    def get_available_models(self):
-        """Returns list of models with their locked status."""
-        # Defaults
-        defaults = [
-            # Google
-            {"id": "gemini-3-pro-preview", "name": "Gemini 3 Pro (Preview)", "provider": "google", "top_pick": True, "recommended": True, "description": "Deep Reasoning. The smartest model available.", "default_cost_in": 2.00, "default_cost_out": 12.00},
-            {"id": "gemini-3-flash-preview", "name": "Gemini 3 Flash (Preview)", "provider": "google", "recommended": True, "description": "High Speed Agent. Smartest 'fast' model.", "default_cost_in": 0.50, "default_cost_out": 3.00},
-            {"id": "gemini-2.5-flash", "name": "Gemini 2.5 Flash", "provider": "google", "description": "The perfect balance of smarts & speed for Arby.", "default_cost_in": 0.30, "default_cost_out": 2.50},
-            {"id": "gemini-2.5-flash-lite", "name": "Gemini 2.5 Flash-Lite", "provider": "google", "description": "Bulk Processing. Great for large PDF libraries.", "default_cost_in": 0.10, "default_cost_out": 0.40},
-            {"id": "gemini-2.5-pro", "name": "Gemini 2.5 Pro", "provider": "google", "description": "Complex Logic. Use if Flash fails.", "default_cost_in": 1.25, "default_cost_out": 10.00},
-            {"id": "gemini-2.0-flash", "name": "Gemini 2.0 Flash", "provider": "google", "description": "Reliability. The 'old reliable' from late 2025.", "default_cost_in": 0.10, "default_cost_out": 0.40},
-
-            # Anthropic
-            {"id": "claude-opus-4-5-20251101", "name": "Claude 4.5 Opus", "provider": "anthropic", "recommended": True, "top_pick": True, "description": "The absolute peak of Claude architecture.", "default_cost_in": 15.00, "default_cost_out": 75.00},
-            {"id": "claude-sonnet-4-5-20250929", "name": "Claude 4.5 Sonnet", "provider": "anthropic", "recommended": True, "description": "Ultra-fast, ultra-smart creative partner.", "default_cost_in": 3.00, "default_cost_out": 15.00},
-            {"id": "claude-haiku-4-5-20251001", "name": "Claude 4.5 Haiku", "provider": "anthropic", "description": "Fast and intelligent ultra-efficient model.", "default_cost_in": 0.25, "default_cost_out": 1.25},
-            
-            # OpenAI
-            {"id": "gpt-5", "name": "GPT-5", "provider": "openai", "recommended": True, "top_pick": True, "description": "The current flagship from OpenAI.", "default_cost_in": 5.00, "default_cost_out": 15.00},
-            {"id": "gpt-5-mini", "name": "GPT-5 Mini", "provider": "openai", "description": "Fast and smart miniature flagship.", "default_cost_in": 0.30, "default_cost_out": 1.20},
-            {"id": "gpt-4.1", "name": "GPT-4.1", "provider": "openai", "description": "Reliable legacy flagship.", "default_cost_in": 2.50, "default_cost_out": 10.00},
-            {"id": "gpt-4o", "name": "GPT-4o", "provider": "openai", "recommended": True, "description": "Standard multimodal model.", "default_cost_in": 2.50, "default_cost_out": 10.00},
-            {"id": "o1", "name": "OpenAI o1", "provider": "openai", "description": "Reasoning & coding specialist.", "default_cost_in": 15.00, "default_cost_out": 60.00},
-            {"id": "o3", "name": "OpenAI o3", "provider": "openai", "description": "Next-gen reasoning model.", "default_cost_in": 3.00, "default_cost_out": 12.00},
-            {"id": "o3-mini", "name": "OpenAI o3-mini", "provider": "openai", "description": "Reasoning speedster.", "default_cost_in": 1.10, "default_cost_out": 4.40},
-            {"id": "o4-mini", "name": "OpenAI o4-mini", "provider": "openai", "description": "Efficient next-gen reasoning.", "default_cost_in": 0.50, "default_cost_out": 2.00},
-            
-            # xAI
-            {"id": "grok-4-1-fast-reasoning", "name": "Grok 4.1 Fast", "provider": "xai", "recommended": True, "top_pick": True, "description": "Advanced reasoning from xAI.", "default_cost_in": 5.00, "default_cost_out": 20.00},
-            {"id": "grok-4-0709", "name": "Grok 4", "provider": "xai", "recommended": True, "description": "Latest xAI frontier model.", "default_cost_in": 5.00, "default_cost_out": 20.00},
-            {"id": "grok-3", "name": "Grok 3", "provider": "xai", "description": "Stable Grok flagship.", "default_cost_in": 2.00, "default_cost_out": 10.00},
-            {"id": "grok-3-mini", "name": "Grok 3 Mini", "provider": "xai", "description": "Efficient Grok model.", "default_cost_in": 0.50, "default_cost_out": 2.00},
-            {"id": "grok-2-vision-1212", "name": "Grok 2 Vision", "provider": "xai", "description": "Visual intelligence from Grok.", "default_cost_in": 2.00, "default_cost_out": 10.00},
-        ]
-        
-        config = self.load_config()
-        
-        # Filter hidden
-        active_models = [m for m in defaults if m['id'] not in config.get('hidden_ids', [])]
-        
-        # Add Custom
-        custom = config.get('custom_models', [])
-        for c in custom:
-            c['is_custom'] = True # Flag for UI to allow deletion
-            active_models.append(c)
-            
-        # Enrich with Status and User Costs
-        saved_costs = config.get('costs', {})
-        health_status = config.get('health', {})
-        core_model = config.get('core_model', 'gemini-2.5-flash') # Updated default to match new list
-
-        for m in active_models:
-            mid = m['id']
-            # Locked Status
-            provider = m["provider"]
-            if provider == 'custom':
-                 has_own_key = bool(m.get('api_key'))
-                 has_default_key = bool(self.keys.get('openai'))
-                 m["locked"] = not (has_own_key or has_default_key)
-            else:
-                m["locked"] = not bool(self.keys.get(provider))
-
-            # Cost Rates
-            cost_entry = saved_costs.get(mid, {})
-            user_in = cost_entry.get('in') if isinstance(cost_entry, dict) else None
-            user_out = cost_entry.get('out') if isinstance(cost_entry, dict) else None
-
-            m['cost_in'] = self._safe_float(user_in, m.get('default_cost_in', 0.0))
-            m['cost_out'] = self._safe_float(user_out, m.get('default_cost_out', 0.0))
+    def _config_signature(self):
+        """Cheap change detector for model_config.json (one stat call, no read)."""
+        try:
+            st = os.stat(self.config_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
 
-            # Health Status
-            m['health'] = health_status.get(mid, {"status": "unchecked"})
-            
-            # Dynamic Recommendation: Unrecommend if health is bad
-            if m.get('recommended') and m['health']['status'] in ['rate_limit', 'auth_error', 'error']:
-                m['recommended'] = False
-            
-            # DYNAMIC DEMOTION: If health is bad, remove recommendations
-            if m['health']['status'] in ['error', 'auth_error']:
-                m['recommended'] = False
-                m['top_pick'] = False
-                
-            # Core and Sous Chef Flags
-            if mid == core_model:
-                m['is_core'] = True
-            
-            if mid == self.get_sous_chef_model_id():
-                m['is_sous_chef'] = True
-                
-            if mid == self.get_librarian_model_id():
-                m['is_librarian'] = True
+    def get_registry(self):
+        """Current ModelRegistry snapshot; rebuilt only when the config file or key set changes."""
+        key_state = tuple(sorted((name, bool(val)) for name, val in self.keys.items()))
+        cache_key = (self.config_path, key_state)
+        signature = self._config_signature()
+        with _REGISTRY_LOCK:
+            cached = _REGISTRY_CACHE.get(cache_key)
+            if cached and cached.signature == signature:
+                return cached
+            version = (cached.version + 1) if cached else 1
+        registry = ModelRegistry.build(self.load_config(), self.keys, signature, version, self._safe_float)
+        with _REGISTRY_LOCK:
+            _REGISTRY_CACHE[cache_key] = registry
+        return registry
+
+    def get_model(self, model_id):
+        """Registry entry (read-only mapping) for a visible model, or None."""
+        return self.get_registry().get(model_id)
+
+    def can_generate(self, model_id):
+        """True when generate() could run this model: it's visible and its provider has a key."""
+        model = self.get_model(model_id)
+        if not model:
+            return False
+        if model["provider"] == 'custom':
+            return bool(model.get('api_key') or self.keys.get('openai'))
+        return model["provider"] in self.providers
 
-        return active_models
+    def get_available_models(self):
+        """Returns list of models with their locked status."""
+        # Copies, so callers can decorate entries without touching the shared snapshot
+        return [dict(m) for m in self.get_registry().models]
 
     def set_core_model(self, model_id):
         config = self.load_config()
@@ -437,7 +634,7 @@ class ModelManager:
     def get_sous_chef_model_id(self):
         config = self.load_config()
         # Default to 1.5 Flash for high reliability/quota if not set
-        return config.get('sous_chef_model', 'gemini-1.5-flash')
+        return config.get('sous_chef_model', DEFAULT_SOUS_CHEF_MODEL)
 
     def set_librarian_model(self, model_id):
         config = self.load_config()
@@ -446,8 +643,8 @@ class ModelManager:
 
     def get_librarian_model_id(self):
         config = self.load_config()
-        # Default to 1.5 Flash - best for PDF ingestion
-        return config.get('librarian_model', 'gemini-1.5-flash')
+        # Default to Flash-Lite - cheap bulk PDF ingestion
+        return config.get('librarian_model', DEFAULT_LIBRARIAN_MODEL)
 
     def update_model_cost(self, model_id, cost_in, cost_out):
         config = self.load_config()
@@ -456,8 +653,7 @@ class ModelManager:
         self.save_config(config)
 
     def _get_provider_for_model(self, model_id):
-        models_list = self.get_available_models()
-        target_model = next((m for m in models_list if m["id"] == model_id), None)
+        target_model = self.get_model(model_id)
         
         if not target_model:
             raise ValueError(f"Unknown or hidden model: {model_id}")
@@ -470,7 +666,7 @@ class ModelManager:
             base_url = target_model.get('base_url')
             if not api_key:
                  raise ValueError(f"No API Key found for custom model {model_id}")
-            provider = OpenAIProvider(api_key=api_key, base_url=base_url)
+            provider = self._wrap_for_replay(OpenAIProvider(api_key=api_key, base_url=base_url))
         else:
             if provider_name not in self.providers:
                  raise ValueError(f"Provider {provider_name} is not configured.")
@@ -556,10 +752,32 @@ class ModelManager:
         config['hidden_ids'] = []
         self.save_config(config)
 
-    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan):
-        # 1. Identify Provider (Re-fetch to include dynamic ones)
-        models_list = self.get_available_models()
-        target_model = next((m for m in models_list if m["id"] == model_id), None)
+    def get_output_limit(self, model_id):
+        """Largest output budget we are willing to request from this model."""
+        best = None
+        for prefix in MODEL_OUTPUT_LIMITS:
+            if model_id.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return MODEL_OUTPUT_LIMITS[best] if best else DEFAULT_MAX_OUTPUT_TOKENS
+
+    def plan_output_budget(self, model_id, num_slots):
+        """Sizes max_output_tokens for a plan from the number of meal slots requested.
+
+        Never below DEFAULT_MAX_OUTPUT_TOKENS: thinking models spend part of the
+        budget on thinking, so small plans keep the old headroom and big ones get more.
+        """
+        wanted = PLAN_TOKENS_BASE + max(num_slots, 1) * PLAN_TOKENS_PER_SLOT
+        return min(self.get_output_limit(model_id), max(DEFAULT_MAX_OUTPUT_TOKENS, wanted))
+
+    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan, max_output_tokens=None,
+                 call_site="generate", units=0, cancel_check=None):
+        """Structured generation. `call_site` and `units` (e.g. meal slots) label the usage ledger entry.
+
+        cancel_check: func() -> bool, polled while waiting for the provider's rate limiter
+        (e.g. out a 429 backoff); raises GenerationCancelled if it fires before the call.
+        """
+        # 1. Identify Provider (O(1) lookup in the registry snapshot)
+        target_model = self.get_model(model_id)
         
         if not target_model:
             raise ValueError(f"Unknown or hidden model: {model_id}")
@@ -576,7 +794,7 @@ class ModelManager:
                  
             # Create ad-hoc provider
             # Assuming OpenAI compatible
-            provider = OpenAIProvider(api_key=api_key, base_url=base_url)
+            provider = self._wrap_for_replay(OpenAIProvider(api_key=api_key, base_url=base_url))
         else:
             if provider_name not in self.providers:
                  raise ValueError(f"Provider {provider_name} is not configured (missing API key).")
@@ -584,4 +802,37 @@ class ModelManager:
         
         # 2. Call Provider
         print(f"Generating structured response using {model_id} via {provider_name}...")
-        return provider.generate(model_id, system_instruction, user_prompt, files, schema=schema)
+        usage = {}
+        ok = False
+        # Shared with every other caller of this provider (e.g. concurrent library sync workers).
+        # Replayed responses never reach the provider, so they aren't throttled.
+        limiter = limiter_for(provider_name)
+        if self.replay_mode != "replay" and not limiter.acquire(cancel_check=cancel_check):
+            raise GenerationCancelled(f"{call_site} cancelled while waiting for {provider_name}")
+        started = time.time()
+        try:
+            result = provider.generate(model_id, system_instruction, user_prompt, files, schema=schema,
+                                       max_output_tokens=max_output_tokens, usage=usage)
+            ok = True
+            return result
+        except Exception as e:
+            if is_rate_limit_error(e):
+                limiter.backoff()
+            raise
+        finally:
+            input_tokens = usage.get("input_tokens", 0)
+            output_tokens = usage.get("output_tokens", 0)
+            cost = (input_tokens / 1_000_000 * target_model.get('cost_in', 0.0)) + \
+                   (output_tokens / 1_000_000 * target_model.get('cost_out', 0.0))
+            self.usage_manager.record(
+                model_id=model_id,
+                call_site=call_site,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cached_tokens=usage.get("cached_tokens", 0),
+                latency_ms=(time.time() - started) * 1000,
+                cost=cost,
+                prompt_chars=len(system_instruction or "") + len(user_prompt or ""),
+                units=units,
+                ok=ok
+            )
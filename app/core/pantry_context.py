@@ -0,0 +1,142 @@
+from datetime import datetime
+from app.core.pantry_matcher import normalize_tokens
+from app.core.units import to_display
+
+# Rough chars-per-token ratio used for the savings estimate in the logs
+CHARS_PER_TOKEN = 4
+
+# Aisle a pantry item is listed under, keyed by normalised (singular) token.
+# Compound tokens use '_' like pantry_matcher.normalize_tokens produces them.
+CATEGORIES = {
+    "Produce": {
+        "onion", "garlic", "shallot", "potato", "sweet_potato", "carrot", "celery", "lettuce",
+        "spinach", "kale", "arugula", "salad", "broccoli", "cauliflower", "cabbage", "zucchini",
+        "cucumber", "bell_pepper", "pepper", "jalapeno", "tomato", "mushroom", "avocado", "lemon",
+        "lime", "apple", "banana", "orange", "berry", "strawberry", "blueberry", "raspberry",
+        "grape", "ginger", "cilantro", "parsley", "basil", "herb", "scallion", "corn",
+        "green_bean", "asparagus", "eggplant", "squash", "leek", "radish", "beet", "pear", "mango",
+    },
+    "Dairy & Eggs": {
+        "milk", "oat_milk", "almond_milk", "soy_milk", "buttermilk", "cream", "heavy_cream",
+        "sour_cream", "cream_cheese", "yogurt", "butter", "cheese", "cheddar", "parmesan",
+        "mozzarella", "feta", "ricotta", "egg", "half",
+    },
+    "Meat & Fish": {
+        "chicken", "beef", "ground", "steak", "pork", "turkey", "lamb", "sausage", "bacon", "ham",
+        "salmon", "fish", "shrimp", "tuna", "cod", "tofu", "tempeh",
+    },
+    "Bakery": {"bread", "tortilla", "bagel", "bun", "pita", "roll", "baguette", "naan"},
+    "Frozen": {"frozen", "ice_cream"},
+    "Spices & Baking": {
+        "salt", "spice", "cumin", "paprika", "cinnamon", "oregano", "thyme", "chili_powder",
+        "garlic_powder", "onion_powder", "chili_flake", "baking_soda", "baking_powder", "yeast",
+        "flour", "sugar", "brown_sugar", "powdered_sugar", "vanilla", "cocoa", "corn_starch",
+    },
+    "Pantry": {
+        "rice", "pasta", "spaghetti", "noodle", "oats", "oat", "cereal", "quinoa", "lentils",
+        "lentil", "bean", "black_bean", "kidney_bean", "pinto_bean", "chickpea", "oil", "olive",
+        "sesame_oil", "coconut_oil", "vinegar", "rice_vinegar", "soy_sauce", "fish_sauce",
+        "hot_sauce", "honey", "maple_syrup", "peanut_butter", "almond_butter", "jam", "ketchup",
+        "mustard", "mayonnaise", "salsa", "coffee", "tea", "broth", "chicken_broth", "beef_broth",
+        "vegetable_broth", "tomato_sauce", "tomato_paste", "pasta_sauce", "coconut_milk",
+        "canned", "nut", "almond", "walnut", "chocolate", "cracker", "chip",
+    },
+}
+OTHER = "Other"
+
+# Token -> category; 'frozen' and 'canned' describe storage and win over the food itself
+_CATEGORY_OF = {token: name for name, tokens in CATEGORIES.items() for token in tokens}
+_STORAGE_WORDS = ("frozen", "canned")
+
+def categorize(name):
+    """Aisle for an item name: storage words first, then the head noun, then any other word."""
+    tokens = normalize_tokens(name)
+    for word in _STORAGE_WORDS:
+        if word in tokens:
+            return _CATEGORY_OF[word]
+    for token in reversed(tokens):
+        if token in _CATEGORY_OF:
+            return _CATEGORY_OF[token]
+    return OTHER
+
+def _number(value):
+    value = round(float(value), 2)
+    return str(int(value)) if value == int(value) else str(value)
+
+def amount(item):
+    """'2 lb', '500 g', or just '4' for counted items."""
+    if item.get('quantity') is None:
+        return ""
+    quantity, unit = to_display(item['quantity'], item.get('unit') or 'ct')
+    if not unit or unit == 'ct':
+        return _number(quantity)
+    return f"{_number(quantity)} {unit}"
+
+def brand(item):
+    """Brand worth mentioning, or None for the empty/'None'/'No Brand' placeholders."""
+    value = (item.get('brand') or "").strip()
+    if value.lower() in ("", "none", "no brand", "null", "n/a", "generic"):
+        return None
+    return value
+
+def full_listing(items, order):
+    """The original one-line-per-item listing; kept as the baseline for savings stats."""
+    return ", ".join(
+        f"[{items[i]['id']}] {items[i]['quantity']} {items[i]['unit']} of {items[i]['item']} ({items[i].get('brand') or 'None'})"
+        for i in order
+    )
+
+def planner_context(items, order, dates, soon, today=None, max_chars=None):
+    """Names and amounts grouped by aisle, for meal planning and grocery checks.
+
+    Items due by `soon` (YYYY-MM-DD) are pulled into a leading "Use soon" group
+    with their date delta-encoded as days left ('Spinach 1 bunch (2d)').
+    max_chars stops adding entries once the budget is spent and says how many were left out.
+    """
+    today = (today or datetime.now()).strftime("%Y-%m-%d")
+    today_date = datetime.strptime(today, "%Y-%m-%d")
+
+    urgent = sorted((dates[i], i) for i in order if dates.get(i) and dates[i] <= soon)
+    urgent_ids = {i for _, i in urgent}
+    groups = {"Use soon (days left)": []}
+    for date, item_id in urgent:
+        days_left = (datetime.strptime(date, "%Y-%m-%d") - today_date).days
+        groups["Use soon (days left)"].append((item_id, f"({days_left}d)" if days_left >= 0 else "(expired)"))
+    for item_id in order:
+        if item_id not in urgent_ids:
+            groups.setdefault(categorize(items[item_id]['item']), []).append((item_id, ""))
+
+    # Fixed aisle order keeps the text stable between calls (and provider prompt caches warm)
+    ranked = ["Use soon (days left)"] + list(CATEGORIES) + [OTHER]
+    lines, used, shown = [], 0, 0
+    total = len(order)
+    for name in ranked:
+        entries = []
+        for item_id, suffix in groups.get(name, []):
+            item = items[item_id]
+            entry = " ".join(part for part in (item['item'], amount(item), suffix) if part)
+            if max_chars and used + len(entry) + len(name) > max_chars:
+                break
+            entries.append(entry)
+            used += len(entry) + 2
+            shown += 1
+        if entries:
+            lines.append(f"{name}: " + "; ".join(entries))
+            used += len(name) + 2
+        if max_chars and shown < total and used >= max_chars:
+            break
+    if shown < total:
+        lines.append(f"...and {total - shown} more items")
+    return "\n".join(lines)
+
+def matcher_context(items, ids):
+    """Ids and names (brand only when there is one), for prompts that must answer with an id."""
+    lines = []
+    for item_id in ids:
+        item = items[item_id]
+        label = brand(item)
+        lines.append(f"[{item_id}] {item['item']}" + (f" ({label})" if label else ""))
+    return "\n".join(lines)
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
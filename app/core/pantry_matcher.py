@@ -0,0 +1,177 @@
+import re
+from app.core.ingredient_parser import parse_ingredient_line
+
+# A best candidate at or above MATCH_THRESHOLD that beats the runner-up by MATCH_MARGIN
+# is taken without asking the LLM. Anything between AMBIGUOUS_THRESHOLD and that is
+# escalated with a short candidate list; below it there is no match.
+MATCH_THRESHOLD = 0.85
+MATCH_MARGIN = 0.1
+AMBIGUOUS_THRESHOLD = 0.5
+MAX_CANDIDATES = 5
+
+# Words that describe preparation, size or grade rather than the ingredient itself
+DESCRIPTORS = {
+    "fresh", "organic", "large", "small", "medium", "extra", "jumbo", "baby", "whole",
+    "chopped", "diced", "minced", "sliced", "grated", "shredded", "cubed", "julienned",
+    "boneless", "skinless", "ripe", "raw", "cooked", "unsalted", "salted", "lean",
+    "finely", "roughly", "thinly", "peeled", "seeded", "softened", "melted", "room",
+    "temperature", "packed", "free", "range", "cage", "natural", "plain", "pure", "virgin",
+    "low", "fat", "reduced", "sodium", "light", "heaping", "level", "optional", "divided",
+    "good", "quality", "store", "bought", "homemade", "the", "a", "an", "some", "of", "to", "taste",
+}
+
+# Multi-word foods that must not match their last word ('peanut butter' is not 'butter')
+COMPOUNDS = [
+    "peanut butter", "almond butter", "cream cheese", "sour cream", "ice cream", "heavy cream",
+    "oat milk", "almond milk", "coconut milk", "soy milk", "rice milk", "coconut cream",
+    "soy sauce", "fish sauce", "hot sauce", "tomato sauce", "tomato paste", "pasta sauce",
+    "baking soda", "baking powder", "brown sugar", "powdered sugar", "sweet potato",
+    "green bean", "black bean", "kidney bean", "pinto bean", "chicken broth", "beef broth",
+    "vegetable broth", "chicken stock", "beef stock", "vegetable stock", "bell pepper",
+    "chili powder", "garlic powder", "onion powder", "rice vinegar", "red wine vinegar",
+    "apple cider vinegar", "maple syrup", "corn starch", "sesame oil", "coconut oil",
+    "red pepper flake",
+]
+
+# Curated synonyms, applied to the normalised (singular) name -> canonical name
+SYNONYMS = {
+    "green onion": "scallion", "spring onion": "scallion",
+    "coriander leaf": "cilantro", "fresh coriander": "cilantro",
+    "garbanzo": "chickpea", "garbanzo bean": "chickpea",
+    "courgette": "zucchini", "aubergine": "eggplant", "capsicum": "bell pepper",
+    "minced beef": "ground beef", "beef mince": "ground beef", "hamburger meat": "ground beef",
+    "confectioner sugar": "powdered sugar", "icing sugar": "powdered sugar",
+    "double cream": "heavy cream", "heavy whipping cream": "heavy cream", "whipping cream": "heavy cream",
+    "all purpose flour": "flour", "plain flour": "flour", "ap flour": "flour",
+    "bicarbonate of soda": "baking soda", "bicarb": "baking soda",
+    "prawn": "shrimp", "rocket": "arugula", "cornstarch": "corn starch", "cornflour": "corn starch",
+    "catsup": "ketchup", "mayo": "mayonnaise", "evoo": "olive oil",
+    "extra virgin olive oil": "olive oil", "chilli": "chili", "chile": "chili",
+    "stock": "broth", "chicken stock": "chicken broth", "beef stock": "beef broth",
+    "vegetable stock": "vegetable broth",
+    "red pepper flake": "chili flake", "crushed red pepper": "chili flake",
+}
+
+_SYNONYMS_LONGEST_FIRST = sorted(SYNONYMS, key=len, reverse=True)
+
+# Plural endings left alone
+_NO_SINGULAR = {"hummus", "couscous", "asparagus", "molasses", "swiss", "grits", "oats", "brussels", "citrus", "bass", "lentils"}
+
+def _singular(word):
+    if word in _NO_SINGULAR or len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("ves") and word[:-3] in ("lea", "loa", "hal"):
+        return word[:-3] + "f"
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+def normalize_tokens(name):
+    """Lowercase, singular, descriptor-free tokens with compounds and synonyms folded in."""
+    text = re.sub(r"\([^)]*\)", " ", (name or "").lower())
+    phrase = " ".join(_singular(w) for w in re.findall(r"[a-z]+", text))
+
+    # Synonyms before descriptor removal so 'fresh coriander' still reads as cilantro.
+    # Longest first so 'extra virgin olive oil' wins over 'olive oil'.
+    for alias in _SYNONYMS_LONGEST_FIRST:
+        phrase = re.sub(rf"\b{alias}\b", SYNONYMS[alias], phrase)
+    phrase = " ".join(w for w in phrase.split() if w not in DESCRIPTORS)
+    for compound in COMPOUNDS:
+        phrase = re.sub(rf"\b{compound}\b", compound.replace(" ", "_"), phrase)
+    return phrase.split()
+
+def query_name(recipe_line):
+    """Ingredient name from a recipe/grocery line: '2 cloves garlic, minced' -> 'garlic'."""
+    item = parse_ingredient_line(recipe_line)["item"] or recipe_line or ""
+    item = item.split(",")[0]
+    item = re.split(r"\s+or\s+", item)[0]
+    return item.strip()
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(query_tokens, query_grams, tokens, grams):
+    """0-1 score from token overlap, character trigrams and a shared head noun."""
+    if not query_tokens or not tokens:
+        return 0.0
+    if query_tokens == tokens:
+        return 1.0
+    a, b = set(query_tokens), set(tokens)
+    shared = len(a & b)
+    containment = shared / min(len(a), len(b))
+    jaccard = shared / len(a | b)
+    token_score = (containment + jaccard) / 2
+    char_score = 2 * len(query_grams & grams) / (len(query_grams) + len(grams)) if (query_grams or grams) else 0.0
+    score = max(token_score, 0.9 * char_score)
+    # 'yellow onion' vs 'onion': same head noun is a strong signal
+    if query_tokens[-1] == tokens[-1]:
+        score += 0.1
+    return min(score, 1.0)
+
+class PantryMatchIndex:
+    """Local fuzzy lookup over pantry item names.
+
+    Built from (key, item dict) pairs; candidates are pulled from token and
+    trigram postings so only items sharing something with the query get scored.
+    """
+    def __init__(self, entries):
+        self.entries = {}
+        self.token_postings = {}
+        self.gram_postings = {}
+        for key, item in entries:
+            tokens = normalize_tokens(item.get('item'))
+            grams = _trigrams(" ".join(tokens))
+            self.entries[key] = (tokens, grams, item)
+            for token in set(tokens):
+                self.token_postings.setdefault(token, set()).add(key)
+            for gram in grams:
+                self.gram_postings.setdefault(gram, set()).add(key)
+
+    @classmethod
+    def from_inventory(cls, items):
+        """Index keyed by item id, from InventoryManager's {id: item} map."""
+        return cls(items.items())
+
+    def candidates(self, name, limit=MAX_CANDIDATES):
+        """[(key, score)] best first, scores above AMBIGUOUS_THRESHOLD only."""
+        query_tokens = normalize_tokens(name)
+        if not query_tokens:
+            return []
+        query_grams = _trigrams(" ".join(query_tokens))
+
+        keys = set()
+        for token in query_tokens:
+            keys |= self.token_postings.get(token, set())
+        # Character overlap catches spelling variants that share no whole token
+        gram_hits = {}
+        for gram in query_grams:
+            for key in self.gram_postings.get(gram, ()):
+                gram_hits[key] = gram_hits.get(key, 0) + 1
+        keys |= {key for key, hits in gram_hits.items() if hits >= len(query_grams) // 3}
+
+        scored = []
+        for key in keys:
+            tokens, grams, _ = self.entries[key]
+            score = similarity(query_tokens, query_grams, tokens, grams)
+            if score >= AMBIGUOUS_THRESHOLD:
+                scored.append((key, round(score, 3)))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return scored[:limit]
+
+    def resolve(self, name):
+        """Returns ("match", key), ("ambiguous", [(key, score)]) or ("none", None)."""
+        scored = self.candidates(name)
+        if not scored:
+            return "none", None
+        best_key, best = scored[0]
+        runner_up = scored[1][1] if len(scored) > 1 else 0.0
+        if best >= MATCH_THRESHOLD and best - runner_up >= MATCH_MARGIN:
+            return "match", best_key
+        return "ambiguous", scored
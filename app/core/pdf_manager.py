@@ -14,8 +14,8 @@ class PDFManager:
         """Calculates the MD5 hash of a file."""
         hasher = hashlib.md5()
         with open(filepath, 'rb') as f:
-            buf = f.read()
-            hasher.update(buf)
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
         return hasher.hexdigest()
 
     def _load_history(self):
@@ -0,0 +1,76 @@
+import re
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Gemini bills an uploaded PDF at a flat rate per page (the page image), on top of its text
+PDF_PAGE_TOKENS = 258
+# Below this much readable text per page we assume a scanned/image PDF and upload it instead
+MIN_CHARS_PER_PAGE = 80
+MIN_LETTER_RATIO = 0.6
+
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s*)?\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?$", re.IGNORECASE)
+_PRINT_STAMP_RE = re.compile(r"^\d{1,2}/\d{1,2}/\d{2,4},?\s+\d{1,2}:\d{2}\s*(?:[AP]M)?\b", re.IGNORECASE)
+_URL_RE = re.compile(r"^(?:https?://|www\.)\S+$", re.IGNORECASE)
+
+def clean_text(pages):
+    """Joins page lines into readable text, dropping print furniture.
+
+    Removes page numbers, browser print stamps and bare URLs, plus header/footer
+    lines repeated on most pages; re-joins words hyphenated across lines and
+    sentences wrapped mid-line, but keeps list lines (ingredients) separate.
+    """
+    normalize = lambda s: re.sub(r"\d+", "#", s.strip().lower())
+    repeated = set()
+    if len(pages) >= 3:
+        counts = {}
+        for lines in pages:
+            for key in {normalize(l) for l in lines[:3] + lines[-3:] if l.strip()}:
+                counts[key] = counts.get(key, 0) + 1
+        repeated = {key for key, count in counts.items() if count >= len(pages) / 2}
+
+    out = []
+    for lines in pages:
+        for raw in lines:
+            text = re.sub(r"[ \t ]+", " ", raw).strip()
+            if text and (normalize(text) in repeated or _PAGE_NUMBER_RE.match(text)
+                         or _PRINT_STAMP_RE.match(text) or _URL_RE.match(text)):
+                continue
+            if out and out[-1] and text:
+                prev = out[-1]
+                if prev.endswith("-") and text[0].islower():
+                    out[-1] = prev[:-1] + text
+                    continue
+                if prev[-1].isalpha() and text[0].islower() and len(prev) > 40:
+                    out[-1] = prev + " " + text
+                    continue
+            if text or (out and out[-1]):
+                out.append(text)
+        if out and out[-1]:
+            out.append("")
+    return "\n".join(out).strip()
+
+def extract_text(path):
+    """(clean text, page count) for a PDF; ("", 0) when nothing readable was found.
+
+    Without pypdf (see requirements.txt), or for a PDF it can't read, every file takes the upload path.
+    """
+    if PdfReader is None:
+        return "", 0
+    try:
+        reader = PdfReader(path)
+        pages = [(page.extract_text() or "").splitlines() for page in reader.pages]
+    except Exception as e:
+        print(f"DEBUG: pypdf could not read {path} ({e}); uploading it instead.")
+        return "", 0
+    return clean_text(pages), len(pages)
+
+def is_usable(text, page_count):
+    """True when the text looks like a real text layer rather than a scan or garbled glyph ids."""
+    letters = sum(ch.isalpha() for ch in text)
+    visible = sum(not ch.isspace() for ch in text)
+    if not visible:
+        return False
+    return len(text) >= MIN_CHARS_PER_PAGE * max(1, page_count) and letters / visible >= MIN_LETTER_RATIO
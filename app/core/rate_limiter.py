@@ -0,0 +1,63 @@
+import os
+import time
+import threading
+
+# Requests per minute allowed per provider unless ARBY_<PROVIDER>_RPM overrides it (0 = unlimited)
+DEFAULT_RPM = 60
+# How long everyone waits after any caller is told "429 / quota exhausted"
+RATE_LIMIT_BACKOFF_SECONDS = 60
+
+def is_rate_limit_error(error):
+    message = str(error)
+    lowered = message.lower()
+    return "429" in message or "resource_exhausted" in lowered or "rate limit" in lowered or "quota" in lowered
+
+class RateLimiter:
+    """Spaces out calls to one provider across threads.
+
+    acquire() hands out evenly spaced start slots (60 / rpm seconds apart) and
+    also waits out any shared backoff set by backoff() after a 429.
+    """
+    def __init__(self, rpm=DEFAULT_RPM):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+    def acquire(self, cancel_check=None):
+        """Blocks until this caller may start a request. Returns False if cancelled while waiting."""
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+        while True:
+            # A backoff set while we were queued pushes our slot back too
+            wait = max(slot, self._paused_until) - time.time()
+            if wait <= 0:
+                return True
+            if cancel_check and cancel_check():
+                return False
+            time.sleep(min(wait, 0.5))
+
+    def backoff(self, seconds=RATE_LIMIT_BACKOFF_SECONDS):
+        """Pauses every caller of this provider for `seconds` (extends, never shortens, a pause)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    def paused_for(self):
+        return max(0.0, self._paused_until - time.time())
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def limiter_for(provider):
+    """Process-wide limiter for a provider name ('gemini', 'openai', ...)."""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(provider)
+        if limiter is None:
+            try:
+                rpm = float(os.environ.get(f"ARBY_{provider.upper()}_RPM", DEFAULT_RPM))
+            except ValueError:
+                rpm = DEFAULT_RPM
+            limiter = _LIMITERS[provider] = RateLimiter(rpm)
+        return limiter
@@ -0,0 +1,212 @@
+import random
+import hashlib
+from app.core.pantry_matcher import normalize_tokens, query_name
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# MinHash signature length and LSH banding: 12 bands of 5 rows, so the band threshold,
+# (1/12)^(1/5) ~ 0.6, sits at DUPLICATE_THRESHOLD. Pairs at Jaccard 0.8 share a band ~99%
+# of the time, at 0.6 ~62%, at 0.3 (a few staples like salt, oil and garlic) only ~3%.
+# Wider bands let staples put most of a cookbook into every recipe's candidates.
+BANDS = 12
+ROWS = 5
+NUM_HASHES = BANDS * ROWS
+# Jaccard over title words + ingredient names at which two recipes count as the same dish
+DUPLICATE_THRESHOLD = 0.6
+# Same cleaned title: duplicates unless the ingredient lists overlap less than this
+SAME_TITLE_MIN_OVERLAP = 0.25
+
+_MASK = 0xFFFFFFFF
+_rng = random.Random(20240611)  # fixed, so signatures are stable between runs
+_PERMS = [(_rng.randrange(1, 1 << 32) | 1, _rng.randrange(0, 1 << 32)) for _ in range(NUM_HASHES)]
+if np is not None:
+    _A = np.array([a for a, _ in _PERMS], dtype=np.uint64)[:, None]
+    _B = np.array([b for _, b in _PERMS], dtype=np.uint64)[:, None]
+
+def _hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'big')
+
+def minhash(shingles):
+    """NUM_HASHES-long MinHash signature of a set of strings."""
+    hashes = [_hash(s) for s in shingles]
+    if np is not None:
+        values = (_A * np.array(hashes, dtype=np.uint64)[None, :] + _B) & _MASK
+        return tuple(int(v) for v in values.min(axis=1))
+    return tuple(min((a * h + b) & _MASK for h in hashes) for a, b in _PERMS)
+
+def jaccard(a, b):
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# Ingredient line -> normalised name; lines like "1 onion, diced" repeat across most cookbooks
+_NAMES = {}
+_NAMES_MAX = 50000
+
+def ingredient_names(lines):
+    """{'chicken_thigh', 'garlic', ...}: quantities, units and prep notes stripped."""
+    names = set()
+    for line in lines or []:
+        name = _NAMES.get(line)
+        if name is None:
+            if len(_NAMES) >= _NAMES_MAX:
+                _NAMES.clear()
+            name = _NAMES[line] = "_".join(normalize_tokens(query_name(line)))
+        if name:
+            names.add(name)
+    return names
+
+def _steps(lines):
+    return [" ".join(line.split()).lower() for line in lines or [] if line.strip()]
+
+def same_content(a, b):
+    """True if two recipes have the same ingredient names and the same steps (so merging loses nothing)."""
+    return (ingredient_names(a.get('ingredients')) == ingredient_names(b.get('ingredients'))
+            and _steps(a.get('instructions')) == _steps(b.get('instructions')))
+
+class DedupeIndex:
+    """MinHash/LSH index over recipe titles and ingredient sets for near-duplicate checks.
+
+    A recipe is only compared with recipes sharing an LSH band or its exact
+    cleaned title, so checks stay sub-linear in cookbook size. add()/remove()
+    keep it current; sync() brings it in line with a recipe list, re-hashing
+    only recipes whose name or ingredients changed.
+    """
+    def __init__(self, title_key=None):
+        self.title_key = title_key or (lambda title: (title or "").lower().strip())
+        self.docs = {}      # id -> (fingerprint, cleaned title, title words, ingredient names, signature, recipe)
+        self.buckets = {}   # (band, band values) -> {ids}
+        self.titles = {}    # cleaned title -> {ids}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def copy(self):
+        """A snapshot that later add()/remove() calls on this index don't touch."""
+        other = DedupeIndex(self.title_key)
+        other.docs = dict(self.docs)
+        other.buckets = {key: set(ids) for key, ids in self.buckets.items()}
+        other.titles = {key: set(ids) for key, ids in self.titles.items()}
+        return other
+
+    @staticmethod
+    def _fingerprint(recipe):
+        return (recipe.get('name') or "", tuple(recipe.get('ingredients') or ()))
+
+    def _features(self, recipe):
+        title = self.title_key(recipe.get('name'))
+        words = set(title.split())
+        ingredients = ingredient_names(recipe.get('ingredients'))
+        shingles = {"t:" + w for w in words} | {"i:" + i for i in ingredients}
+        return title, words, ingredients, (minhash(shingles) if shingles else None)
+
+    def _bands(self, signature):
+        return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def add(self, recipe):
+        recipe_id = recipe['id']
+        fingerprint = self._fingerprint(recipe)
+        doc = self.docs.get(recipe_id)
+        if doc and doc[0] == fingerprint:
+            self.docs[recipe_id] = doc[:5] + (recipe,)
+            return
+        self.remove(recipe_id)
+        title, words, ingredients, signature = self._features(recipe)
+        self.docs[recipe_id] = (fingerprint, title, words, ingredients, signature, recipe)
+        self.titles.setdefault(title, set()).add(recipe_id)
+        if signature:
+            for key in self._bands(signature):
+                self.buckets.setdefault(key, set()).add(recipe_id)
+
+    def remove(self, recipe_id):
+        doc = self.docs.pop(recipe_id, None)
+        if doc is None:
+            return
+        _, title, _, _, signature, _ = doc
+        for postings, key in [(self.titles, title)] + [(self.buckets, k) for k in (self._bands(signature) if signature else [])]:
+            ids = postings.get(key)
+            if ids is not None:
+                ids.discard(recipe_id)
+                if not ids:
+                    del postings[key]
+
+    def sync(self, recipes):
+        keep = set()
+        for recipe in recipes:
+            if recipe.get('id'):
+                keep.add(recipe['id'])
+                self.add(recipe)
+        for recipe_id in [i for i in self.docs if i not in keep]:
+            self.remove(recipe_id)
+
+    def _score(self, a, b):
+        """Similarity of two indexed docs, or 0.0 when they aren't duplicates."""
+        _, title_a, words_a, ingredients_a, _, _ = a
+        _, title_b, words_b, ingredients_b, _, _ = b
+        if title_a and title_a == title_b:
+            if not ingredients_a or not ingredients_b:
+                return 1.0
+            overlap = jaccard(ingredients_a, ingredients_b)
+            if overlap >= SAME_TITLE_MIN_OVERLAP:
+                return (1.0 + overlap) / 2
+        combined = jaccard({"t:" + w for w in words_a} | {"i:" + i for i in ingredients_a},
+                           {"t:" + w for w in words_b} | {"i:" + i for i in ingredients_b})
+        return combined if combined >= DUPLICATE_THRESHOLD else 0.0
+
+    def _candidates(self, title, signature):
+        ids = set(self.titles.get(title, ()))
+        if signature:
+            for key in self._bands(signature):
+                ids |= self.buckets.get(key, set())
+        return ids
+
+    def find(self, recipe, limit=3):
+        """[(recipe, score)] of indexed near-duplicates of `recipe`, best first (itself excluded)."""
+        probe = (self._fingerprint(recipe),) + self._features(recipe) + (recipe,)
+        matches = []
+        for other_id in self._candidates(probe[1], probe[4]):
+            if other_id == recipe.get('id'):
+                continue
+            score = self._score(probe, self.docs[other_id])
+            if score:
+                matches.append((self.docs[other_id][5], score))
+        matches.sort(key=lambda m: -m[1])
+        return matches[:limit]
+
+    def groups(self):
+        """Clusters of near-duplicates across the whole index: [([recipes], best score)], biggest first."""
+        parent = {}
+
+        def root(i):
+            while parent.get(i, i) != i:
+                i = parent[i]
+            return i
+
+        best = {}
+        for recipe_id, doc in self.docs.items():
+            for other_id in self._candidates(doc[1], doc[4]):
+                if other_id <= recipe_id:
+                    continue
+                score = self._score(doc, self.docs[other_id])
+                if score:
+                    a, b = root(recipe_id), root(other_id)
+                    if a != b:
+                        parent[b] = a
+                    best[(recipe_id, other_id)] = score
+
+        clusters, scores = {}, {}
+        for (a, b), score in best.items():
+            key = root(a)
+            clusters.setdefault(key, set()).update((a, b))
+            scores[key] = max(scores.get(key, 0.0), score)
+        result = []
+        for key, members in clusters.items():
+            # Best-kept copy first: highest rated, then the most complete
+            recipes = sorted((self.docs[i][5] for i in members),
+                             key=lambda r: (-(r.get('rating') or 0), -len(r.get('ingredients') or []), r.get('name') or ""))
+            result.append((recipes, scores[key]))
+        result.sort(key=lambda g: (-len(g[0]), -g[1]))
+        return result
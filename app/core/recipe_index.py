@@ -0,0 +1,240 @@
+import re
+import bisect
+import math
+
+# Field weights: a term in the title counts more than one in the ingredient list
+NAME_WEIGHT = 3.0
+INGREDIENT_WEIGHT = 1.0
+# A query term that only prefixes an indexed term ('chick' -> 'chickpea') scores this much less
+PREFIX_PENALTY = 0.5
+
+FACETS = ("category", "protein", "rating")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or "").lower())
+
+def _discard(postings, key, recipe_id):
+    """Removes recipe_id from postings[key], dropping the key once it is empty."""
+    ids = postings.get(key)
+    if ids is not None:
+        ids.discard(recipe_id)
+        if not ids:
+            del postings[key]
+
+class RecipeIndex:
+    """In-memory inverted index over a cookbook.
+
+    term -> {recipe_id: weight} postings for names and ingredients, a sorted term
+    list for prefix lookups, and facet postings (category, protein, rating).
+    Titles are also kept as exact and cleaned lookup keys with word postings,
+    for find_title(). add()/remove() keep everything current one recipe at a time.
+    """
+    def __init__(self, recipes=(), title_key=None):
+        self.title_key = title_key or (lambda title: (title or "").lower().strip())
+        self.exact_titles = {}    # name.lower() -> {recipe_id}
+        self.clean_titles = {}    # title_key(name) -> {recipe_id}
+        self.title_postings = {}  # word of the cleaned title -> {recipe_id}
+        self.postings = {}
+        self.terms = []     # sorted, for prefix matching
+        self.facets = {facet: {} for facet in FACETS}
+        self.docs = {}      # recipe_id -> (term weights, facet values, recipe, title keys)
+        self.order = {}     # recipe_id -> insertion sequence, for stable unranked listings
+        self._seq = 0
+        for recipe in recipes:
+            self.add(recipe)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _weights(self, recipe):
+        weights = {}
+        for token in tokenize(recipe.get('name')):
+            weights[token] = weights.get(token, 0.0) + NAME_WEIGHT
+        for line in recipe.get('ingredients') or []:
+            for token in tokenize(line):
+                weights[token] = weights.get(token, 0.0) + INGREDIENT_WEIGHT
+        return weights
+
+    def add(self, recipe):
+        """Indexes a recipe, replacing any previous version with the same id."""
+        recipe_id = recipe['id']
+        if recipe_id in self.docs:
+            self.remove(recipe_id, keep_position=True)
+        weights = self._weights(recipe)
+        facets = {
+            "category": recipe.get('category'),
+            "protein": recipe.get('protein'),
+            "rating": int(recipe.get('rating') or 0),
+        }
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[recipe_id] = weight
+        for facet, value in facets.items():
+            self.facets[facet].setdefault(value, set()).add(recipe_id)
+        titles = self._title_keys(recipe)
+        exact, cleaned, words = titles
+        self.exact_titles.setdefault(exact, set()).add(recipe_id)
+        self.clean_titles.setdefault(cleaned, set()).add(recipe_id)
+        for word in words:
+            self.title_postings.setdefault(word, set()).add(recipe_id)
+        self.docs[recipe_id] = (weights, facets, recipe, titles)
+        if recipe_id not in self.order:
+            self.order[recipe_id] = self._seq
+            self._seq += 1
+
+    def remove(self, recipe_id, keep_position=False):
+        doc = self.docs.pop(recipe_id, None)
+        if doc is None:
+            return
+        weights, facets, _, (exact, cleaned, words) = doc
+        _discard(self.exact_titles, exact, recipe_id)
+        _discard(self.clean_titles, cleaned, recipe_id)
+        for word in words:
+            _discard(self.title_postings, word, recipe_id)
+        for term in weights:
+            posting = self.postings[term]
+            posting.pop(recipe_id, None)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        for facet, value in facets.items():
+            _discard(self.facets[facet], value, recipe_id)
+        if not keep_position:
+            self.order.pop(recipe_id, None)
+
+    def _title_keys(self, recipe):
+        cleaned = self.title_key(recipe.get('name'))
+        return (recipe.get('name') or "").lower().strip(), cleaned, frozenset(cleaned.split())
+
+    def get(self, recipe_id):
+        doc = self.docs.get(recipe_id)
+        return doc[2] if doc else None
+
+    def _expand(self, token):
+        """{recipe_id: score} for one query token: its exact term plus every term it prefixes."""
+        scores = {}
+        start = bisect.bisect_left(self.terms, token)
+        for term in self.terms[start:]:
+            if not term.startswith(token):
+                break
+            posting = self.postings[term]
+            idf = math.log(1 + len(self.docs) / len(posting))
+            factor = idf if term == token else idf * PREFIX_PENALTY
+            for recipe_id, weight in posting.items():
+                score = weight * factor
+                if score > scores.get(recipe_id, 0.0):
+                    scores[recipe_id] = score
+        return scores
+
+    def _facet_filter(self, category=None, protein=None, min_rating=None):
+        """Ids allowed by the facet filters, or None when no filter is set."""
+        allowed = None
+        for facet, value in (("category", category), ("protein", protein)):
+            if value:
+                ids = self.facets[facet].get(value, set())
+                allowed = set(ids) if allowed is None else allowed & ids
+        if min_rating:
+            rated = set()
+            for rating, ids in self.facets["rating"].items():
+                if rating >= int(min_rating):
+                    rated |= ids
+            allowed = rated if allowed is None else allowed & rated
+        return allowed
+
+    def search(self, query=None, category=None, protein=None, min_rating=None, limit=None):
+        """Recipes matching every query term (each as a word or word prefix) and the facet filters.
+
+        With a query, results are ranked by tf-idf score (then rating); without
+        one, they keep cookbook order.
+        """
+        allowed = self._facet_filter(category, protein, min_rating)
+        tokens = list(dict.fromkeys(tokenize(query)))
+
+        if not tokens:
+            ids = self.docs.keys() if allowed is None else allowed
+            ranked = sorted(ids, key=lambda i: self.order[i])
+        else:
+            # Rarest term first so the running intersection stays small
+            expanded = sorted((self._expand(token) for token in tokens), key=len)
+            scores = dict(expanded[0])
+            for term_scores in expanded[1:]:
+                scores = {i: s + term_scores[i] for i, s in scores.items() if i in term_scores}
+                if not scores:
+                    break
+            if allowed is not None:
+                scores = {i: s for i, s in scores.items() if i in allowed}
+            ranked = sorted(scores, key=lambda i: (-scores[i], -self.docs[i][1]["rating"], self.order[i]))
+
+        if limit:
+            ranked = ranked[:limit]
+        return [self.docs[i][2] for i in ranked]
+
+    def _prefixed(self, word):
+        """Ids whose name or ingredients have a term starting with `word` (a superset; callers verify)."""
+        tokens = tokenize(word)
+        if not tokens:
+            return set(self.title_postings.get(word, set()))
+        prefix = tokens[-1]
+        ids = set()
+        for term in self.terms[bisect.bisect_left(self.terms, prefix):]:
+            if not term.startswith(prefix):
+                break
+            ids.update(self.postings[term])
+        return ids
+
+    def _first(self, ids):
+        """The id earliest in cookbook order (what a front-to-back scan would find)."""
+        return min(ids, key=lambda i: self.order[i]) if ids else None
+
+    def find_title(self, name, min_jaccard=0.4):
+        """Best recipe for a meal name, trying in turn:
+
+        id, exact name, cleaned name, a cleaned recipe title contained in the name
+        ('Beef Stew' for 'Beef Stew Leftovers'), the name contained in a recipe title,
+        then word-overlap (Jaccard) among recipes sharing at least one word.
+        """
+        if name in self.docs:
+            return self.get(name)
+        target = self.title_key(name)
+
+        hit = self._first(self.exact_titles.get(target)) or self._first(self.clean_titles.get(target))
+        if hit:
+            return self.get(hit)
+
+        words = target.split()
+        if not words:
+            return None
+
+        # Recipe title inside the target: every run of whole words is a hash lookup
+        contained = set()
+        for i in range(len(words)):
+            for j in range(i + 1, len(words) + 1):
+                contained |= self.clean_titles.get(" ".join(words[i:j]), set())
+        if contained:
+            return self.get(self._first(contained))
+
+        # Target inside a recipe title: only titles holding every target word can qualify.
+        # The last word may be cut short ('lentil so'), so it matches as a prefix.
+        postings = [self.title_postings.get(w, set()) for w in set(words[:-1])]
+        postings.append(self._prefixed(words[-1]))
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        hit = self._first({i for i in candidates if target in self.docs[i][3][1]})
+        if hit:
+            return self.get(hit)
+
+        # Jaccard over titles that share at least one word
+        target_words = set(words)
+        shared = set().union(*(self.title_postings.get(w, set()) for w in target_words))
+        best, best_score = None, 0.0
+        for recipe_id in sorted(shared, key=lambda i: self.order[i]):
+            title_words = self.docs[recipe_id][3][2]
+            score = len(target_words & title_words) / len(target_words | title_words)
+            if score > best_score:
+                best, best_score = recipe_id, score
+        return self.get(best) if best_score > min_jaccard else None
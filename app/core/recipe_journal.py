@@ -0,0 +1,74 @@
+import os
+import json
+import threading
+
+# One lock per journal file, shared by every manager instance in the process
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+
+def _lock_for(path):
+    with _LOCKS_GUARD:
+        return _LOCKS.setdefault(os.path.abspath(path), threading.RLock())
+
+class RecipeJournal:
+    """Append-only JSONL log of recipes not yet merged into the cookbook.
+
+    Each append is one line, flushed and fsynced, so a crash loses at most the
+    line being written (a torn last line is skipped on read). merge() folds the
+    entries into the cookbook and truncates the log.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = _lock_for(path)
+
+    def append(self, recipe):
+        line = json.dumps(recipe, ensure_ascii=False)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with self.lock, open(self.path, 'r', encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    print(f"DEBUG: Skipping torn journal line {n} in {self.path}")
+        return entries
+
+    def clear(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def merge(self, load, save):
+        """Upserts journalled recipes (by id) into load()'s list, save()s it and clears the journal.
+
+        A recipe already in the cookbook keeps its stored rating, which may have
+        changed while the sync ran. Returns how many entries were merged.
+        """
+        with self.lock:
+            entries = self.entries()
+            if not entries:
+                return 0
+            recipes = load()
+            positions = {r.get('id'): n for n, r in enumerate(recipes)}
+            for entry in entries:
+                n = positions.get(entry.get('id'))
+                if n is None:
+                    positions[entry.get('id')] = len(recipes)
+                    recipes.append(entry)
+                else:
+                    entry['rating'] = recipes[n].get('rating', entry.get('rating', 0))
+                    recipes[n] = entry
+            save(recipes)
+            self.clear()
+            return len(entries)
@@ -0,0 +1,256 @@
+import os
+import json
+import math
+import hashlib
+import tempfile
+import threading
+from app.core.pantry_matcher import normalize_tokens
+from app.core.recipe_dedupe import ingredient_names
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Hashed feature space. Rows are sparse (a recipe has ~30 features), so a wide space costs
+# nothing per recipe and keeps unrelated words from sharing a column.
+VECTOR_DIM = 1 << 18
+# Bump when the features change, so cached vectors from older code are rebuilt
+FEATURES_VERSION = 2
+# A title word counts this much more than an ingredient word
+NAME_WEIGHT = 2.0
+# Matches scoring below this cosine aren't worth showing
+MIN_SIMILARITY = 0.1
+# Local, rebuildable vector caches (never the state/ mount: that's gcsfuse in production)
+CACHE_DIR = os.environ.get("ARBY_CACHE_DIR") or os.path.join(tempfile.gettempdir(), 'arby', 'vectors')
+# Filler in titles and cravings ("something spicy with chickpeas"), after normalize_tokens
+# (which already drops "a", "the", "some", ...)
+STOP_WORDS = {
+    "and", "or", "with", "without", "in", "on", "for", "from", "into", "at", "by", "my", "me",
+    "i", "we", "it", "is", "be", "can", "could", "would", "should", "like", "want", "wanna",
+    "need", "feel", "feeling", "make", "something", "anything", "thing", "kind", "sort", "maybe",
+    "really", "very", "quite", "just", "tonight", "today", "dinner", "lunch", "meal", "dish",
+    "recipe", "please", "that", "this", "what", "any", "more", "less", "up", "style",
+}
+
+def available():
+    return np is not None
+
+def _slot(feature):
+    """Column and sign for a feature (signed hashing keeps collisions from piling up)."""
+    h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+    return h % VECTOR_DIM, (1.0 if h >> 63 else -1.0)
+
+def _words_and_bigrams(words, weight, counts):
+    for word in words:
+        counts["w:" + word] = counts.get("w:" + word, 0.0) + weight
+    for a, b in zip(words, words[1:]):
+        counts[f"b:{a} {b}"] = counts.get(f"b:{a} {b}", 0.0) + weight
+
+def _content_words(text):
+    return [word for word in normalize_tokens(text) if word not in STOP_WORDS]
+
+def recipe_features(recipe):
+    """Weighted n-gram features of a recipe: title words and bigrams, ingredient names and their words."""
+    counts = {}
+    _words_and_bigrams(_content_words(recipe.get('name')), NAME_WEIGHT, counts)
+    for name in ingredient_names(recipe.get('ingredients')):
+        counts["i:" + name] = counts.get("i:" + name, 0.0) + 1.0
+        _words_and_bigrams(name.split("_"), 1.0, counts)
+    return counts
+
+def text_features(text, ingredients=()):
+    """Features of a free-text craving ("something spicy with chickpeas"), comparable to recipe_features.
+
+    Only words (or adjacent word pairs) found in `ingredients`, the known ingredient
+    names, also count as ingredients.
+    """
+    counts = {}
+    words = _content_words(text)
+    _words_and_bigrams([part for word in words for part in word.split("_")], 1.0, counts)
+    for name in words + [f"{a}_{b}" for a, b in zip(words, words[1:])]:
+        if name in ingredients:
+            counts["i:" + name] = counts.get("i:" + name, 0.0) + 1.0
+    return counts
+
+def vectorize(counts):
+    """Sparse vector of a feature dict: (sorted column ids, weights)."""
+    columns = {}
+    for feature, weight in counts.items():
+        column, sign = _slot(feature)
+        columns[column] = columns.get(column, 0.0) + sign * (1.0 + math.log(weight))  # sublinear term frequency
+    columns = {c: v for c, v in columns.items() if v}
+    order = sorted(columns)
+    return np.array(order, dtype=np.int32), np.array([columns[c] for c in order], dtype=np.float32)
+
+def _fingerprint(recipe):
+    payload = json.dumps([recipe.get('name') or "", recipe.get('ingredients') or []])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+class VectorIndex:
+    """TF-IDF style similarity over sparse hashed n-gram vectors.
+
+    Each recipe keeps only its non-zero columns, with a fingerprint so sync() only
+    re-vectorises recipes whose name or ingredients changed. IDF weights and row
+    norms are computed from the rows when first queried after a change. The rows
+    are cached in a local file (CACHE_DIR, keyed by the state folder) so a restart
+    doesn't re-vectorise everything; it is only a cache and is rebuilt if missing.
+    """
+    def __init__(self, state_dir, cache_dir=None):
+        key = hashlib.sha1(os.path.abspath(state_dir).encode('utf-8')).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir or CACHE_DIR, f"{key}.npz")
+        self._lock = threading.RLock()
+        self.recipes = {}   # recipe id -> recipe, from the last sync()
+        self._drop_legacy_files(state_dir)
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _drop_legacy_files(state_dir):
+        """Removes the dense matrix older versions kept next to the cookbook (hundreds of MB on big cookbooks)."""
+        for name in ('recipe_vectors.npy', 'recipe_vectors.json', 'recipe_vectors.lock'):
+            try:
+                os.remove(os.path.join(state_dir, name))
+            except OSError:
+                pass
+
+    def load(self):
+        self.ids = []           # row -> recipe id
+        self.rows = {}          # recipe id -> row
+        self.fingerprints = {}  # recipe id -> fingerprint of the vectorised name/ingredients
+        self.columns = []       # row -> column ids
+        self.weights = []       # row -> weights
+        self._prepared = None   # (row of each entry, column ids, IDF-weighted L2-normalised weights)
+        self._ingredients = None  # ingredient names across self.recipes, for text queries
+        if np is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                if int(cache['dim']) != VECTOR_DIM or int(cache['version']) != FEATURES_VERSION:
+                    raise ValueError("built by other code")
+                ids, fingerprints = cache['ids'].tolist(), cache['fingerprints'].tolist()
+                offsets, columns, weights = cache['offsets'], cache['columns'], cache['weights']
+        except Exception as e:
+            print(f"DEBUG: Rebuilding recipe vectors ({e}).")
+            return
+        self.ids = ids
+        self.rows = {recipe_id: row for row, recipe_id in enumerate(ids)}
+        self.fingerprints = dict(zip(ids, fingerprints))
+        self.columns = [columns[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        self.weights = [weights[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def _save(self):
+        lengths = [len(c) for c in self.columns]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        try:
+            np.savez(tmp, dim=VECTOR_DIM, version=FEATURES_VERSION,
+                     ids=np.array(self.ids, dtype=str), fingerprints=np.array([self.fingerprints[i] for i in self.ids], dtype=str),
+                     offsets=offsets,
+                     columns=np.concatenate(self.columns) if self.columns else np.zeros(0, dtype=np.int32),
+                     weights=np.concatenate(self.weights) if self.weights else np.zeros(0, dtype=np.float32))
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"DEBUG: Couldn't cache recipe vectors: {e}")
+
+    def _remove(self, recipe_id):
+        """Drops a row by moving the last row into its place."""
+        row = self.rows.pop(recipe_id)
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row], self.columns[row], self.weights[row] = moved, self.columns[last], self.weights[last]
+            self.rows[moved] = row
+        self.ids.pop()
+        self.columns.pop()
+        self.weights.pop()
+        self.fingerprints.pop(recipe_id, None)
+
+    def sync(self, recipes):
+        """Brings the vectors in line with a recipe list. Returns how many rows were written or removed."""
+        if np is None:
+            return 0
+        with self._lock:
+            self.recipes = {r['id']: r for r in recipes if r.get('id')}
+            self._ingredients = None
+            changed = 0
+            for recipe_id in [i for i in self.ids if i not in self.recipes]:
+                self._remove(recipe_id)
+                changed += 1
+            for recipe_id, recipe in self.recipes.items():
+                fingerprint = _fingerprint(recipe)
+                if self.fingerprints.get(recipe_id) == fingerprint:
+                    continue
+                columns, weights = vectorize(recipe_features(recipe))
+                row = self.rows.get(recipe_id)
+                if row is None:
+                    row = self.rows[recipe_id] = len(self.ids)
+                    self.ids.append(recipe_id)
+                    self.columns.append(columns)
+                    self.weights.append(weights)
+                else:
+                    self.columns[row], self.weights[row] = columns, weights
+                self.fingerprints[recipe_id] = fingerprint
+                changed += 1
+            if changed:
+                self._prepared = None
+                self._save()
+            return changed
+
+    def _prepare(self):
+        if self._prepared is None:
+            n = len(self.ids)
+            lengths = np.array([len(c) for c in self.columns], dtype=np.int64)
+            row_of = np.repeat(np.arange(n), lengths)
+            columns = np.concatenate(self.columns) if n else np.zeros(0, dtype=np.int32)
+            weights = np.concatenate(self.weights) if n else np.zeros(0, dtype=np.float32)
+            df = np.bincount(columns, minlength=VECTOR_DIM)  # a column appears at most once per row
+            self._idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+            weighted = weights * self._idf[columns]
+            norms = np.sqrt(np.bincount(row_of, weights=weighted * weighted, minlength=n))
+            norms[norms == 0] = 1.0
+            self._prepared = (row_of, columns, (weighted / norms[row_of]).astype(np.float32))
+        return self._prepared
+
+    def _top(self, columns, weights, limit, exclude=()):
+        row_of, all_columns, all_weights = self._prepare()
+        n = len(self.ids)
+        if not n:
+            return []
+        query = weights * self._idf[columns]
+        norm = np.linalg.norm(query)
+        if not norm:
+            return []
+        dense = np.zeros(VECTOR_DIM, dtype=np.float32)
+        dense[columns] = query / norm
+        scores = np.bincount(row_of, weights=all_weights * dense[all_columns], minlength=n)
+        k = min(limit + len(exclude), n)
+        best = np.argpartition(-scores, k - 1)[:k]
+        results = []
+        for row in best[np.argsort(-scores[best])]:
+            recipe_id = self.ids[row]
+            if recipe_id in exclude or scores[row] < MIN_SIMILARITY or recipe_id not in self.recipes:
+                continue
+            results.append((self.recipes[recipe_id], float(scores[row])))
+        return results[:limit]
+
+    def similar(self, recipe_id, limit=5):
+        """[(recipe, cosine)] closest to an indexed recipe, itself excluded."""
+        with self._lock:
+            row = self.rows.get(recipe_id)
+            if np is None or row is None:
+                return []
+            return self._top(self.columns[row], self.weights[row], limit, exclude={recipe_id})
+
+    def query(self, text, limit=5):
+        """[(recipe, cosine)] closest to a free-text description."""
+        with self._lock:
+            if np is None or not self.ids:
+                return []
+            if self._ingredients is None:
+                self._ingredients = set().union(*(ingredient_names(r.get('ingredients')) for r in self.recipes.values()))
+            columns, weights = vectorize(text_features(text, self._ingredients))
+            return self._top(columns, weights, limit)
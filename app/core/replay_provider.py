@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import time
+import types
+import random
+import hashlib
+import threading
+import typing
+from pydantic import BaseModel
+from app.core.schemas import WeeklyPlan
+
+# Placeholder dishes so replayed plans look like plans in the UI
+FAKE_DISHES = [
+    "Lemon Herb Chicken", "Beef Stew", "Mushroom Risotto", "Salmon Tacos", "Veggie Stir Fry",
+    "Shrimp Fried Rice", "Black Bean Chili", "Pesto Pasta", "Greek Salad", "Overnight Oats",
+]
+FAKE_INGREDIENTS = ["1 lb chicken breast", "2 cups rice", "1 yellow onion", "2 cloves garlic", "1 tbsp olive oil"]
+
+class LatencyModel:
+    """Synthetic latency parsed from a spec string.
+
+    "recorded" (replay what was captured), "fixed:800", "uniform:200,1500"
+    or "lognormal:1200,0.5" (median ms, sigma). Values are milliseconds.
+    """
+    def __init__(self, spec="recorded", rng=None):
+        self.spec = (spec or "recorded").strip().lower()
+        self.rng = rng or random.Random()
+        kind, _, args = self.spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a.strip()]
+
+    def sample_ms(self, recorded_ms=None):
+        if self.kind == "fixed" and self.args:
+            return self.args[0]
+        if self.kind == "uniform" and len(self.args) == 2:
+            return self.rng.uniform(self.args[0], self.args[1])
+        if self.kind == "lognormal" and len(self.args) == 2:
+            return self.args[0] * self.rng.lognormvariate(0, self.args[1])
+        return recorded_ms or 0
+
+class ReplayProvider:
+    """Drop-in provider for ModelManager.providers that records or replays responses.
+
+    record: forwards to `inner` and stores each response under a hash of the request.
+    replay: serves stored responses (no network); on a miss it fabricates data
+            that validates against the requested pydantic schema.
+    """
+    def __init__(self, mode, store_dir, inner=None, latency="recorded"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown replay mode: {mode}")
+        if mode == "record" and inner is None:
+            raise ValueError("Record mode needs a real provider to wrap.")
+        self.mode = mode
+        self.store_dir = store_dir
+        self.inner = inner
+        self.latency = LatencyModel(latency)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    # --- Storage ---
+
+    def request_key(self, model_id, system_instruction, user_prompt, schema=None):
+        payload = json.dumps({
+            "model": model_id,
+            "system": system_instruction,
+            "user": user_prompt,
+            "schema": schema.__name__ if schema else None,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.store_dir, f"{key}.json")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"DEBUG: Corrupt replay entry {path}: {e}")
+            return None
+
+    def _save(self, key, entry):
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp, self._path(key))
+
+    def _sleep(self, recorded_ms=None):
+        delay = self.latency.sample_ms(recorded_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    # --- Provider interface ---
+
+    def ping(self, model_id):
+        if self.mode == "record":
+            return self.inner.ping(model_id)
+        return True
+
+    def generate(self, model_id, system_instruction, user_prompt, files=None, schema=WeeklyPlan, max_output_tokens=None, usage=None):
+        key = self.request_key(model_id, system_instruction, user_prompt, schema)
+
+        if self.mode == "record":
+            captured = {}
+            started = time.time()
+            result = self.inner.generate(model_id, system_instruction, user_prompt, files, schema=schema,
+                                         max_output_tokens=max_output_tokens, usage=captured)
+            self._save(key, {
+                "model_id": model_id,
+                "schema": schema.__name__ if schema else None,
+                "latency_ms": int((time.time() - started) * 1000),
+                "usage": captured,
+                "result": result,
+            })
+            if usage is not None:
+                usage.update(captured)
+            return result
+
+        entry = self._load(key)
+        with self._lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry:
+            self._sleep(entry.get("latency_ms"))
+            if usage is not None:
+                usage.update(entry.get("usage") or {})
+            return entry["result"]
+
+        self._sleep()
+        result = fake_for_schema(schema, prompt=f"{system_instruction}\n{user_prompt}", seed=key)
+        if usage is not None:
+            usage.update({
+                "input_tokens": (len(system_instruction or "") + len(user_prompt or "")) // 4,
+                "output_tokens": len(json.dumps(result)) // 4,
+                "cached_tokens": 0,
+            })
+        return result
+
+    def simple_generate(self, model_id, system_instruction, user_prompt):
+        key = self.request_key(model_id, system_instruction, user_prompt)
+        if self.mode == "record":
+            text = self.inner.simple_generate(model_id, system_instruction, user_prompt)
+            self._save(key, {"model_id": model_id, "schema": None, "latency_ms": 0, "usage": {}, "result": text})
+            return text
+        entry = self._load(key)
+        self._sleep(entry.get("latency_ms") if entry else None)
+        return entry["result"] if entry else "OK"
+
+# --- Schema-valid fake data ---
+
+def fake_for_schema(schema, prompt="", seed=None):
+    """Builds a dict that validates against `schema`, using any YYYY-MM-DD dates found in the prompt."""
+    rng = random.Random(seed)
+    dates = list(dict.fromkeys(re.findall(r'\b\d{4}-\d{2}-\d{2}\b', prompt or "")))
+    state = {"dates": dates, "date_pos": 0}
+    data = _fake_model(schema, rng, state)
+    # Round-trip through the schema so callers get exactly what a real provider returns
+    return schema(**data).model_dump()
+
+def _fake_model(model, rng, state):
+    out = {}
+    for name, field in model.model_fields.items():
+        out[name] = _fake_value(name, field.annotation, rng, state)
+    return out
+
+def _fake_value(name, annotation, rng, state):
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if origin in (typing.Union, types.UnionType):
+        non_null = [a for a in args if a is not type(None)]
+        # Optional scalars stay empty (so fake indexes never point at real rows);
+        # optional sub-models such as meal slots are filled in.
+        if non_null and isinstance(non_null[0], type) and issubclass(non_null[0], BaseModel):
+            return _fake_model(non_null[0], rng, state)
+        return None
+
+    if origin in (list, typing.List):
+        inner = args[0] if args else str
+        if name == "days" and state["dates"]:
+            count = len(state["dates"])
+        elif name == "ingredients" and inner is str:
+            return rng.sample(FAKE_INGREDIENTS, 3)
+        else:
+            count = rng.randint(1, 3)
+        return [_fake_value(name, inner, rng, state) for _ in range(count)]
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _fake_model(annotation, rng, state)
+
+    if annotation is bool:
+        return False
+    if annotation is int:
+        return rng.randint(0, 5) if name == "rating" else rng.randint(1, 14)
+    if annotation is float:
+        return float(rng.randint(1, 4))
+    if annotation is str:
+        if name == "date":
+            dates = state["dates"]
+            if dates:
+                value = dates[state["date_pos"] % len(dates)]
+                state["date_pos"] += 1
+                return value
+            return time.strftime("%Y-%m-%d")
+        if name in ("name", "item"):
+            return rng.choice(FAKE_DISHES)
+        if name == "source":
+            return "chef"
+        if name == "unit":
+            return "ct"
+        if name == "category":
+            return "Main"
+        if name == "protein":
+            return "Vegetarian"
+        if name == "id":
+            return f"replay-{rng.randrange(1 << 32):08x}"
+        return f"Replay {name.replace('_', ' ')}"
+    return None
@@ -1,9 +1,11 @@
 import os
+import re
 import json
 import google.genai as genai
 from google.genai import types
 from pydantic import BaseModel
 from typing import List
+from app.core.recipe_dedupe import same_content
 
 class ReviewAction(BaseModel):
     action_type: str  # "SAVE_RECIPE" or "BLACKLIST" or "LEARN_PREFERENCE"
@@ -15,9 +17,11 @@ class ReviewResult(BaseModel):
     summary_message: str
 
 class ReviewManager:
-    def __init__(self, state_dir, model_manager=None):
+    def __init__(self, state_dir, model_manager=None, cookbook_manager=None):
         self.state_dir = state_dir
         self.model_manager = model_manager
+        # Checked for near-duplicates before saving a recipe
+        self.cookbook_manager = cookbook_manager
         self.blacklist_file = os.path.join(state_dir, 'blacklist.json')
         # Recipes saved to user's 'recipes' folder
         self.recipes_dir = os.path.join(state_dir, 'recipes')
@@ -58,7 +62,8 @@ class ReviewManager:
                     model_id=model_id,
                     system_instruction=prompt,
                     user_prompt="Analyze feedback",
-                    schema=ReviewResult
+                    schema=ReviewResult,
+                    call_site="feedback"
                 )
                 result = ReviewResult(**result)
             else:
@@ -77,8 +82,11 @@ class ReviewManager:
             
             for action in result.actions:
                 if action.action_type == "SAVE_RECIPE":
-                    self._save_recipe(action.item_name, action.content)
-                    messages.append(f"Saved recipe: {action.item_name}")
+                    existing = self._save_recipe(action.item_name, action.content)
+                    if existing:
+                        messages.append(f"Already saved: {action.item_name} (as {existing})")
+                    else:
+                        messages.append(f"Saved recipe: {action.item_name}")
                     
                 elif action.action_type == "BLACKLIST":
                     self._add_to_blacklist(action.item_name)
@@ -91,7 +99,23 @@ class ReviewManager:
             return f"Error: {e}"
 
     def _save_recipe(self, name, content):
-        """Saves a recipe as a markdown file in the PDF/Recipe folder."""
+        """Saves a recipe as a markdown file in the PDF/Recipe folder.
+
+        Returns the name of an existing recipe instead of saving, if one has the same
+        ingredients and steps. A near-duplicate that differs (e.g. a customized version)
+        is still saved.
+        """
+        if self.cookbook_manager:
+            # Bullet lines of the markdown are the ingredients, numbered lines the steps
+            lines = [l.strip() for l in content.splitlines()]
+            recipe = {"name": name,
+                      "ingredients": [l[2:] for l in lines if l[:2] in ("- ", "* ")],
+                      "instructions": [re.sub(r"^\d+[.)]\s*", "", l) for l in lines if re.match(r"\d+[.)]\s", l)]}
+            matches = self.cookbook_manager.find_duplicates(recipe, limit=1)
+            if matches and same_content(matches[0], recipe):
+                print(f"DEBUG: Not saving '{name}': same recipe as '{matches[0]['name']}' in the cookbook.")
+                return matches[0]['name']
+
         # Sanitize filename
         safe_name = "".join([c for c in name if c.isalpha() or c.isdigit() or c==' ']).strip()
         filename = f"{safe_name}.md"
@@ -99,6 +123,7 @@ class ReviewManager:
         
         with open(path, 'w') as f:
             f.write(content)
+        return None
             
     def _add_to_blacklist(self, item):
         """Adds an item to the blacklist json."""
@@ -0,0 +1,75 @@
+import json
+import hashlib
+import threading
+
+class SupersededError(Exception):
+    """Raised to every caller of an in-flight operation that a newer, different request replaced."""
+
+def fingerprint(*parts):
+    """Stable hash of the inputs that decide an operation's result."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class _Call:
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.superseded = False
+        self.waiters = 1
+
+class SingleFlight:
+    """Coalesces duplicate in-flight work per (user, operation).
+
+    - Same fingerprint while a call is running: the caller waits and gets the same result.
+    - Different fingerprint: the running call is marked superseded. It keeps running
+      (LLM calls can't be aborted mid-request) but its callers get SupersededError
+      instead of a stale result, and `fn` can poll `cancelled()` to stop early.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # (user_id, operation) -> _Call
+
+    def do(self, user_id, operation, fp, fn):
+        """Runs fn(cancelled) once per identical in-flight request and returns its result."""
+        slot = (user_id, operation)
+        with self._lock:
+            call = self._calls.get(slot)
+            if call and call.fingerprint == fp and not call.superseded:
+                call.waiters += 1
+                leader = False
+            else:
+                if call:
+                    call.superseded = True
+                    print(f"DEBUG: {operation} for {user_id} superseded by a newer request.")
+                call = _Call(fp)
+                self._calls[slot] = call
+                leader = True
+
+        if leader:
+            try:
+                call.result = fn(lambda: call.superseded)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    if self._calls.get(slot) is call:
+                        del self._calls[slot]
+                call.done.set()
+        else:
+            print(f"DEBUG: Joining in-flight {operation} for {user_id}.")
+            call.done.wait()
+
+        if call.superseded:
+            raise SupersededError(f"{operation} was replaced by a newer request.")
+        if call.error:
+            raise call.error
+        return call.result
+
+    def in_flight(self, user_id, operation):
+        with self._lock:
+            return (user_id, operation) in self._calls
+
+# Process-wide registry shared by every (per-request) ArbyAgent
+FLIGHTS = SingleFlight()
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+def file_sha256(path, chunk_size=HASH_CHUNK_BYTES):
+    """SHA-256 of a file, read in chunks so big scans never hold a whole PDF in memory."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class FileState:
+    def __init__(self, relpath, path, size, mtime_ns, sha256):
+        self.relpath = relpath
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+
+class SyncManifest:
+    """What the library looked like at the last sync: relpath -> size, mtime and content hash.
+
+    Stored as sync_manifest.json next to the cookbook. A file is only re-hashed
+    when its size or mtime changed since it was last seen.
+    """
+    def __init__(self, state_dir):
+        self.manifest_file = os.path.join(state_dir, 'sync_manifest.json')
+        self.files = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            return {}
+        try:
+            with open(self.manifest_file, 'r') as f:
+                return json.load(f).get('files', {})
+        except Exception as e:
+            print(f"DEBUG: Ignoring unreadable sync manifest: {e}")
+            return {}
+
+    def save(self):
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": 1, "files": self.files}, f)
+        os.replace(tmp, self.manifest_file)
+
+    def scan(self, library_path, paths, progress=None, partial=False, removed=()):
+        """FileStates for `paths`; the manifest is updated to exactly these files (call save() after).
+
+        With partial=True only `paths` are (re)checked, the rest of the manifest is kept
+        and `removed` relpaths are dropped from it (incremental syncs from the watcher).
+        """
+        states, hashed = [], 0
+        seen = {k: v for k, v in self.files.items() if k not in set(removed)} if partial else {}
+        for n, path in enumerate(paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            relpath = os.path.relpath(path, library_path).replace(os.sep, '/')
+            entry = self.files.get(relpath)
+            if entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns and entry.get('sha256'):
+                sha = entry['sha256']
+            else:
+                sha = file_sha256(path)
+                hashed += 1
+                if progress and hashed % 50 == 0:
+                    progress(n, len(paths), f"Fingerprinting PDFs ({n}/{len(paths)})...")
+            seen[relpath] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha}
+            states.append(FileState(relpath, path, st.st_size, st.st_mtime_ns, sha))
+        self.files = seen
+        print(f"DEBUG: Sync manifest: {len(states)} PDFs, {hashed} (re)hashed.")
+        return states
+
+def classify(states, recipes, blacklist=(), present=None):
+    """Sorts scanned files into what the sync must do with them.
+
+    Returns {"new": [FileState], "modified": [(FileState, recipe)], "moved": [(FileState, recipe)],
+             "duplicate": [(FileState, recipe or FileState)], "unchanged": [...], "ignored": [...]}.
+    - new: content we have never extracted
+    - modified: the file a recipe came from now has different content
+    - moved: known content at a new path whose old path is gone (only `filename` needs updating)
+    - duplicate: known content while the original is still there (nothing to do)
+    Recipes synced before the manifest existed (basename filename, no content_hash) are adopted
+    by their basename when it is unambiguous.
+    Moves and adoptions are applied to the recipe dicts in place.
+    `present` is every relpath in the library (defaults to the scanned ones), for telling
+    moves from duplicates when only some files were scanned.
+    """
+    result = {key: [] for key in ("new", "modified", "moved", "duplicate", "unchanged", "ignored")}
+    blacklist = set(blacklist or ())
+    current = set(present) if present is not None else {s.relpath for s in states}
+    by_path, by_hash, legacy = {}, {}, {}
+    for recipe in recipes:
+        filename = recipe.get('filename')
+        if recipe.get('source') != 'pdf' or not filename:
+            continue
+        by_path[filename] = recipe
+        if recipe.get('content_hash'):
+            by_hash.setdefault(recipe['content_hash'], recipe)
+        else:
+            legacy.setdefault(os.path.basename(filename), []).append(recipe)
+    basename_counts = {}
+    for s in states:
+        name = os.path.basename(s.relpath)
+        basename_counts[name] = basename_counts.get(name, 0) + 1
+
+    claimed = {}  # sha256 -> first FileState holding it in this scan
+    for s in states:
+        basename = os.path.basename(s.relpath)
+        if s.relpath in blacklist or basename in blacklist:
+            result["ignored"].append(s)
+            continue
+
+        recipe = by_path.get(s.relpath)
+        if recipe is None and basename_counts[basename] == 1 and len(legacy.get(basename, [])) == 1:
+            # Pre-manifest recipe stored by basename: adopt it at its real path
+            recipe = legacy[basename][0]
+            recipe['filename'] = s.relpath
+
+        if recipe is not None:
+            if not recipe.get('content_hash'):
+                recipe['content_hash'] = s.sha256
+                by_hash.setdefault(s.sha256, recipe)
+            if recipe['content_hash'] == s.sha256:
+                result["unchanged"].append(s)
+            else:
+                result["modified"].append((s, recipe))
+            claimed.setdefault(s.sha256, s)
+            continue
+
+        original = by_hash.get(s.sha256)
+        if original is not None and original['filename'] not in current:
+            original['filename'] = s.relpath
+            result["moved"].append((s, original))
+            claimed.setdefault(s.sha256, s)
+        elif original is not None:
+            result["duplicate"].append((s, original))
+        elif s.sha256 in claimed:
+            result["duplicate"].append((s, claimed[s.sha256]))
+        else:
+            claimed[s.sha256] = s
+            result["new"].append(s)
+    return result
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+
+# Progress and per-file outcomes are written at most this often (the file grows with the
+# library, so rewriting it per file is quadratic). An outcome lost in a crash costs little:
+# extracted recipes are journalled and skipped via the manifest, a lost failure is retried.
+WRITE_INTERVAL_SECONDS = 0.5
+ACTIVE_STATUSES = ("queued", "running")
+
+def _blank():
+    return {
+        "status": "idle",       # idle | queued | running | done | cancelled | error | interrupted
+        "job_id": None,
+        "message": "Idle",
+        "current": 0,
+        "total": 0,
+        "percent": 0,
+        "queued": [],           # relpaths still waiting for extraction
+        "completed": {},        # relpath -> recipe name
+        "failed": {},           # relpath -> {"reason", "retries"}
+        "retries": {},          # relpath -> retries so far (rate limits)
+        "resume": False,        # re-queued after its job was lost; start() keeps the outcomes
+        "started_at": None,
+        "updated_at": None,
+    }
+
+class SyncState:
+    """Per-user library sync progress, persisted to sync_state.json.
+
+    The sync job writes it as it goes and the status endpoint reads it, so progress
+    survives a restart and looks the same from every gunicorn worker. A job that
+    is picked up again after a restart, or a job re-queued by requeue() after the
+    jobs database was lost, resumes it instead of starting over.
+    """
+    def __init__(self, state_dir):
+        self.path = os.path.join(state_dir, 'sync_state.json')
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+        self.data = self.load()
+
+    def load(self):
+        data = _blank()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data.update(json.load(f))
+            except Exception as e:
+                print(f"DEBUG: Ignoring unreadable sync state: {e}")
+        return data
+
+    def _write(self, force=True):
+        now = time.time()
+        if not force and now - self._last_write < WRITE_INTERVAL_SECONDS:
+            return
+        self._last_write = now
+        self.data["updated_at"] = now
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.data))
+
+    def mark_queued(self, job_id):
+        with self._lock:
+            self.data = _blank()
+            self.data.update(status="queued", job_id=job_id, message="Waiting to start sync...")
+            self._write()
+
+    def requeue(self, job_id):
+        """Hands an interrupted sync, and the outcomes recorded so far, to a new job."""
+        with self._lock:
+            self.data.update(status="queued", job_id=job_id, resume=True, message="Waiting to resume sync...")
+            self._write()
+
+    def start(self, job_id):
+        """Marks the sync running. Returns True when this job already ran before (resuming after a restart)."""
+        with self._lock:
+            resuming = self.data.get("job_id") == job_id and (
+                self.data.get("status") == "running" or self.data.get("resume"))
+            if not resuming:
+                self.data = _blank()
+                self.data.update(job_id=job_id, started_at=time.time())
+            self.data.update(status="running", resume=False,
+                             message="Resuming sync..." if resuming else "Starting sync...")
+            self._write()
+            return resuming
+
+    def set_queue(self, relpaths):
+        with self._lock:
+            self.data["queued"] = list(relpaths)
+            self._write()
+
+    def progress(self, current, total, message):
+        with self._lock:
+            self.data.update(current=current, total=total, message=message,
+                             percent=int(current / total * 100) if total > 0 else 0)
+            self._write(force=False)
+
+    def retry(self, relpath):
+        with self._lock:
+            retries = self.data["retries"]
+            retries[relpath] = retries.get(relpath, 0) + 1
+            self._write(force=False)
+
+    def complete(self, relpath, name):
+        with self._lock:
+            self._dequeue(relpath)
+            self.data["completed"][relpath] = name
+            self.data["failed"].pop(relpath, None)
+            self._write(force=False)
+
+    def fail(self, relpath, reason):
+        with self._lock:
+            self._dequeue(relpath)
+            self.data["failed"][relpath] = {"reason": str(reason), "retries": self.data["retries"].get(relpath, 0)}
+            self._write(force=False)
+
+    def _dequeue(self, relpath):
+        if relpath in self.data["queued"]:
+            self.data["queued"].remove(relpath)
+
+    def finish(self, status, message, percent=None):
+        with self._lock:
+            self.data.update(status=status, message=message)
+            if percent is not None:
+                self.data["percent"] = percent
+            self._write()
@@ -0,0 +1,175 @@
+import re
+from app.core.ingredient_parser import UNIT_ALIASES
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MASS, VOLUME, COUNT = "mass", "volume", "count"
+BASE_UNITS = {MASS: "g", VOLUME: "ml", COUNT: "ct"}
+
+# Canonical unit -> (dimension, size in the dimension's base unit: g, ml or ct)
+UNITS = {
+    "g": (MASS, 1.0),
+    "kg": (MASS, 1000.0),
+    "oz": (MASS, 28.3495),
+    "lb": (MASS, 453.592),
+    "ml": (VOLUME, 1.0),
+    "l": (VOLUME, 1000.0),
+    "ct": (COUNT, 1.0),
+}
+
+# Extra aliases the pantry uses that the line parser doesn't need
+_EXTRA_ALIASES = {"dozen": ("ct", 12), "doz": ("ct", 12)}
+
+# Density hints (g per ml) so volume and mass of the same staple can merge
+DENSITY_G_PER_ML = {
+    "flour": 0.53, "sugar": 0.85, "brown sugar": 0.9, "powdered sugar": 0.56,
+    "rice": 0.85, "oat": 0.41, "butter": 0.96, "milk": 1.03, "water": 1.0,
+    "oil": 0.92, "olive oil": 0.92, "honey": 1.42, "salt": 1.2, "cream": 1.0,
+    "heavy cream": 1.0, "yogurt": 1.03, "maple syrup": 1.32, "peanut butter": 1.08,
+    "cocoa": 0.42, "cornmeal": 0.65, "quinoa": 0.72, "lentil": 0.85, "broth": 1.0,
+}
+
+# Typical weight of one piece (g) so counted produce can merge with weighed produce
+EACH_GRAMS = {
+    "egg": 50, "onion": 150, "potato": 200, "sweet potato": 200, "apple": 180,
+    "banana": 120, "lemon": 100, "lime": 70, "tomato": 120, "avocado": 170,
+    "carrot": 60, "bell pepper": 150, "zucchini": 200, "cucumber": 250, "shallot": 40,
+}
+
+def canonical_unit(unit):
+    """(canonical unit, multiplier) for any alias we know, else (None, None)."""
+    key = (unit or "").strip().rstrip(".").lower()
+    if key in UNITS:
+        return key, 1.0
+    found = UNIT_ALIASES.get(key) or _EXTRA_ALIASES.get(key)
+    if found:
+        return found[0].lower(), float(found[1])
+    return None, None
+
+def dimension(unit):
+    canonical, _ = canonical_unit(unit)
+    return UNITS[canonical][0] if canonical else None
+
+def _hint(table, item):
+    """Longest table key contained in the item name ('brown sugar' before 'sugar')."""
+    words = re.findall(r"[a-z]+", (item or "").lower())
+    words = [w[:-1] if w.endswith("s") and not w.endswith("ss") else w for w in words]
+    name = f" {' '.join(words)} "
+    best = None
+    for key in table:
+        if f" {key} " in name and (best is None or len(key) > len(best)):
+            best = key
+    return table[best] if best else None
+
+def to_base(quantity, unit):
+    """(dimension, quantity in g/ml/ct) or (None, None) for units we don't know."""
+    canonical, multiplier = canonical_unit(unit)
+    if not canonical:
+        return None, None
+    dim, size = UNITS[canonical]
+    return dim, float(quantity) * multiplier * size
+
+def _bridge(value, from_dim, to_dim, item):
+    """Moves a base quantity across dimensions using the density / piece-weight hints."""
+    if from_dim == to_dim:
+        return value
+    grams = None
+    if from_dim == MASS:
+        grams = value
+    elif from_dim == VOLUME:
+        density = _hint(DENSITY_G_PER_ML, item)
+        grams = value * density if density else None
+    elif from_dim == COUNT:
+        each = _hint(EACH_GRAMS, item)
+        grams = value * each if each else None
+    if grams is None:
+        return None
+
+    if to_dim == MASS:
+        return grams
+    if to_dim == VOLUME:
+        density = _hint(DENSITY_G_PER_ML, item)
+        return grams / density if density else None
+    if to_dim == COUNT:
+        each = _hint(EACH_GRAMS, item)
+        return grams / each if each else None
+    return None
+
+def convert(quantity, from_unit, to_unit, item=None):
+    """Converts a quantity between units. Returns None when the units can't be bridged."""
+    from_dim, value = to_base(quantity, from_unit)
+    to_canonical, to_multiplier = canonical_unit(to_unit)
+    if from_dim is None or to_canonical is None:
+        return None
+    to_dim, to_size = UNITS[to_canonical]
+    value = _bridge(value, from_dim, to_dim, item)
+    if value is None:
+        return None
+    return value / (to_size * to_multiplier)
+
+def merge_quantities(quantity, unit, add_quantity, add_unit, item=None):
+    """Adds add_quantity (in add_unit) to quantity, keeping `unit`. None if incompatible."""
+    if (unit or "").lower() == (add_unit or "").lower():
+        return round(quantity + add_quantity, 2)
+    converted = convert(add_quantity, add_unit, unit, item)
+    if converted is None:
+        return None
+    return round(quantity + converted, 2)
+
+# Preferred display unit per dimension, by size of the base quantity
+_DISPLAY_STEPS = {
+    MASS: [(1000.0, "kg"), (0.0, "g")],
+    VOLUME: [(1000.0, "L"), (0.0, "ml")],
+}
+_IMPERIAL_MASS = [(453.592, "lb"), (0.0, "oz")]
+
+def to_display(quantity, unit):
+    """Readable (quantity, unit): 1500 g -> 1.5 kg, 40 oz -> 2.5 lb. Unknown units pass through."""
+    canonical, _ = canonical_unit(unit)
+    if not canonical or canonical == "ct":
+        return quantity, unit
+    dim, value = to_base(quantity, unit)
+    steps = _IMPERIAL_MASS if canonical in ("oz", "lb") else _DISPLAY_STEPS[dim]
+    for threshold, display_unit in steps:
+        if value >= threshold:
+            size = UNITS[display_unit.lower()][1]
+            shown = round(value / size, 2)
+            return (int(shown) if shown == int(shown) else shown), display_unit
+    return quantity, unit
+
+def normalize_bulk(quantities, units):
+    """Vectorised to_base for a whole pantry: returns (dimensions, base_quantities) lists.
+
+    Uses numpy when installed; unknown units come back as (None, nan).
+    """
+    lookup = {}
+    for unit in set(units):
+        canonical, multiplier = canonical_unit(unit)
+        if canonical:
+            dim, size = UNITS[canonical]
+            lookup[unit] = (dim, multiplier * size)
+        else:
+            lookup[unit] = (None, float("nan"))
+
+    dims = [lookup[u][0] for u in units]
+    if np is not None:
+        factors = np.fromiter((lookup[u][1] for u in units), dtype=float, count=len(units))
+        values = np.asarray(quantities, dtype=float) * factors
+        return dims, values.tolist()
+    return dims, [float(q) * lookup[u][1] for q, u in zip(quantities, units)]
+
+def group_totals(keys, dims, base_values):
+    """Sums base quantities per (key, dimension) group. Returns {(key, dim): total}."""
+    pairs = [(k, d) for k, d in zip(keys, dims)]
+    if np is not None and pairs:
+        labels = {pair: i for i, pair in enumerate(dict.fromkeys(pairs))}
+        codes = np.fromiter((labels[p] for p in pairs), dtype=int, count=len(pairs))
+        values = np.nan_to_num(np.asarray(base_values, dtype=float))
+        sums = np.bincount(codes, weights=values, minlength=len(labels))
+        return {pair: float(sums[i]) for pair, i in labels.items()}
+    totals = {}
+    for pair, value in zip(pairs, base_values):
+        totals[pair] = totals.get(pair, 0.0) + (value if value == value else 0.0)
+    return totals
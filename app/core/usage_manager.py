@@ -0,0 +1,138 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+# Serialises ledger appends and rollup rewrites across request threads
+_LEDGER_LOCK = threading.Lock()
+
+# "calls" and the token/char/unit totals cover successful calls only (they feed calibration);
+# failed calls are counted in "errors", with their latency and any cost still added.
+ROLLUP_FIELDS = ["calls", "in", "out", "cached", "cost", "ms", "chars", "units", "errors"]
+
+class UsageManager:
+    """Per-user LLM usage ledger.
+
+    Every call is appended as one compact JSON line to usage_ledger.jsonl, and
+    folded into usage_daily.json ({day: {model: {call_site: totals}}}) so
+    summaries never have to re-read the full ledger.
+    """
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.ledger_file = os.path.join(state_dir, 'usage_ledger.jsonl')
+        self.daily_file = os.path.join(state_dir, 'usage_daily.json')
+
+    def record(self, model_id, call_site, input_tokens=0, output_tokens=0, cached_tokens=0,
+               latency_ms=0, cost=0.0, prompt_chars=0, units=0, ok=True):
+        entry = {
+            "t": int(datetime.now().timestamp()),
+            "m": model_id,
+            "s": call_site,
+            "i": int(input_tokens or 0),
+            "o": int(output_tokens or 0),
+            "c": int(cached_tokens or 0),
+            "ms": int(latency_ms or 0),
+            "$": round(cost or 0.0, 6),
+            "ch": int(prompt_chars or 0),
+            "u": int(units or 0),
+        }
+        if not ok:
+            entry["err"] = 1
+
+        day = datetime.now().strftime("%Y-%m-%d")
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with _LEDGER_LOCK:
+                with open(self.ledger_file, 'a') as f:
+                    f.write(json.dumps(entry, separators=(',', ':')) + "\n")
+
+                daily = self.load_daily()
+                bucket = daily.setdefault(day, {}).setdefault(model_id, {}).setdefault(
+                    call_site, {k: 0 for k in ROLLUP_FIELDS})
+                if ok:
+                    bucket["calls"] += 1
+                    bucket["in"] += entry["i"]
+                    bucket["out"] += entry["o"]
+                    bucket["cached"] += entry["c"]
+                    bucket["chars"] += entry["ch"]
+                    bucket["units"] += entry["u"]
+                else:
+                    bucket["errors"] = bucket.get("errors", 0) + 1
+                bucket["cost"] = round(bucket["cost"] + entry["$"], 6)
+                bucket["ms"] += entry["ms"]
+                with open(self.daily_file, 'w') as f:
+                    json.dump(daily, f, separators=(',', ':'))
+        except Exception as e:
+            print(f"DEBUG: Error recording usage at {self.ledger_file}: {e}")
+
+    def load_daily(self):
+        if os.path.exists(self.daily_file):
+            try:
+                with open(self.daily_file, 'r') as f:
+                    data = json.load(f)
+                    if isinstance(data, dict):
+                        return data
+            except Exception as e:
+                print(f"DEBUG: Error loading usage rollup at {self.daily_file}: {e}")
+        return {}
+
+    def _buckets(self, days=None):
+        """Yields (day, model_id, call_site, totals) for the last `days` days (all if None)."""
+        cutoff = None
+        if days:
+            cutoff = (datetime.now() - timedelta(days=int(days) - 1)).strftime("%Y-%m-%d")
+        for day, models in self.load_daily().items():
+            if cutoff and day < cutoff:
+                continue
+            for model_id, sites in models.items():
+                for call_site, totals in sites.items():
+                    yield day, model_id, call_site, totals
+
+    def summarize(self, days=30):
+        """Totals plus breakdowns by model, call site and day."""
+        def empty():
+            return {k: 0 for k in ROLLUP_FIELDS}
+
+        def add(target, totals):
+            for k in ROLLUP_FIELDS:
+                target[k] += totals.get(k, 0)
+
+        summary = {"days": days, "totals": empty(), "by_model": {}, "by_call_site": {}, "by_day": {}}
+        for day, model_id, call_site, totals in self._buckets(days):
+            add(summary["totals"], totals)
+            add(summary["by_model"].setdefault(model_id, empty()), totals)
+            add(summary["by_call_site"].setdefault(call_site, empty()), totals)
+            add(summary["by_day"].setdefault(day, empty()), totals)
+
+        for group in [summary["by_model"], summary["by_call_site"], summary["by_day"]]:
+            for totals in group.values():
+                totals["cost"] = round(totals["cost"], 6)
+        summary["totals"]["cost"] = round(summary["totals"]["cost"], 6)
+        return summary
+
+    def calibration(self, model_id, call_site, days=90):
+        """Observed tokens-per-prompt-char and output-tokens-per-unit for a model and call site.
+
+        Falls back to every model's history for the call site when this model has none.
+        Failed calls aren't part of these totals (see ROLLUP_FIELDS).
+        Returns None when there is nothing to calibrate from.
+        """
+        for match_model in (True, False):
+            chars = in_tokens = out_tokens = units = calls = 0
+            for _, mid, site, totals in self._buckets(days):
+                if site != call_site or (match_model and mid != model_id):
+                    continue
+                calls += totals.get("calls", 0)
+                chars += totals.get("chars", 0)
+                in_tokens += totals.get("in", 0)
+                out_tokens += totals.get("out", 0)
+                units += totals.get("units", 0)
+            if calls and chars:
+                return {
+                    "samples": calls,
+                    "tokens_per_char": in_tokens / chars,
+                    "output_per_unit": (out_tokens / units) if units else None,
+                    "output_per_call": out_tokens / calls,
+                    "same_model": match_model,
+                }
+        return None
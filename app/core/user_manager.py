@@ -161,7 +161,7 @@ class UserManager:
             return False, "User data directory not found"
         
         # Keep essential config, wipe everything else
-        files_to_preserve = ['preferences.json', 'model_config.json']
+        files_to_preserve = ['preferences.json', 'model_config.json', 'usage_ledger.jsonl', 'usage_daily.json']
         
         for item in os.listdir(user_path):
             item_path = os.path.join(user_path, item)
@@ -0,0 +1,83 @@
+"""Offline end-to-end benchmark using the ReplayProvider.
+
+Runs plan generation, pantry parsing and grocery checks against recorded (or
+fabricated) responses, so it needs no network or API keys.
+
+    python3 app/scripts/bench_replay.py --runs 20 --concurrency 4 --latency lognormal:1200,0.4
+
+Point --replay-dir at a folder captured with ARBY_REPLAY_MODE=record to replay
+real responses; otherwise every call is a miss and gets schema-valid fake data.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Arby offline with recorded LLM responses.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", default="fixed:0", help="recorded | fixed:MS | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--replay-dir", default=None)
+    parser.add_argument("--base-dir", default=None, help="Arby base dir (defaults to a throwaway temp dir)")
+    parser.add_argument("--user-id", default="bench-user")
+    args = parser.parse_args()
+
+    base_dir = args.base_dir or tempfile.mkdtemp(prefix="arby-bench-")
+    os.environ["ARBY_REPLAY_MODE"] = "replay"
+    os.environ["ARBY_REPLAY_LATENCY"] = args.latency
+    if args.replay_dir:
+        os.environ["ARBY_REPLAY_DIR"] = args.replay_dir
+
+    from app.core.agent import ArbyAgent
+
+    # The built-in defaults point at retired model ids; pin ones the registry knows
+    setup = ArbyAgent(base_dir, user_id=args.user_id)
+    setup.model_manager.set_core_model("gemini-2.5-flash")
+    setup.model_manager.set_sous_chef_model("gemini-2.5-flash-lite")
+
+    def one_run(i):
+        agent = ArbyAgent(base_dir, user_id=args.user_id)
+        timings = {}
+
+        started = time.perf_counter()
+        draft = agent.generate_draft(duration=4)
+        timings["generate_draft"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        agent.inventory_manager.parse_and_add("2 lb chicken breast\n1 gallon milk\n3 yellow onions")
+        timings["parse_and_add"] = time.perf_counter() - started
+
+        if isinstance(draft, dict) and "error" not in draft:
+            started = time.perf_counter()
+            agent.recommend_grocery_checks(draft)
+            timings["recommend_grocery_checks"] = time.perf_counter() - started
+        return timings
+
+    results = {}
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+        for timings in pool.map(one_run, range(args.runs)):
+            for op, secs in timings.items():
+                results.setdefault(op, []).append(secs * 1000)
+    wall = time.perf_counter() - wall_start
+
+    print(f"Base dir: {base_dir}")
+    print(f"{args.runs} runs, concurrency {args.concurrency}, latency '{args.latency}', wall {wall:.2f}s")
+    print(f"{'operation':<28}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for op, values in results.items():
+        print(f"{op:<28}{len(values):>5}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}{max(values):>10.1f}")
+
+if __name__ == "__main__":
+    main()
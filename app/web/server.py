@@ -2,15 +2,15 @@ import os
 import json
 import sys
 from datetime import datetime, timedelta, date, time as dt_time
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, Response
 from functools import wraps
 from dotenv import load_dotenv
 import re
-import threading
 import schedule
 import schedule
 import time
 import subprocess
+import tempfile
 
 # CAPTURE ORIGINAL SYSTEM ENVIRONMENT before load_dotenv shadows it
 original_env = os.environ.copy()
@@ -20,10 +20,18 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'
 
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 
-from app.core.agent import ArbyAgent
-from app.core.inventory_manager import InventoryManager
+from app.core.agent import ArbyAgent, grocery_version
+from app.core.inventory_manager import InventoryManager, EXPIRING_SOON_DAYS
+from app.core.units import to_display
 from app.core.review_manager import ReviewManager
 from app.core.user_manager import UserManager, User
+from app.core.usage_manager import UsageManager
+from app.core.single_flight import SupersededError
+from app.core.job_queue import JobQueue, JobFailed, JobCancelled, TERMINAL_STATUSES
+from app.core.sync_state import SyncState, ACTIVE_STATUSES as SYNC_ACTIVE_STATUSES
+from app.core.library_watcher import LibraryWatcher
+from app.core.cookbook_manager import SyncInProgress
+from app.core.sync_manifest import SyncManifest
 
 load_dotenv()
 
@@ -141,13 +149,37 @@ def admin_dashboard():
     user_stats = []
     for u in users:
         usage = user_manager.get_user_storage_usage(u.id)
+        llm_usage = UsageManager(os.path.join(user_manager.users_dir, u.id)).summarize(days=30)['totals']
         user_stats.append({
             'user': u,
             'usage_mb': round(usage, 2),
-            'limit_mb': u.storage_limit_mb
+            'limit_mb': u.storage_limit_mb,
+            'llm_usage': llm_usage
         })
     return render_template('admin.html', user_stats=user_stats)
 
+@app.route('/admin/usage')
+@admin_required
+def admin_usage():
+    """Usage aggregated across all users, by user, model and call site."""
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        days = 30
+    fields = ["calls", "in", "out", "cached", "cost", "ms"]
+    report = {"days": days, "totals": {k: 0 for k in fields}, "by_user": {}, "by_model": {}, "by_call_site": {}}
+    for u in user_manager.load_users():
+        summary = UsageManager(os.path.join(user_manager.users_dir, u.id)).summarize(days=days)
+        report["by_user"][u.id] = {"name": u.name, **summary["totals"]}
+        for k in fields:
+            report["totals"][k] += summary["totals"][k]
+        for group in ["by_model", "by_call_site"]:
+            for key, totals in summary[group].items():
+                target = report[group].setdefault(key, {k: 0 for k in fields})
+                for k in fields:
+                    target[k] += totals[k]
+    return jsonify(report)
+
 @app.route('/admin/user/<user_id>/wipe', methods=['POST'])
 @admin_required
 def admin_wipe_user(user_id):
@@ -214,6 +246,12 @@ def pretty_date_filter(date_str):
     except Exception:
         return date_str
 
+@app.template_filter('qty')
+def qty_filter(item):
+    """Pantry quantity in a readable unit (1500 g -> 1.5 kg)."""
+    quantity, unit = to_display(item.get('quantity') or 0, item.get('unit') or '')
+    return f"{quantity} {unit}"
+
 @app.template_filter('day_name')
 def day_name_filter(date_str):
     if not date_str: return ""
@@ -727,9 +765,14 @@ def restore_models():
 @login_required
 def pantry_page():
     agent = get_agent()
-    # Sort by expiry if possible or just as is
     items = agent.inventory_manager.load_inventory()
-    return render_template('inventory.html', items=enumerate(items), user=current_user)
+    # Expiring-soon view comes from the expiry index, not a scan of every item
+    try:
+        soon_days = int(request.args.get('soon', EXPIRING_SOON_DAYS))
+    except ValueError:
+        soon_days = EXPIRING_SOON_DAYS
+    expiring = agent.inventory_manager.expiring_within(soon_days)
+    return render_template('inventory.html', items=items, expiring=expiring, soon_days=soon_days, user=current_user)
 
 @app.route('/pantry/add', methods=['POST'])
 @login_required
@@ -747,6 +790,24 @@ def add_inventory():
             flash(f"Error: {e}", "error")
     return redirect(url_for('pantry_page'))
     
+@app.route('/api/pantry/import', methods=['POST'])
+@login_required
+def import_inventory_stream():
+    """Bulk import that streams one JSON line per progress event (NDJSON)."""
+    agent = get_agent()
+    data = request.get_json(silent=True) or {}
+    raw_text = data.get('ingredients') or request.form.get('ingredients')
+    if not raw_text:
+        return jsonify({"status": "error", "message": "Nothing to import"}), 400
+
+    events = agent.inventory_manager.import_stream(raw_text)
+
+    def generate():
+        for event in events:
+            yield json.dumps(event) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={"X-Accel-Buffering": "no"})
+
 @app.route('/pantry/add_manual', methods=['POST'])
 @login_required
 def add_inventory_manual():
@@ -770,19 +831,30 @@ def add_inventory_manual():
         
     return redirect(url_for('pantry_page'))
 
-@app.route('/pantry/delete/<int:index>', methods=['POST'])
+@app.route('/pantry/consolidate', methods=['POST'])
 @login_required
-def delete_inventory(index):
+def consolidate_inventory():
     agent = get_agent()
-    if agent.inventory_manager.delete_item(index):
+    folded = agent.inventory_manager.consolidate()
+    if folded:
+        flash(f"Merged {folded} duplicate items.", "success")
+    else:
+        flash("No duplicates to merge.", "info")
+    return redirect(url_for('pantry_page'))
+
+@app.route('/pantry/delete/<item_id>', methods=['POST'])
+@login_required
+def delete_inventory(item_id):
+    agent = get_agent()
+    if agent.inventory_manager.delete_item(item_id):
         flash("Item removed from pantry.", "info")
     else:
         flash("Failed to remove item.", "error")
     return redirect(url_for('pantry_page'))
 
-@app.route('/pantry/edit/<int:index>', methods=['POST'])
+@app.route('/pantry/edit/<item_id>', methods=['POST'])
 @login_required
-def edit_inventory(index):
+def edit_inventory(item_id):
     agent = get_agent()
     data = {
         "item": request.form.get("item"),
@@ -794,22 +866,20 @@ def edit_inventory(index):
         "purchase_date": request.form.get("purchase_date"),
         "expiry_date": request.form.get("expiry_date"),
     }
-    if agent.inventory_manager.update_item(index, data):
+    if agent.inventory_manager.update_item(item_id, data):
         flash("Pantry item updated.", "success")
     else:
         flash("Failed to update item.", "error")
     return redirect(url_for('pantry_page'))
 
-@app.route('/pantry/increment/<int:index>', methods=['POST'])
+@app.route('/pantry/increment/<item_id>', methods=['POST'])
 @login_required
-def increment_inventory(index):
+def increment_inventory(item_id):
     agent = get_agent()
-    items = agent.inventory_manager.load_inventory()
-    if 0 <= index < len(items):
-        items[index]['quantity'] += 1
-        items[index]['updated_on'] = datetime.now().strftime("%Y-%m-%d")
-        agent.inventory_manager.save_inventory(items)
-        return jsonify({"status": "ok", "new_quantity": items[index]['quantity']})
+    new_quantity = agent.inventory_manager.increment_item(item_id)
+    if new_quantity is not None:
+        item = agent.inventory_manager.get_item(item_id)
+        return jsonify({"status": "ok", "new_quantity": new_quantity, "display": qty_filter(item)})
     return jsonify({"status": "error"}), 404
 
 @app.route('/history')
@@ -951,22 +1021,12 @@ def generate_plan():
     except Exception as e:
         print(f"Failed to save context: {e}")
 
-    try:
-        draft = agent.generate_draft(model_id=model_id, start_date=start_date, duration=duration)
-        if "error" in draft:
-            flash(f"Error: {draft['error']}", "error")
-            return redirect('/')
-            
-        # Save Draft to State
-        draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
-        with open(draft_path, 'w') as f:
-            json.dump(draft, f, indent=4)
-            
-        return redirect('/plan/review')
-    except Exception as e:
-        print(f"Error generating: {e}")
-        flash(f"Error generating plan: {str(e)}", "error")
-        return redirect('/')
+    job_id = job_queue.enqueue(current_user.id, "generate_draft", {
+        "model_id": model_id,
+        "start_date": start_date,
+        "duration": duration
+    })
+    return redirect(url_for('job_status_page', job_id=job_id))
 
 @app.route('/plan/review')
 @login_required
@@ -987,16 +1047,12 @@ def review_plan_page():
 def modify_plan():
     agent = get_agent()
     user_feedback = request.form.get('feedback')
-    model_id = request.form.get('model_id') # Optional override
     
     draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
     if not os.path.exists(draft_path):
         flash("No draft found to modify.", "error")
         return redirect('/')
         
-    with open(draft_path, 'r') as f:
-        current_draft = json.load(f)
-        
     if not user_feedback:
         flash("Please provide feedback.", "warning")
         return redirect('/plan/review')
@@ -1008,19 +1064,8 @@ def modify_plan():
     else:
         model_id = agent.model_manager.get_core_model_id()
 
-    # Execute Modification
-    new_draft = agent.modify_plan(current_draft, user_feedback, model_id=model_id)
-    
-    if "error" in new_draft:
-        flash(f"Modification failed: {new_draft['error']}", "error")
-        return redirect('/plan/review')
-        
-    # Save New Draft
-    with open(draft_path, 'w') as f:
-        json.dump(new_draft, f, indent=4)
-        
-    flash("Plan updated based on your feedback!", "success")
-    return redirect('/plan/review')
+    job_id = job_queue.enqueue(current_user.id, "modify_draft", {"feedback": user_feedback, "model_id": model_id})
+    return redirect(url_for('job_status_page', job_id=job_id))
 
 @app.route('/plan/active/modify', methods=['POST'])
 @login_required
@@ -1033,9 +1078,6 @@ def modify_active_plan():
         flash("No active plan found to modify.", "error")
         return redirect('/')
         
-    with open(active_path, 'r') as f:
-        current_plan = json.load(f)
-        
     if not user_feedback:
         flash("Please provide feedback.", "warning")
         return redirect('/plan/view')
@@ -1047,13 +1089,81 @@ def modify_active_plan():
     else:
         model_id = agent.model_manager.get_core_model_id()
 
+    job_id = job_queue.enqueue(current_user.id, "modify_active", {"feedback": user_feedback, "model_id": model_id})
+    return redirect(url_for('job_status_page', job_id=job_id))
+
+@app.route('/plan/confirm', methods=['POST'])
+@login_required
+def confirm_plan():
+    agent = get_agent()
+    draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
+    if not os.path.exists(draft_path):
+        return redirect('/')
+
+    job_id = job_queue.enqueue(current_user.id, "confirm_plan", {})
+    return redirect(url_for('job_status_page', job_id=job_id))
+
+# --- BACKGROUND JOBS ---
+# Long LLM operations run on the job queue's worker threads instead of a request
+# thread. Each handler returns where to send the user and what to tell them.
+
+def generate_draft_job(user_id, payload, ctx):
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    ctx.progress(10, "The Head Chef is planning your meals...")
+    try:
+        draft = agent.generate_draft(model_id=payload.get('model_id'), start_date=payload.get('start_date'), duration=payload.get('duration'))
+    except SupersededError:
+        raise JobFailed("A newer plan request replaced this one.")
+    if "error" in draft:
+        raise JobFailed(f"Error: {draft['error']}")
+    ctx.check_cancelled()
+
+    # Save Draft to State
+    draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
+    with open(draft_path, 'w') as f:
+        json.dump(draft, f, indent=4)
+    return {"redirect": "/plan/review", "message": "Your draft plan is ready!", "category": "success"}
+
+def modify_draft_job(user_id, payload, ctx):
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
+    if not os.path.exists(draft_path):
+        raise JobFailed("No draft found to modify.")
+    with open(draft_path, 'r') as f:
+        current_draft = json.load(f)
+
+    ctx.progress(10, "Applying your changes...")
+    try:
+        new_draft = agent.modify_plan(current_draft, payload['feedback'], model_id=payload.get('model_id'), target="draft")
+    except SupersededError:
+        raise JobFailed("A newer change request replaced this one.")
+    if "error" in new_draft:
+        raise JobFailed(f"Modification failed: {new_draft['error']}")
+    ctx.check_cancelled()
+
+    # Save New Draft
+    with open(draft_path, 'w') as f:
+        json.dump(new_draft, f, indent=4)
+    return {"redirect": "/plan/review", "message": "Plan updated based on your feedback!", "category": "success"}
+
+def modify_active_job(user_id, payload, ctx):
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    active_path = os.path.join(agent.user_state_dir, 'active_plan.json')
+    if not os.path.exists(active_path):
+        raise JobFailed("No active plan found to modify.")
+    with open(active_path, 'r') as f:
+        current_plan = json.load(f)
+
     # Execute Modification
     # We pass the current plan. The agent will return a NEW plan structure.
-    new_plan = agent.modify_plan(current_plan, user_feedback, model_id=model_id)
-    
+    ctx.progress(10, "Applying your changes...")
+    try:
+        new_plan = agent.modify_plan(current_plan, payload['feedback'], model_id=payload.get('model_id'), target="active")
+    except SupersededError:
+        raise JobFailed("A newer change request replaced this one.")
     if "error" in new_plan:
-        flash(f"Modification failed: {new_plan['error']}", "error")
-        return redirect('/plan/view')
+        raise JobFailed(f"Modification failed: {new_plan['error']}")
+    ctx.check_cancelled()
     
     # Preserve existing state
     if 'checked_groceries' in current_plan:
@@ -1062,8 +1172,9 @@ def modify_active_plan():
         new_plan['completed_meals'] = current_plan['completed_meals']
         
     # We might want to re-run pantry recommendations since ingredients changed
+    ctx.progress(70, "Checking your pantry...")
     try:
-        recommendations = agent.recommend_grocery_checks(new_plan)
+        recommendations = agent.recommend_grocery_checks(new_plan, local_only=True)
         new_plan['pantry_recommendations'] = recommendations
     except:
         pass
@@ -1071,6 +1182,7 @@ def modify_active_plan():
     # Save New Active Plan
     with open(active_path, 'w') as f:
         json.dump(new_plan, f, indent=4)
+    job_queue.enqueue(user_id, "pantry_check", {"plan": grocery_version(new_plan)})
         
     # UPDATE CALENDAR (Sync)
     try:
@@ -1089,26 +1201,24 @@ def modify_active_plan():
     except Exception as e:
         print(f"Failed to sync calendar after modify: {e}")
 
-    flash("Active plan updated!", "success")
-    return redirect('/plan/view')
+    return {"redirect": "/plan/view", "message": "Active plan updated!", "category": "success"}
 
-@app.route('/plan/confirm', methods=['POST'])
-@login_required
-def confirm_plan():
-    agent = get_agent()
+def confirm_plan_job(user_id, payload, ctx):
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
     draft_path = os.path.join(agent.user_state_dir, 'current_draft.json')
     if not os.path.exists(draft_path):
-        return redirect('/')
-        
+        raise JobFailed("No draft plan found. Please generate one first.")
     with open(draft_path, 'r') as f:
         draft = json.load(f)
     
     # Finalize
+    ctx.progress(20, "Saving to your calendar and sending the email...")
     agent.finalize_plan(draft)
     
-    # Auto-run Pantry Check
+    # Auto-run Pantry Check: local matches now, the uncertain rest in the background
+    ctx.progress(60, "Checking your pantry...")
     try:
-        recommendations = agent.recommend_grocery_checks(draft)
+        recommendations = agent.recommend_grocery_checks(draft, local_only=True)
         draft['pantry_recommendations'] = recommendations
     except Exception as e:
         print(f"Auto-pantry check failed: {e}")
@@ -1120,14 +1230,280 @@ def confirm_plan():
         
     # Remove Draft
     os.remove(draft_path)
+    job_queue.enqueue(user_id, "pantry_check", {"plan": grocery_version(draft)})
     
     # Clear Ideas/Cravings
     if os.path.exists(agent.ideas_file):
         with open(agent.ideas_file, 'w') as f:
             f.write("")
     
-    flash("Plan confirmed! Calendar updated and email sent.", "success")
-    return redirect('/plan/view')
+    return {"redirect": "/plan/view", "message": "Plan confirmed! Calendar updated and email sent.", "category": "success"}
+
+def pantry_check_job(user_id, payload, ctx):
+    """Asks the Sous Chef about the grocery items the local pantry check left open.
+
+    payload["plan"] is the grocery_version of the plan it was queued for; a check whose
+    plan has since been modified or replaced stops (the newer plan queued its own).
+    """
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    active_path = os.path.join(agent.user_state_dir, 'active_plan.json')
+    if not os.path.exists(active_path):
+        return {"added": 0}
+    with open(active_path, 'r') as f:
+        plan = json.load(f)
+    version = payload.get("plan")
+    if version and grocery_version(plan) != version:
+        return {"added": 0, "stale": True}
+    new_checks = agent.recommend_grocery_checks(plan)
+    ctx.check_cancelled()
+
+    # Re-read so toggles made while the Sous Chef was thinking aren't lost
+    with open(active_path, 'r') as f:
+        plan = json.load(f)
+    if version and grocery_version(plan) != version:
+        print(f"DEBUG: Dropping pantry check for {user_id}: the plan changed while it ran.")
+        return {"added": 0, "stale": True}
+    existing = plan.setdefault('pantry_recommendations', [])
+    added = [i for i in new_checks if i not in existing]
+    existing.extend(added)
+    with open(active_path, 'w') as f:
+        json.dump(plan, f, indent=4)
+    return {"added": len(added)}
+
+def library_sync_job(user_id, payload, ctx):
+    """Syncs the user's PDF library, recording progress in sync_state.json.
+
+    If the process dies mid-sync the queue hands this job out again and the
+    sync resumes: extracted recipes are already journalled, unchanged files are
+    skipped via the manifest, and files that failed are not retried. If the job
+    itself was lost with the jobs database (a new instance after a deploy),
+    resume_library_syncs() queues a fresh one that resumes the same way.
+    """
+    sync_state = get_user_sync_state(user_id)
+    resuming = sync_state.start(ctx.job_id)
+    if resuming:
+        print(f"DEBUG: Resuming library sync for {user_id} ({len(sync_state.data['completed'])} done, "
+              f"{len(sync_state.data['failed'])} failed so far).")
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+
+    try:
+        added_recipes = agent.sync_library(progress_callback=sync_state.progress, cancel_check=ctx.cancelled,
+                                           sync_state=sync_state)
+    except SupersededError:
+        sync_state.finish("cancelled", "Sync replaced by a newer sync.")
+        raise JobCancelled()
+    except Exception as e:
+        sync_state.finish("error", f"Error: {e}")
+        raise
+
+    if ctx.cancelled():
+        sync_state.finish("cancelled", "Sync Stopped.")
+        raise JobCancelled()
+    # Count recipes from before a restart too
+    added_recipes = list(sync_state.data["completed"].values()) or added_recipes or []
+    if added_recipes:
+        names_str = ", ".join(added_recipes)
+        if len(names_str) > 50:
+            names_str = names_str[:47] + "..."
+        message = f"Sync Complete! Added: {names_str}"
+    else:
+        message = "Sync Complete! No new recipes found."
+    if sync_state.data["failed"]:
+        message += f" ({len(sync_state.data['failed'])} failed)"
+    sync_state.finish("done", message, percent=100)
+    return {"added": len(added_recipes), "failed": len(sync_state.data["failed"])}
+
+def library_changes_job(user_id, payload, ctx):
+    """Ingests the PDFs the library watcher saw change and orphans recipes of deleted ones.
+
+    A full sync, queued or running, already covers the batch, so it is dropped rather than
+    left waiting on the cookbook's sync lock. If another batch holds the lock, this one is
+    queued again behind it.
+    """
+    if get_user_sync_status(user_id)["is_syncing"]:
+        return {"added": 0, "skipped": "full sync"}
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    try:
+        added = agent.sync_library_changes(payload.get("changed", []), payload.get("deleted", []),
+                                           cancel_check=ctx.cancelled) or []
+    except SyncInProgress:
+        if get_user_sync_status(user_id)["is_syncing"]:
+            return {"added": 0, "skipped": "full sync"}
+        # Our own job is still running, so dedupe would hand back its id
+        return {"added": 0, "deferred": job_queue.enqueue(user_id, "library_changes", payload, dedupe=False)}
+    ctx.check_cancelled()
+    return {"added": len(added)}
+
+def duplicate_report_job(user_id, payload, ctx):
+    """Clusters near-duplicate recipes; the page reads the groups (as recipe ids) from the result."""
+    agent = ArbyAgent(base_dir, user_id=user_id, original_env=original_env)
+    groups = agent.cookbook_manager.duplicate_report()
+    ctx.check_cancelled()
+    return {"redirect": f"/library/duplicates?job={ctx.job_id}",
+            "groups": [{"ids": [r['id'] for r in group["recipes"]], "score": group["score"]} for group in groups]}
+
+# Where to send the user when a job fails or is cancelled
+JOB_FALLBACK_REDIRECTS = {
+    "generate_draft": "/",
+    "modify_draft": "/plan/review",
+    "modify_active": "/plan/view",
+    "confirm_plan": "/plan/review",
+    "pantry_check": "/plan/grocery",
+    "library_sync": "/library",
+    "library_changes": "/library",
+    "duplicate_report": "/library",
+}
+
+JOB_TITLES = {
+    "generate_draft": "Cooking up your plan",
+    "modify_draft": "Updating your draft",
+    "modify_active": "Updating your plan",
+    "confirm_plan": "Confirming your plan",
+    "pantry_check": "Checking your pantry",
+    "library_sync": "Syncing your library",
+    "library_changes": "Adding new PDFs",
+    "duplicate_report": "Looking for duplicate recipes",
+}
+
+# On local disk by default: state/ is a gcsfuse mount in production, where SQLite locking doesn't work
+JOBS_DB = os.environ.get("ARBY_JOBS_DB") or os.path.join(tempfile.gettempdir(), 'arby', 'jobs.db')
+# Library syncs run in their own lane, so hours of PDF extraction never block plan jobs
+job_queue = JobQueue(JOBS_DB, workers=int(os.environ.get("ARBY_JOB_WORKERS", 2)),
+                     lane_workers={"library": int(os.environ.get("ARBY_LIBRARY_JOB_WORKERS", 1))})
+job_queue.register("generate_draft", generate_draft_job)
+job_queue.register("modify_draft", modify_draft_job)
+job_queue.register("modify_active", modify_active_job)
+job_queue.register("confirm_plan", confirm_plan_job)
+job_queue.register("pantry_check", pantry_check_job)
+job_queue.register("duplicate_report", duplicate_report_job)
+job_queue.register("library_sync", library_sync_job, lane="library")
+job_queue.register("library_changes", library_changes_job, lane="library")
+
+# --- LIBRARY WATCHER (optional) ---
+# ARBY_WATCH_LIBRARY=1 (inotify, polling fallback) or =poll (e.g. GCS/network mounts).
+# Only one process watches, so gunicorn workers don't queue the same batch several times.
+LIBRARY_WATCH_MODE = os.environ.get("ARBY_WATCH_LIBRARY", "").lower()
+LIBRARY_WATCHERS = {}  # library path -> LibraryWatcher
+
+def library_users(library_path):
+    """(user, CookbookManager) for every user whose library is this folder."""
+    for user in user_manager.load_users():
+        cookbook_manager = CookbookManager(os.path.join(base_dir, 'state', 'users', user.id), config={})
+        if cookbook_manager.library_path == library_path:
+            yield user, cookbook_manager
+
+def queue_library_changes(library_path):
+    """Watcher callback: queues an incremental (or, after lost events, full) sync for every user of the folder."""
+    def handle(changed, deleted, rescan):
+        for user, _ in library_users(library_path):
+            if rescan:
+                if not get_user_sync_status(user.id)["is_syncing"]:
+                    get_user_sync_state(user.id).mark_queued(job_queue.enqueue(user.id, "library_sync", {}))
+            elif not get_user_sync_status(user.id)["is_syncing"]:  # a full sync will pick these up
+                job_queue.enqueue(user.id, "library_changes", {"changed": sorted(changed), "deleted": sorted(deleted)})
+    return handle
+
+def reconcile_library(library_path):
+    """Watcher start-up hook: queues what changed in the folder while no process was watching it.
+
+    Compares the watcher's first snapshot with each user's sync manifest (what the last
+    sync saw), so PDFs added, edited or deleted while the service was down or scaled to
+    zero are still picked up.
+    """
+    def handle(files):
+        for user, cookbook_manager in library_users(library_path):
+            synced = SyncManifest(cookbook_manager.state_dir).files
+            # Never synced: the first sync is started by hand. Syncing: it covers these files.
+            if not synced or get_user_sync_status(user.id)["is_syncing"]:
+                continue
+            changed = [relpath for relpath, sig in files.items() if relpath not in synced
+                       or (synced[relpath].get('size'), synced[relpath].get('mtime_ns')) != sig]
+            deleted = [relpath for relpath in synced if relpath not in files]
+            if changed or deleted:
+                print(f"DEBUG: {len(changed)} PDF(s) changed and {len(deleted)} removed in {library_path} "
+                      f"since {user.id}'s last sync.")
+                job_queue.enqueue(user.id, "library_changes", {"changed": sorted(changed), "deleted": sorted(deleted)})
+    return handle
+
+def start_library_watchers():
+    if LIBRARY_WATCH_MODE in ("", "0", "off", "false"):
+        return
+    import fcntl
+    lock_file = open(os.path.join(base_dir, 'state', 'library_watch.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print("DEBUG: Another process is watching the libraries.")
+        return
+    app.config['LIBRARY_WATCH_LOCK'] = lock_file  # held for the life of the process
+    for user in user_manager.load_users():
+        library_path = CookbookManager(os.path.join(base_dir, 'state', 'users', user.id), config={}).library_path
+        if library_path in LIBRARY_WATCHERS or not os.path.isdir(library_path):
+            continue
+        LIBRARY_WATCHERS[library_path] = LibraryWatcher(
+            library_path, queue_library_changes(library_path), mode=LIBRARY_WATCH_MODE,
+            on_ready=reconcile_library(library_path)).start()
+        print(f"DEBUG: Watching {library_path} for new recipe PDFs.")
+
+def get_user_job(job_id):
+    job = job_queue.get(job_id)
+    if not job or job['user_id'] != current_user.id:
+        return None
+    return job
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status_page(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        flash("That task no longer exists.", "error")
+        return redirect('/')
+    return render_template('job_status.html', job=job, title=JOB_TITLES.get(job['kind'], "Working"), user=current_user)
+
+@app.route('/jobs/<job_id>/done')
+@login_required
+def job_done(job_id):
+    """Turns a finished job into a flash message + redirect, like the old inline routes did."""
+    job = get_user_job(job_id)
+    if not job:
+        return redirect('/')
+    fallback = JOB_FALLBACK_REDIRECTS.get(job['kind'], '/')
+    if job['status'] == 'done':
+        result = job['result'] or {}
+        if result.get('message'):
+            flash(result['message'], result.get('category', 'success'))
+        return redirect(result.get('redirect') or fallback)
+    if job['status'] == 'failed':
+        flash(job['message'] or "Something went wrong.", "error")
+        return redirect(fallback)
+    if job['status'] == 'cancelled':
+        flash("Cancelled.", "info")
+        return redirect(fallback)
+    return redirect(url_for('job_status_page', job_id=job_id))
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def job_status_api(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({
+        "id": job['id'],
+        "kind": job['kind'],
+        "status": job['status'],
+        "progress": job['progress'],
+        "message": job['message'],
+        "done_url": url_for('job_done', job_id=job['id'])
+    })
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    job = job_queue.cancel(job_id)
+    return jsonify({"status": job['status'], "cancel_requested": job['cancel_requested']})
 
 @app.route('/plan/view')
 @login_required
@@ -1295,11 +1671,22 @@ def toggle_cooking_meal():
         current_state = plan['completed_meals'].get(meal_id, False)
         new_state = not current_state
         plan['completed_meals'][meal_id] = new_state
+
+        # Marking a meal cooked takes its ingredients off the pantry, once per meal
+        pantry_report = None
+        consumed = plan.setdefault('consumed_meals', {})
+        if new_state and data.get('consume') and meal_id not in consumed:
+            date_str, meal_type = meal_id.rsplit('-', 1)
+            day = next((d for d in plan.get('days', []) if d.get('date') == date_str), None)
+            meal = day.get(meal_type) if day else None
+            if meal:
+                pantry_report = agent.inventory_manager.consume_lines(meal.get('ingredients', []))
+                consumed[meal_id] = pantry_report
             
         with open(active_path, 'w') as f:
             json.dump(plan, f, indent=4)
             
-        return jsonify({"status": "ok", "completed": new_state})
+        return jsonify({"status": "ok", "completed": new_state, "pantry": pantry_report})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -1314,22 +1701,9 @@ def run_pantry_check():
     try:
         with open(active_path, 'r') as f:
             plan = json.load(f)
-            
-        new_checks = agent.recommend_grocery_checks(plan)
-        
-        # Merge with existing
-        if 'pantry_recommendations' not in plan:
-            plan['pantry_recommendations'] = []
-            
-        # Add new ones if unique
-        for item_id in new_checks:
-            if item_id not in plan['pantry_recommendations']:
-                plan['pantry_recommendations'].append(item_id)
-                
-        with open(active_path, 'w') as f:
-            json.dump(plan, f, indent=4)
-            
-        return jsonify({"status": "ok", "recommended_checks": plan['pantry_recommendations']})
+        # The Sous Chef call runs in the background, like the check queued on confirm
+        job_id = job_queue.enqueue(current_user.id, "pantry_check", {"plan": grocery_version(plan)})
+        return jsonify({"status": "started", "job_id": job_id})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -1450,87 +1824,41 @@ def ideas_page():
 def library_page():
     agent = get_agent()
     from app.core.cookbook_manager import CATEGORIES, PROTEINS
-    recipes = agent.cookbook_manager.load_recipes()
-    
-    # Filter/Search logic
-    query = request.args.get('q')
-    category_filter = request.args.get('category')
-    protein_filter = request.args.get('protein')
-
-    if query:
-        query = query.lower()
-        recipes = [r for r in recipes if query in r['name'].lower() or query in str(r.get('ingredients')).lower()]
     
-    if category_filter:
-        recipes = [r for r in recipes if r.get('category') == category_filter]
-
-    if protein_filter:
-        recipes = [r for r in recipes if r.get('protein') == protein_filter]
+    # Filter/Search logic (served from the cookbook's inverted index)
+    try:
+        min_rating = int(request.args.get('rating') or 0)
+    except ValueError:
+        min_rating = 0
+    recipes = agent.cookbook_manager.search_recipes(
+        request.args.get('q'),
+        category=request.args.get('category'),
+        protein=request.args.get('protein'),
+        min_rating=min_rating
+    )
         
     return render_template('cookbook.html', recipes=recipes, categories=CATEGORIES, proteins=PROTEINS, user=current_user)
 
 # --- SYNC STATUS (Multi-User) ---
-# Dict: user_id -> sync_status_dict
-USER_SYNC_STATS = {}
+# Progress lives in each user's sync_state.json (written by the library_sync job), so every
+# worker process reports the same thing and it survives restarts.
 
-def get_user_sync_status(user_id):
-    if user_id not in USER_SYNC_STATS:
-        USER_SYNC_STATS[user_id] = {
-            "is_syncing": False,
-            "current": 0,
-            "total": 0,
-            "message": "Idle",
-            "percent": 0,
-            "cancel_requested": False
-        }
-    return USER_SYNC_STATS[user_id]
+def get_user_sync_state(user_id):
+    return SyncState(os.path.join(base_dir, 'state', 'users', user_id))
 
-def run_sync_job(user_id):
-    status = get_user_sync_status(user_id)
-    status["is_syncing"] = True
-    status["cancel_requested"] = False
-    status["message"] = "Starting sync..."
-    
-    # We need a fresh agent for the thread
-    from app.core.agent import ArbyAgent
-    thread_agent = ArbyAgent(base_dir, user_id=user_id)
-    
-    def callback(curr, total, msg):
-        status["current"] = curr
-        status["total"] = total
-        status["message"] = msg
-        if total > 0:
-            status["percent"] = int((curr / total) * 100)
-        else:
-            status["percent"] = 0
-
-    def check_cancel():
-        return status.get("cancel_requested", False)
-
-    try:
-        librarian_id = thread_agent.model_manager.get_librarian_model_id()
-        added_recipes = thread_agent.cookbook_manager.sync_library(progress_callback=callback, model_id=librarian_id, cancel_check=check_cancel)
-        
-        if status.get("cancel_requested"):
-             status["message"] = "Sync Stopped."
-        else:
-             if added_recipes:
-                  names_str = ", ".join(added_recipes)
-                  if len(names_str) > 50:
-                      names_str = names_str[:47] + "..."
-                  status["message"] = f"Sync Complete! Added: {names_str}"
-             else:
-                  status["message"] = "Sync Complete! No new recipes found."
-             status["percent"] = 100
-             
-    except Exception as e:
-        status["message"] = f"Error: {e}"
-        import traceback
-        traceback.print_exc()
-    finally:
-        time.sleep(1) # Let UI see message
-        status["is_syncing"] = False
-        status["cancel_requested"] = False
+def get_user_sync_status(user_id):
+    sync_state = get_user_sync_state(user_id)
+    status = sync_state.snapshot()
+    job = job_queue.get(status["job_id"]) if status.get("job_id") else None
+    if status["status"] in SYNC_ACTIVE_STATUSES and (not job or job["status"] in TERMINAL_STATUSES):
+        # The job ended without recording it (e.g. its process died and the job was pruned)
+        sync_state.finish("interrupted", "Sync was interrupted.")
+        status = sync_state.snapshot()
+    status["is_syncing"] = status["status"] in SYNC_ACTIVE_STATUSES
+    status["cancel_requested"] = bool(job and job["cancel_requested"])
+    status["completed_count"] = len(status["completed"])
+    status["failed_count"] = len(status["failed"])
+    return status
 
 @app.route('/library/sync', methods=['POST'])
 @login_required
@@ -1538,16 +1866,20 @@ def sync_cookbook():
     status = get_user_sync_status(current_user.id)
     if status["is_syncing"]:
         return jsonify({"status": "already_running"}), 200
-        
-    threading.Thread(target=run_sync_job, args=(current_user.id,)).start()
-    return jsonify({"status": "started"}), 200
+
+    job_id = job_queue.enqueue(current_user.id, "library_sync", {})
+    get_user_sync_state(current_user.id).mark_queued(job_id)
+    return jsonify({"status": "started", "job_id": job_id}), 200
 
 @app.route('/library/sync/cancel', methods=['POST'])
 @login_required
 def cancel_sync():
     status = get_user_sync_status(current_user.id)
     if status["is_syncing"]:
-        status["cancel_requested"] = True
+        job = job_queue.cancel(status["job_id"])
+        if job and job["status"] == "cancelled":
+            # Never started, so no handler will record the stop
+            get_user_sync_state(current_user.id).finish("cancelled", "Sync Stopped.")
         return jsonify({"status": "cancel_requested"}), 200
     return jsonify({"status": "not_running"}), 200
 
@@ -1579,8 +1911,11 @@ def add_recipe():
             "instructions": request.form.get('instructions').split('\n'),
             "source": request.form.get('source', 'user')
         }
-        agent.cookbook_manager.add_recipe(recipe_data)
-        flash("Recipe added!", "success")
+        recipe = agent.cookbook_manager.add_recipe(recipe_data)
+        if recipe.duplicate_of:
+            flash("Recipe added! It looks like one you already have; see Duplicates to merge them.", "success")
+        else:
+            flash("Recipe added!", "success")
         return redirect('/library')
     return render_template('recipe_form.html', categories=CATEGORIES, proteins=PROTEINS, user=current_user)
 
@@ -1629,6 +1964,36 @@ def view_ignored_files():
     blacklist = agent.cookbook_manager.load_blacklist()
     return render_template('ignored_files.html', blacklist=blacklist, user=current_user)
 
+@app.route('/library/duplicates')
+@login_required
+def view_duplicates():
+    """Shows a finished duplicate_report job (?job=), queueing a new report when there isn't one."""
+    job = get_user_job(request.args['job']) if request.args.get('job') else None
+    if not job or job['kind'] != "duplicate_report" or job['status'] in ("failed", "cancelled"):
+        job = job_queue.get(job_queue.enqueue(current_user.id, "duplicate_report", {}))
+    if job['status'] != "done":
+        return redirect(url_for('job_status_page', job_id=job['id']))
+    # Recipes merged or deleted since the report ran drop out of their group
+    recipes = {r['id']: r for r in get_agent().cookbook_manager.load_recipes()}
+    groups = []
+    for group in (job['result'] or {}).get("groups", []):
+        members = [recipes[i] for i in group["ids"] if i in recipes]
+        if len(members) > 1:
+            groups.append({"recipes": members, "score": group["score"]})
+    return render_template('duplicates.html', groups=groups, user=current_user)
+
+@app.route('/library/duplicates/merge', methods=['POST'])
+@login_required
+def merge_duplicates():
+    agent = get_agent()
+    keep_id = request.form.get('keep')
+    drop_ids = [i for i in request.form.getlist('ids') if i != keep_id]
+    if keep_id and drop_ids and agent.cookbook_manager.merge_duplicates(keep_id, drop_ids):
+        flash(f"Merged {len(drop_ids)} duplicate(s).", "success")
+    else:
+        flash("Error merging duplicates.", "error")
+    return redirect(request.referrer or '/library/duplicates')
+
 @app.route('/library/restore/<path:filename>', methods=['POST'])
 @login_required
 def restore_file(filename):
@@ -1647,7 +2012,43 @@ def view_recipe(recipe_id):
     if not recipe:
         flash("Recipe not found", "error")
         return redirect('/library')
-    return render_template('recipe_detail.html', recipe=recipe, user=current_user)
+    similar = agent.cookbook_manager.similar_recipes(recipe_id, limit=5)
+    return render_template('recipe_detail.html', recipe=recipe, similar=similar, user=current_user)
+
+@app.route('/api/library/similar/<recipe_id>')
+@login_required
+def similar_recipes_api(recipe_id):
+    """Recipes most like the given one (local vector index, no model call)."""
+    from app.core.recipe_vectors import available
+    if not available():
+        return jsonify({"status": "error", "message": "Similar recipes need numpy installed"}), 501
+    agent = get_agent()
+    limit = min(request.args.get('limit', 5, type=int), 50)
+    matches = agent.cookbook_manager.similar_recipes(recipe_id, limit=limit)
+    return jsonify({"status": "ok", "results": [
+        {"id": r['id'], "name": r['name'], "category": r.get('category'), "similarity": r['similarity']} for r in matches]})
+
+@app.route('/api/library/similar')
+@login_required
+def recipes_like_api():
+    """Recipes most like free text (?q=), or like each line of the user's ideas.txt when q is empty."""
+    from app.core.recipe_vectors import available
+    if not available():
+        return jsonify({"status": "error", "message": "Similar recipes need numpy installed"}), 501
+    agent = get_agent()
+    limit = min(request.args.get('limit', 5, type=int), 50)
+    queries = [request.args.get('q', '').strip()]
+    if not queries[0]:
+        queries = []
+        if os.path.exists(agent.ideas_file):
+            with open(agent.ideas_file, 'r') as f:
+                queries = [line.strip() for line in f if line.strip()]
+    results = []
+    for query in queries:
+        matches = agent.cookbook_manager.recipes_like(query, limit=limit)
+        results.append({"query": query, "results": [
+            {"id": r['id'], "name": r['name'], "category": r.get('category'), "similarity": r['similarity']} for r in matches]})
+    return jsonify({"status": "ok", "queries": results})
 
 @app.route('/library/find')
 @login_required
@@ -1744,7 +2145,9 @@ def save_from_plan_api():
             "protein": data.get('protein', 'Vegetarian'),
             "source": "chef"
         }
-        recipe = agent.cookbook_manager.add_recipe(recipe_data)
+        recipe = agent.cookbook_manager.add_recipe(recipe_data, on_duplicate="flag")
+        if recipe.duplicate_of:
+            return jsonify({"status": "ok", "message": f"Saved {recipe.name} to cookbook! It looks like a recipe you already have, so it's marked as a possible duplicate.", "id": recipe.id, "duplicate": True})
         return jsonify({"status": "ok", "message": f"Saved {recipe.name} to cookbook!", "id": recipe.id})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1792,8 +2195,11 @@ def save_from_plan_form():
             "protein": request.form.get('protein', 'Vegetarian'),
             "source": "chef"
         }
-        agent.cookbook_manager.add_recipe(recipe_data)
-        flash(f"Saved {name} to your Cookbook!", "success")
+        recipe = agent.cookbook_manager.add_recipe(recipe_data, on_duplicate="flag")
+        if recipe.duplicate_of:
+            flash(f"Saved {name} to your Cookbook. It looks like a recipe you already have, so it's marked as a possible duplicate.", "info")
+        else:
+            flash(f"Saved {name} to your Cookbook!", "success")
     except Exception as e:
         flash(f"Error saving recipe: {str(e)}", "error")
         
@@ -1859,52 +2265,30 @@ def estimate_cost_endpoint():
         sys_p, user_p = agent.construct_prompt(start_date=start_date, duration=duration)
         full_text = sys_p + "\n" + user_p
         
-        # 2. Count Tokens (Approx)
-        char_count = len(full_text)
-        est_input_tokens = char_count / 4
-        
-        # If PDFs exist, add a buffer? 
-        # Checking PDF folder
-        if os.path.exists(agent.pdf_folder):
-             # Hard to guess valid token count of PDFs without reading them.
-             # Let's add a fixed buffer if PDFs are present
-             num_pdfs = len([f for f in os.listdir(agent.pdf_folder) if f.endswith('.pdf')])
-             if num_pdfs > 0:
-                 est_input_tokens += (num_pdfs * 5000) # Assuming 5k tokens per PDF? Conservative.
-                 
-        # Dynamic Output Tokens
-        # Base overhead + (tokens per meal * num_meals)
-        # 1. Determine Start Date
-        if start_date:
-            if isinstance(start_date, str):
-                 start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-        else:
-             today = datetime.now()
-             start_date_obj = today + timedelta(days=1)
-             
-        # 2. Determine Duration
+        # 2. Count Active Slots
         try:
             days_to_plan = int(duration) if duration else 4
         except:
             days_to_plan = 4
-            
-        # 3. Count Active Slots
-        config = agent.calendar_manager.load_config()
-        total_meal_slots = 0
-        
-        for i in range(days_to_plan):
-            d = start_date_obj + timedelta(days=i)
-            day_name = d.strftime("%A")
-            day_sched = config['schedule'].get(day_name, {})
-            # day_sched is {"breakfast": True, "lunch": False, ...}
-            total_meal_slots += sum(1 for active in day_sched.values() if active)
-            
-        # Assuming ~500 output tokens per meal recipe + 500 overhead
-        est_output_tokens = 500 + (total_meal_slots * 500)
+        slots = agent.get_planning_slots(start_date=start_date, duration=days_to_plan)
+        total_meal_slots = sum(len(meals) for _, _, meals in slots)
+
+        # 3. Estimate Tokens - calibrated from this user's recorded plan calls when we have them
+        char_count = len(full_text)
+        calibration = agent.model_manager.usage_manager.calibration(model_id, "plan")
+        if calibration:
+            est_input_tokens = char_count * calibration['tokens_per_char']
+            per_slot = calibration['output_per_unit'] or calibration['output_per_call'] / max(total_meal_slots, 1)
+            est_output_tokens = int(per_slot * total_meal_slots)
+            basis = f"calibrated from {calibration['samples']} past plans"
+        else:
+            # Approximation: ~4 chars per token, ~500 output tokens per meal recipe + 500 overhead
+            est_input_tokens = char_count / 4
+            est_output_tokens = 500 + (total_meal_slots * 500)
+            basis = "approximate"
         
-        # 3. Calculate Cost
-        all_models = agent.model_manager.get_available_models()
-        model_conf = next((m for m in all_models if m['id'] == model_id), {})
+        # 4. Calculate Cost
+        model_conf = agent.model_manager.get_model(model_id) or {}
         
         cost_in_rate = model_conf.get('cost_in', 0.0)
         cost_out_rate = model_conf.get('cost_out', 0.0)
@@ -1914,11 +2298,23 @@ def estimate_cost_endpoint():
         return jsonify({
             "estimated_cost": cost,
             "currency": "$",
-            "details": f"{int(est_input_tokens)} in / {est_output_tokens} out"
+            "details": f"{int(est_input_tokens)} in / {est_output_tokens} out",
+            "basis": basis
         })
     except Exception as e:
          return jsonify({"error": str(e)}), 500
 
+@app.route('/api/usage')
+@login_required
+def usage_endpoint():
+    """Recorded token usage and cost for the current user."""
+    agent = get_agent()
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        days = 30
+    return jsonify(agent.model_manager.usage_manager.summarize(days=days))
+
 @app.route('/api/test_model', methods=['POST'])
 @login_required
 def test_model_endpoint():
@@ -2360,5 +2756,29 @@ def handle_ideas():
             ideas = f.read()
     return jsonify({"ideas": ideas})
 
+def resume_library_syncs():
+    """Re-queues syncs whose job vanished with the jobs database (local disk, wiped by a deploy or new instance)."""
+    for user in user_manager.load_users():
+        sync_state = get_user_sync_state(user.id)
+        old_job_id = sync_state.data.get("job_id")
+        if sync_state.data["status"] not in SYNC_ACTIVE_STATUSES or not old_job_id or job_queue.get(old_job_id):
+            continue
+        # Keyed by the lost job, so several starting processes queue it only once
+        sync_state.requeue(job_queue.enqueue(user.id, "library_sync", {"resume": old_job_id}))
+        print(f"DEBUG: Re-queued the interrupted library sync for {user.id} "
+              f"({len(sync_state.data['completed'])} done so far).")
+
+def start_background_services():
+    """Starts the job workers and library watchers in the process that serves requests."""
+    resume_library_syncs()
+    job_queue.start()
+    start_library_watchers()
+
 if __name__ == "__main__":
+    # The debug reloader's parent only watches files and restarts its child (WERKZEUG_RUN_MAIN);
+    # workers started there would keep running pre-edit handlers against the same jobs database.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
     app.run(host='0.0.0.0', port=5005, debug=True)
+else:
+    start_background_services()